@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from functions.call_function import WORKING_DIRECTORY
+from functions.dispatch import dispatch_function_calls
+from functions.file_cache import FileCache
+from governor import Governor, answer_contents, final_config, final_prompt
+from history import DEFAULT_CHARS_PER_TOKEN, content_chars
+from main import (
+    MAX_ITERATIONS,
+    MODEL,
+    answer_text,
+    build_config,
+    function_response_part,
+    get_client,
+    usage_tokens,
+)
+from scheduler import RequestScheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run many prompts from a JSONL file concurrently")
+    parser.add_argument("prompts_file", type=str,
+                        help="JSONL file with one prompt object (or string) per line")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write results here instead of stdout")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Maximum number of sessions running at once")
+    parser.add_argument("--prompt-key", type=str, default="prompt",
+                        help="Key holding the prompt in each input object")
+    parser.add_argument("--id-key", type=str, default="id",
+                        help="Key holding the prompt id (defaults to the line number)")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Run the function calls of one turn concurrently")
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="Keep model requests from all sessions under this many per minute")
+    parser.add_argument("--tpm", type=int, default=None,
+                        help="Keep model tokens from all sessions under this many per minute")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="Retry rate-limited or failed model requests this many times")
+    parser.add_argument("--result-budget", type=int, default=8000,
+                        help="Shape each turn's tool results to fit about this many tokens in total (0 for no limit)")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Ask a session for its final answer once it has taken this many seconds")
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="Ask a session for its final answer once it has used this many tokens")
+    parser.add_argument("--max-tool-seconds", type=float, default=None,
+                        help="Ask a session for its final answer once its tools have run for this many seconds")
+    parser.add_argument("--max-stalled-turns", type=int, default=3,
+                        help="Ask for a final answer after this many turns of only repeated or failed calls (0 to never)")
+    parser.add_argument("--no-dedupe", dest="dedupe", action="store_false",
+                        help="Run repeated identical tool calls again instead of reusing their results")
+    args = parser.parse_args()
+
+    client = get_client()
+    governor = Governor(
+        max_seconds=args.max_seconds,
+        max_tokens=args.max_tokens,
+        max_tool_seconds=args.max_tool_seconds,
+        max_stalled_turns=args.max_stalled_turns,
+        dedupe=args.dedupe,
+    )
+    output = sys.stdout if args.output is None else open(
+        args.output, "w", encoding="utf-8")
+    try:
+        with open(args.prompts_file, encoding="utf-8") as prompts:
+            asyncio.run(run_batch(
+                client, prompts, output,
+                concurrency=args.concurrency,
+                prompt_key=args.prompt_key,
+                id_key=args.id_key,
+                parallel=args.parallel,
+                scheduler=RequestScheduler(
+                    rpm=args.rpm, tpm=args.tpm, max_retries=args.max_retries),
+                result_budget=(int(args.result_budget * DEFAULT_CHARS_PER_TOKEN)
+                               if args.result_budget else None),
+                governor=governor,
+            ))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        print(governor.summary(), file=sys.stderr)
+
+
+async def run_batch(client, lines, output, concurrency=8, prompt_key="prompt",
+                    id_key="id", parallel=False,
+                    working_directory=WORKING_DIRECTORY, scheduler=None,
+                    result_budget=None, governor=None):
+    """Run one agent session per JSONL line, at most ``concurrency`` at once.
+
+    Each result is written to ``output`` as a JSON line as soon as its
+    session finishes, so results arrive in completion order; use the
+    ``id`` field to match them up with the input. All sessions share
+    ``scheduler``, an optional RequestScheduler, so together they stay
+    within one set of rate limits, and ``governor``, an optional Governor,
+    which applies its limits to each session and counts how they ended.
+    """
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            prompt_id, prompt = item
+            try:
+                result = await run_session(
+                    client, prompt, parallel=parallel,
+                    working_directory=working_directory, scheduler=scheduler,
+                    result_budget=result_budget, governor=governor)
+            except Exception as e:
+                result = {"text": None, "error": f"{type(e).__name__}: {e}"}
+            output.write(json.dumps({"id": prompt_id, **result}) + "\n")
+            output.flush()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                prompt_id, prompt = line_number, record
+            else:
+                prompt_id = record.get(id_key, line_number)
+                prompt = record[prompt_key]
+            await queue.put((prompt_id, prompt))
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+
+async def run_session(client, prompt, parallel=False,
+                      working_directory=WORKING_DIRECTORY, scheduler=None,
+                      result_budget=None, messages=None, file_cache=None,
+                      on_event=None, governor=None):
+    """Async counterpart of main.run_agent for a single prompt.
+
+    Model calls go through the async client surface; tool calls run in a
+    worker thread so they don't block the other sessions on the loop.
+    Returns a dict with the final text, iteration count, token usage and
+    the number of file reads the session's FileCache saved.
+
+    To continue a conversation, pass its ``messages`` (extended in place)
+    and ``file_cache``. ``on_event`` is an optional coroutine function
+    awaited with a dict after every model response ("model") and tool
+    call ("tool"), for callers that report progress as it happens.
+    With a ``governor`` (see main.run_agent) the result also has the
+    ``stop_reason`` the session ended with.
+    """
+    from google.genai import types
+
+    if messages is None:
+        messages = []
+    messages.append(types.Content(role="user", parts=[types.Part(text=prompt)]))
+    if file_cache is None:
+        file_cache = FileCache()
+    config = build_config()
+    run = governor.start() if governor is not None else None
+    try:
+        return await _session_loop(
+            client, messages, config, parallel, working_directory, scheduler,
+            result_budget, file_cache, on_event, run)
+    except Exception:
+        if run is not None:
+            run.finish("error")
+        raise
+
+
+async def _session_loop(client, messages, config, parallel, working_directory,
+                        scheduler, result_budget, file_cache, on_event, run):
+    from google.genai import types
+
+    total_prompt_tokens = 0
+    total_response_tokens = 0
+    memo = run.memo if run is not None else None
+
+    for iteration in range(1, MAX_ITERATIONS + 1):
+        forced = None
+        if run is not None:
+            forced = run.stop_reason(last_turn=iteration == MAX_ITERATIONS)
+        contents = messages
+        request_config = config
+        if forced is not None:
+            # Sent but not kept, so a continued session isn't told to stop.
+            contents = messages + [final_prompt(forced)]
+            request_config = final_config(config)
+
+        started = time.perf_counter()
+        if scheduler is None:
+            response = await client.aio.models.generate_content(
+                model=MODEL,
+                contents=contents,
+                config=request_config,
+            )
+        else:
+            response = await scheduler.acall(
+                client.aio.models.generate_content,
+                model=MODEL,
+                contents=contents,
+                config=request_config,
+                prompt_chars=sum(content_chars(content) for content in contents),
+            )
+
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            raise RuntimeError(
+                "Gemini API response missing usage metadata; request may have failed."
+            )
+        prompt_tokens, response_tokens = usage_tokens(usage)
+        total_prompt_tokens += prompt_tokens or 0
+        total_response_tokens += response_tokens or 0
+        if run is not None:
+            run.observe_model(prompt_tokens, response_tokens)
+
+        model_contents = [cand.content for cand in getattr(response, "candidates", None) or []]
+        function_calls = getattr(response, "function_calls", None)
+        if forced is not None:
+            model_contents = answer_contents(model_contents)
+            function_calls = None
+        messages.extend(model_contents)
+
+        if on_event is not None:
+            await on_event({
+                "event": "model",
+                "iteration": iteration,
+                "seconds": round(time.perf_counter() - started, 4),
+                "prompt_tokens": prompt_tokens,
+                "response_tokens": response_tokens,
+                "function_calls": [call.name for call in function_calls or []],
+            })
+        if not function_calls:
+            result = {
+                "text": answer_text(model_contents) if forced else response.text,
+                "iterations": iteration,
+                "prompt_tokens": total_prompt_tokens,
+                "response_tokens": total_response_tokens,
+                "reads_saved": file_cache.reads_saved,
+            }
+            if run is not None:
+                run.finish(forced or "answered")
+                result["stop_reason"] = run.reason
+            return result
+
+        results = await asyncio.to_thread(
+            dispatch_function_calls,
+            function_calls,
+            working_directory=working_directory,
+            parallel=parallel,
+            quiet=True,
+            file_cache=file_cache,
+            result_budget=result_budget,
+            memo=memo,
+        )
+        if run is not None:
+            run.observe_tools(results)
+        messages.append(types.Content(
+            role="user",
+            parts=[function_response_part(result) for result, _ in results],
+        ))
+        if on_event is not None:
+            for function_call, (result, elapsed) in zip(function_calls, results):
+                tool_response = function_response_part(result).function_response.response
+                await on_event({
+                    "event": "tool",
+                    "iteration": iteration,
+                    "name": function_call.name,
+                    "seconds": round(elapsed, 4),
+                    "result_chars": len(json.dumps(tool_response, default=str)),
+                })
+
+    return {
+        "text": None,
+        "iterations": MAX_ITERATIONS,
+        "prompt_tokens": total_prompt_tokens,
+        "response_tokens": total_response_tokens,
+        "reads_saved": file_cache.reads_saved,
+        "error": "Maximum iterations reached without a final response.",
+    }
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Offline benchmark of the agent loop against a scripted fake client.
+
+The fake client replays a transcript of TURNS responses with CALLS tool
+calls each, then a final answer. The tools are the real ones, run against
+a generated copy of a calculator-shaped workspace, so the numbers cover
+the loop, the tools and history handling without any network access.
+
+Usage: python -m benchmarks.agent_loop [--turns M] [--calls N]
+       [--output-kb K] [--save-baseline | --max-regression F]
+
+Exits with status 1 if a metric is more than --max-regression (a fraction)
+worse than the stored baseline, so it can run as a CI check.
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from google.genai import types
+
+from functions.call_function import WORKING_DIRECTORY
+from history import HistoryManager
+from main import run_agent
+from tracing import Tracer, percentile
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "agent_loop_baseline.json")
+
+# Metrics compared against the baseline, by which direction is worse.
+LOWER_IS_BETTER = ("history_chars", "peak_rss_kb")
+HIGHER_IS_BETTER = ("iterations_per_sec",)
+
+NOISY_SCRIPT = """\
+import sys
+kb = int(sys.argv[1])
+for i in range(kb * 16):
+    print(f"result {i:08d}: " + "x" * 44)
+"""
+
+
+def make_workspace(output_kb):
+    """Copy the calculator project and add files that produce large outputs."""
+    workspace = tempfile.mkdtemp(prefix="agent-bench-")
+    shutil.copytree(
+        WORKING_DIRECTORY, workspace, dirs_exist_ok=True,
+        ignore=shutil.ignore_patterns("__pycache__"))
+    with open(os.path.join(workspace, "noisy.py"), "w") as f:
+        f.write(NOISY_SCRIPT)
+    os.makedirs(os.path.join(workspace, "data"))
+    with open(os.path.join(workspace, "data", "large.log"), "w") as f:
+        for i in range(output_kb * 16):
+            f.write(f"{i:08d} INFO request handled in {i % 97} ms\n")
+    for i in range(50):
+        with open(os.path.join(workspace, "pkg", f"module_{i}.py"), "w") as f:
+            f.write(f"def helper_{i}(x):\n    return x + {i}\n")
+    return workspace
+
+
+def tool_calls(output_kb):
+    """The tool calls a transcript cycles through."""
+    return [
+        ("get_files_info", {"max_depth": 3}),
+        ("get_file_content", {"file_path": "pkg/calculator.py"}),
+        ("search_files", {"pattern": "def "}),
+        ("get_file_content", {"file_path": "data/large.log"}),
+        ("run_python_file", {"file_path": "main.py", "args": ["3 + 5"]}),
+        ("run_python_file", {"file_path": "noisy.py", "args": [str(output_kb)]}),
+        ("write_file", {"file_path": "scratch/notes.txt", "content": "benchmark notes\n"}),
+    ]
+
+
+def scripted_responses(turns, calls_per_turn, output_kb):
+    calls = itertools.cycle(tool_calls(output_kb))
+    responses = []
+    for turn in range(turns):
+        parts = [types.Part(text=f"Step {turn + 1}.")]
+        for _ in range(calls_per_turn):
+            name, args = next(calls)
+            parts.append(types.Part(function_call=types.FunctionCall(
+                name=name, args=args)))
+        responses.append(_response(parts))
+    responses.append(_response([types.Part(text="All done.")]))
+    return responses
+
+
+def _response(parts):
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=parts))],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=1000, candidates_token_count=50),
+    )
+
+
+class ScriptedModels:
+    """Stands in for client.models, replaying canned responses in order."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def generate_content(self, model, contents, config):
+        return self.responses.pop(0)
+
+    def generate_content_stream(self, model, contents, config):
+        yield self.responses.pop(0)
+
+
+class ScriptedClient:
+    def __init__(self, responses):
+        self.models = ScriptedModels(responses)
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def run_benchmark(turns=10, calls_per_turn=4, output_kb=64, parallel=False,
+                  stream=False, history_budget=None, result_budget=None):
+    """Run one scripted session and return its metrics as a dict."""
+    workspace = make_workspace(output_kb)
+    try:
+        client = ScriptedClient(scripted_responses(turns, calls_per_turn, output_kb))
+        tracer = Tracer()
+        history = HistoryManager(history_budget) if history_budget else None
+        started = time.perf_counter()
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            run_agent(
+                client, "Benchmark the agent loop.", parallel=parallel,
+                stream=stream, working_directory=workspace, history=history,
+                tracer=tracer, result_budget=result_budget)
+        elapsed = time.perf_counter() - started
+    finally:
+        shutil.rmtree(workspace)
+
+    tools = {}
+    for name, values in sorted(tracer.durations().items()):
+        if name == "model":
+            continue
+        tools[name] = {
+            "calls": len(values),
+            "p50_ms": round(percentile(values, 0.5) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        }
+    sizes = tracer.history_sizes
+    return {
+        "scenario": {
+            "turns": turns, "calls_per_turn": calls_per_turn,
+            "output_kb": output_kb, "parallel": parallel, "stream": stream,
+            "history_budget": history_budget, "result_budget": result_budget,
+        },
+        "iterations": tracer.iterations,
+        "seconds": round(elapsed, 3),
+        "iterations_per_sec": round(tracer.iterations / elapsed, 2),
+        "tools": tools,
+        "peak_rss_kb": peak_rss_kb(),
+        "history_chars": sizes[-1][2],
+        "history_chars_per_iteration": round(
+            (sizes[-1][2] - sizes[0][2]) / max(1, len(sizes) - 1)),
+    }
+
+
+def compare(metrics, baseline, max_regression):
+    """Return a line per tracked metric and whether any regressed."""
+    lines = []
+    regressed = False
+    for key in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+        old, new = baseline.get(key), metrics.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if key in HIGHER_IS_BETTER else change
+        flag = ""
+        if worse > max_regression:
+            flag = "  REGRESSION"
+            regressed = True
+        lines.append(f"{key:<24}{old:>12}{new:>12}{change:>+10.1%}{flag}")
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=10,
+                        help="Model turns that call tools before the final answer")
+    parser.add_argument("--calls", type=int, default=4,
+                        help="Tool calls per turn")
+    parser.add_argument("--output-kb", type=int, default=64,
+                        help="Size of the large tool outputs")
+    parser.add_argument("--parallel", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--history-budget", type=int, default=None)
+    parser.add_argument("--result-budget", type=int, default=None,
+                        help="Characters of tool results allowed per turn")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Run the session this many times and keep the fastest")
+    parser.add_argument("--baseline", type=str, default=BASELINE_PATH,
+                        help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store this run as the new baseline")
+    parser.add_argument("--max-regression", type=float, default=0.5,
+                        help="Exit 1 if a metric is this much worse than the baseline")
+    args = parser.parse_args()
+
+    # Wall-clock numbers are noisy; the fastest of a few runs is stabler.
+    metrics = max(
+        (run_benchmark(
+            turns=args.turns, calls_per_turn=args.calls,
+            output_kb=args.output_kb, parallel=args.parallel,
+            stream=args.stream, history_budget=args.history_budget,
+            result_budget=args.result_budget)
+         for _ in range(max(1, args.repeat))),
+        key=lambda metrics: metrics["iterations_per_sec"])
+
+    print(f"{metrics['iterations']} iterations in {metrics['seconds']}s "
+          f"({metrics['iterations_per_sec']} iterations/sec)")
+    print(f"peak RSS: {metrics['peak_rss_kb']} KiB, history: "
+          f"{metrics['history_chars']} chars "
+          f"(+{metrics['history_chars_per_iteration']} per iteration)")
+    print(f"{'tool':<20}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, tool in metrics["tools"].items():
+        print(f"{name:<20}{tool['calls']:>7}{tool['p50_ms']:>10.1f}{tool['p95_ms']:>10.1f}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(metrics, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against; run with --save-baseline")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("scenario") != metrics["scenario"]:
+        print("Baseline was recorded with other options; not comparing")
+        return
+    lines, regressed = compare(metrics, baseline, args.max_regression)
+    print(f"\n{'metric':<24}{'baseline':>12}{'now':>12}{'change':>10}")
+    print("\n".join(lines))
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
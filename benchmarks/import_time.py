@@ -0,0 +1,148 @@
+"""Cold-start import time of the CLI entry points and the tools.
+
+Each module is imported in a fresh interpreter under ``-X importtime`` and
+its cumulative import time is read from the report; ``main.py --help`` is
+timed end to end. The fastest of --repeat runs is kept.
+
+Usage: python -m benchmarks.import_time [--repeat N]
+       [--save-baseline | --max-regression F]
+
+Exits with status 1 if an import got more than --max-regression (a
+fraction) slower than the stored baseline, or if one of them now imports
+google.genai. Timings on a shared machine drift by tens of percent from
+day to day, so each run also times a stdlib import (REFERENCE_MODULE) and
+the baseline is scaled by how much that moved before comparing.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "import_time_baseline.json")
+
+# None of these should need the SDK until a request is made.
+MODULES = ("main", "batch", "functions.call_function", "functions.get_file_content")
+
+SDK_MODULE = "google.genai"
+
+# A stdlib import this repository can't change, so its time (in a fresh
+# interpreter, like the others) tracks only the machine.
+REFERENCE_MODULE = "asyncio"
+
+
+def import_report(module):
+    """Return ({module: cumulative microseconds}, stderr) for one import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        _, total, name = line[len("import time:"):].split("|")
+        if total.strip().isdigit():
+            cumulative[name.strip()] = int(total)
+    return cumulative
+
+
+def time_help():
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "main.py", "--help"], cwd=ROOT,
+                   capture_output=True, check=True)
+    return time.perf_counter() - started
+
+
+def run_benchmark(repeat=5):
+    """Return the best-of-``repeat`` metrics as a dict."""
+    modules = {}
+    for module in MODULES:
+        reports = [import_report(module) for _ in range(repeat)]
+        modules[module] = {
+            "import_ms": round(min(report[module] for report in reports) / 1000, 1),
+            "imports_sdk": SDK_MODULE in reports[0],
+        }
+    return {
+        "modules": modules,
+        "help_ms": round(min(time_help() for _ in range(repeat)) * 1000, 1),
+        "reference_ms": round(min(
+            import_report(REFERENCE_MODULE)[REFERENCE_MODULE]
+            for _ in range(repeat)) / 1000, 1),
+    }
+
+
+def machine_scale(metrics, baseline):
+    """How much slower this machine is now than when ``baseline`` was saved."""
+    if not baseline.get("reference_ms") or not metrics.get("reference_ms"):
+        return 1.0
+    return metrics["reference_ms"] / baseline["reference_ms"]
+
+
+def compare(metrics, baseline, max_regression):
+    """Return a line per import and whether any regressed."""
+    lines = []
+    regressed = False
+    scale = machine_scale(metrics, baseline)
+    for module, new in metrics["modules"].items():
+        old = baseline.get("modules", {}).get(module)
+        if not old:
+            continue
+        expected = old["import_ms"] * scale
+        change = (new["import_ms"] - expected) / expected
+        flag = ""
+        if new["imports_sdk"]:
+            flag = f"  IMPORTS {SDK_MODULE}"
+            regressed = True
+        elif change > max_regression:
+            flag = "  REGRESSION"
+            regressed = True
+        lines.append(
+            f"{module:<32}{expected:>10.1f}{new['import_ms']:>10}{change:>+10.1%}{flag}")
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Import each module this many times and keep the fastest")
+    parser.add_argument("--baseline", type=str, default=BASELINE_PATH,
+                        help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store this run as the new baseline")
+    parser.add_argument("--max-regression", type=float, default=0.5,
+                        help="Exit 1 if an import is this much slower than the baseline")
+    args = parser.parse_args()
+
+    metrics = run_benchmark(max(1, args.repeat))
+
+    print(f"{'module':<32}{'import ms':>10}  imports {SDK_MODULE}")
+    for module, result in metrics["modules"].items():
+        print(f"{module:<32}{result['import_ms']:>10}  {result['imports_sdk']}")
+    print(f"main.py --help: {metrics['help_ms']} ms")
+    print(f"{REFERENCE_MODULE} (reference): {metrics['reference_ms']} ms")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(metrics, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against; run with --save-baseline")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    lines, regressed = compare(metrics, baseline, args.max_regression)
+    print(f"\nBaseline scaled by {machine_scale(metrics, baseline):.2f} for this machine")
+    print(f"{'module':<32}{'baseline':>10}{'now':>10}{'change':>10}")
+    print("\n".join(lines))
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Per-call latency of run_python_file: cold subprocess vs warm workers.
+
+Usage: python -m benchmarks.run_python_file [--calls N]
+"""
+import argparse
+import statistics
+import time
+
+from functions.call_function import WORKING_DIRECTORY
+from functions.run_python_file import run_python_file, set_execution_backend
+
+CASES = [
+    ("main.py", ["3 + 5"]),
+    ("tests.py", None),
+]
+
+
+def time_calls(file_path, args, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        run_python_file(WORKING_DIRECTORY, file_path, args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20,
+                        help="Calls per backend and script")
+    args = parser.parse_args()
+
+    print(f"{'backend':<12}{'script':<12}{'mean ms':>10}{'p50 ms':>10}{'max ms':>10}")
+    for backend in ("subprocess", "forkserver"):
+        set_execution_backend(backend)
+        for file_path, script_args in CASES:
+            timings = time_calls(file_path, script_args, args.calls)
+            print(
+                f"{backend:<12}{file_path:<12}"
+                f"{statistics.mean(timings) * 1000:>10.1f}"
+                f"{statistics.median(timings) * 1000:>10.1f}"
+                f"{max(timings) * 1000:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
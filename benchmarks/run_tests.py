@@ -0,0 +1,87 @@
+"""Verification turn of an edit-test loop: run_python_file vs run_tests.
+
+Each round edits calculator/pkg/render.py (in a copy of the calculator)
+and then checks the edit, once with ``run_python_file tests.py`` and once
+with ``run_tests``; the time and the size of the result the model would
+read are compared. Both tools start scripts with --python-backend. A
+last row checks again with no edit in between, which run_tests answers
+from its cache without starting anything.
+
+After an edit run_tests still starts a process for the tests that
+depend on the edited file, so under the default subprocess backend the
+two tools take about as long (interpreter startup dominates both) and
+only the result is smaller; run_tests is faster there only under the
+forkserver backend, or when nothing the tests use has changed.
+
+Usage: python -m benchmarks.run_tests [--rounds N] [--python-backend B]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from functions.call_function import WORKING_DIRECTORY
+from functions.run_python_file import (
+    EXECUTION_BACKENDS,
+    run_python_file,
+    set_execution_backend,
+)
+from functions.run_tests import run_tests
+
+EDITED_FILE = os.path.join("pkg", "render.py")
+
+
+def edit(working_directory, round_number):
+    with open(os.path.join(working_directory, EDITED_FILE), "a") as f:
+        f.write(f"\n# edit {round_number}\n")
+
+
+def measure(check, working_directory, rounds, edits=True):
+    timings = []
+    sizes = []
+    for round_number in range(rounds):
+        if edits:
+            edit(working_directory, round_number)
+        start = time.perf_counter()
+        result = check(working_directory)
+        timings.append(time.perf_counter() - start)
+        sizes.append(len(result))
+    return timings, sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=10,
+                        help="Edit-and-check rounds per tool")
+    parser.add_argument("--python-backend", choices=EXECUTION_BACKENDS,
+                        default="subprocess",
+                        help="How both tools start scripts")
+    args = parser.parse_args()
+    set_execution_backend(args.python_backend)
+
+    checks = [
+        ("run_python_file", lambda wd: run_python_file(wd, "tests.py"), True),
+        # The first call runs everything; the loop starts after it.
+        ("run_tests", lambda wd: run_tests(wd), True),
+        ("run_tests, no edit", lambda wd: run_tests(wd), False),
+    ]
+    print(f"{'tool':<18}{'mean ms':>10}{'p50 ms':>10}{'result chars':>14}")
+    with tempfile.TemporaryDirectory() as directory:
+        working_directory = os.path.join(directory, "calculator")
+        shutil.copytree(WORKING_DIRECTORY, working_directory,
+                        ignore=shutil.ignore_patterns("__pycache__"))
+        run_tests(working_directory)
+        for name, check, edits in checks:
+            timings, sizes = measure(check, working_directory, args.rounds, edits)
+            print(
+                f"{name:<18}"
+                f"{statistics.mean(timings) * 1000:>10.1f}"
+                f"{statistics.median(timings) * 1000:>10.1f}"
+                f"{statistics.mean(sizes):>14.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Load test of server.py against a stub model.
+
+An AgentServer runs in this process with StubClient in place of Gemini:
+every model response takes --model-latency seconds, and each prompt costs
+two of them (a get_files_info call, then the answer). --clients clients
+send --requests prompts between them, each as a new session, and the
+request latency is compared with the model time it can't go below.
+
+Usage: python -m benchmarks.server_load [--requests N] [--clients N]
+       [--model-latency S] [--max-in-flight N] [--max-waiting N]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from server import AgentServer
+
+
+def _response(parts):
+    from google.genai import types
+
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=parts))],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=10, candidates_token_count=5),
+    )
+
+
+class StubModels:
+    """Answers every prompt with one get_files_info call, then text.
+
+    Records the requests it got and the most it served at once.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = []
+        self.active = 0
+        self.peak = 0
+
+    async def generate_content(self, model, contents, config):
+        from google.genai import types
+
+        self.requests.append(list(contents))
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+        last = contents[-1].parts[0]
+        if last.function_response is None:
+            return _response([types.Part(function_call=types.FunctionCall(
+                name="get_files_info", args={}))])
+        listing = last.function_response.response["result"]
+        return _response([types.Part(
+            text=f"{last_prompt(contents)}: {len(listing.splitlines())} entries")])
+
+
+def last_prompt(contents):
+    for content in reversed(contents):
+        if content.role == "user" and content.parts[0].text is not None:
+            return content.parts[0].text
+    return None
+
+
+class StubAio:
+    def __init__(self, latency):
+        self.models = StubModels(latency)
+
+
+class StubClient:
+    def __init__(self, latency=0.05):
+        self.aio = StubAio(latency)
+
+
+async def request(port, method, path, payload=None):
+    """Send one request; returns (status, headers, body).
+
+    A streamed response's body is its list of events; any other body is
+    the decoded JSON.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding") == "chunked":
+            events = []
+            while size := int(await reader.readline(), 16):
+                events.append(json.loads(await reader.readexactly(size)))
+                await reader.readline()
+            await reader.readline()
+            return status, headers, events
+        data = await reader.readexactly(int(headers.get("content-length", 0)))
+        return status, headers, json.loads(data) if data else None
+    finally:
+        writer.close()
+
+
+async def run_load(requests=200, clients=32, model_latency=0.05,
+                   max_in_flight=16, max_waiting=64):
+    """Return the load test's metrics as a dict."""
+    client = StubClient(model_latency)
+    server = AgentServer(client, max_in_flight=max_in_flight,
+                         max_waiting=max_waiting, max_sessions=requests)
+    await server.start("127.0.0.1", 0)
+    latencies = []
+    statuses = {}
+    remaining = iter(range(requests))
+
+    async def run_client():
+        for i in remaining:
+            started = time.perf_counter()
+            status, _, events = await request(
+                server.port, "POST", "/prompt", {"prompt": f"prompt {i}"})
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200 and events[-1]["event"] == "done":
+                latencies.append(time.perf_counter() - started)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(run_client() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await server.close()
+
+    latencies.sort()
+    model_seconds = 2 * model_latency
+    return {
+        "statuses": statuses,
+        "throughput": round(len(latencies) / elapsed, 1),
+        "model_ms": round(model_seconds * 1000, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+        "peak_model_calls": client.aio.models.peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200,
+                        help="Prompts to send in total")
+    parser.add_argument("--clients", type=int, default=32,
+                        help="Concurrent clients sending them")
+    parser.add_argument("--model-latency", type=float, default=0.05,
+                        help="Seconds each stub model response takes")
+    parser.add_argument("--max-in-flight", type=int, default=16,
+                        help="The server's --max-in-flight")
+    parser.add_argument("--max-waiting", type=int, default=64,
+                        help="The server's --max-waiting")
+    args = parser.parse_args()
+
+    metrics = asyncio.run(run_load(
+        args.requests, args.clients, args.model_latency,
+        args.max_in_flight, args.max_waiting))
+    print(json.dumps(metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()
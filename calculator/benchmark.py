@@ -0,0 +1,102 @@
+"""Time Calculator.evaluate on a hot workload, with and without the cache.
+
+The workload evaluates the same few hundred expressions many times over,
+which is where compiled, cached programs pay off. With NumPy installed it
+also times one formula over --rows rows of variables, row by row and with
+evaluate_array.
+
+Usage: python benchmark.py [--expressions N] [--rounds R] [--rows N]
+"""
+import argparse
+import random
+import time
+
+from pkg.calculator import Calculator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FORMULA = "price * quantity - discount / quantity + 1"
+
+
+def make_expressions(count, seed=0):
+    rng = random.Random(seed)
+    expressions = []
+    for _ in range(count):
+        tokens = [str(rng.randint(1, 99))]
+        for _ in range(rng.randint(1, 8)):
+            tokens += [rng.choice("+-*/"), str(rng.randint(1, 99))]
+        expressions.append(" ".join(tokens))
+    return expressions
+
+
+def time_it(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--expressions", type=int, default=200,
+                        help="Distinct expressions in the workload")
+    parser.add_argument("--rounds", type=int, default=500,
+                        help="Times each expression is evaluated")
+    parser.add_argument("--rows", type=int, default=1000000,
+                        help="Rows of variables for the vectorized comparison")
+    args = parser.parse_args()
+
+    workload = make_expressions(args.expressions) * args.rounds
+    uncached = Calculator(cache_size=0)
+    cached = Calculator()
+
+    def evaluate_each(calculator):
+        evaluate = calculator.evaluate
+        for expression in workload:
+            evaluate(expression)
+
+    timings = [
+        ("uncached evaluate", time_it(lambda: evaluate_each(uncached))),
+        ("cached evaluate", time_it(lambda: evaluate_each(cached))),
+        ("cached evaluate_many", time_it(lambda: cached.evaluate_many(workload))),
+    ]
+
+    baseline = timings[0][1]
+    print(f"{len(workload)} evaluations of {args.expressions} expressions")
+    print(f"{'mode':<24}{'total s':>10}{'us/expr':>10}{'speedup':>10}")
+    for name, seconds in timings:
+        print(f"{name:<24}{seconds:>10.3f}"
+              f"{seconds / len(workload) * 1e6:>10.2f}"
+              f"{baseline / seconds:>9.1f}x")
+
+    if np is not None:
+        time_vectorized(args.rows)
+
+
+def time_vectorized(rows):
+    rng = np.random.default_rng(0)
+    columns = {
+        "price": rng.uniform(1, 100, rows),
+        "quantity": rng.integers(1, 50, rows).astype(np.float64),
+        "discount": rng.uniform(0, 10, rows),
+    }
+    calculator = Calculator()
+
+    # Row by row is slow; time a sample and scale it up.
+    sample = min(rows, 100000)
+    scalar = time_it(lambda: [
+        calculator.evaluate(FORMULA, {name: values[i] for name, values in columns.items()})
+        for i in range(sample)
+    ]) * rows / sample
+    vectorized = time_it(lambda: calculator.evaluate_array(FORMULA, columns))
+
+    print(f"\n{FORMULA} over {rows} rows")
+    print(f"{'mode':<24}{'total s':>10}{'speedup':>10}")
+    print(f"{'row by row (est.)':<24}{scalar:>10.3f}{1:>9.1f}x")
+    print(f"{'evaluate_array':<24}{vectorized:>10.3f}{scalar / vectorized:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import argparse
 import sys
 from pkg.calculator import Calculator
 from pkg.render import format_json_output
@@ -8,9 +9,14 @@ def main():
     if len(sys.argv) <= 1:
         print("Calculator App")
         print('Usage: python main.py "<expression>"')
+        print('       python main.py --batch [FILE] [--workers N]')
         print('Example: python main.py "3 + 5"')
         return
 
+    if sys.argv[1] == "--batch":
+        batch_main(sys.argv[2:])
+        return
+
     expression = " ".join(sys.argv[1:])
     try:
         result = calculator.evaluate(expression)
@@ -23,5 +29,26 @@ def main():
         print(f"Error: {e}")
 
 
+def batch_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="main.py --batch",
+        description="Evaluate one expression per line and write JSONL results")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="File of expressions, one per line (default: stdin)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Evaluate chunks of input in this many processes")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="Lines per chunk handed to a worker")
+    args = parser.parse_args(argv)
+    # Only batch mode needs the process pool, so only it pays for importing it.
+    from pkg.batch import run_batch
+
+    if args.input == "-":
+        run_batch(sys.stdin, sys.stdout, args.workers, args.chunk_size)
+    else:
+        with open(args.input, encoding="utf-8") as lines:
+            run_batch(lines, sys.stdout, args.workers, args.chunk_size)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,63 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from pkg.calculator import Calculator
+from pkg.render import format_jsonl_error, format_jsonl_result
+
+EMPTY_EXPRESSION = "Expression is empty or contains only whitespace."
+
+# One calculator per process, so its program cache lasts across chunks.
+_calculator = Calculator()
+
+
+def evaluate_lines(lines):
+    """Evaluate one expression per line; return the JSONL output for them."""
+    evaluate = _calculator.evaluate
+    output = []
+    append = output.append
+    for line in lines:
+        expression = line.rstrip("\r\n")
+        try:
+            result = evaluate(expression)
+        except Exception as e:
+            append(format_jsonl_error(expression, str(e)))
+            continue
+        if result is None:
+            append(format_jsonl_error(expression, EMPTY_EXPRESSION))
+        else:
+            append(format_jsonl_result(expression, result))
+    append("")
+    return "\n".join(output)
+
+
+def _chunks(lines, chunk_size):
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_batch(lines, output, workers=1, chunk_size=1000):
+    """Write one JSONL result or error object per input line, in order.
+
+    Input is read ``chunk_size`` lines at a time. With ``workers`` > 1
+    the chunks are evaluated in a process pool; at most a few chunks per
+    worker are in flight, so memory stays bounded however long the input.
+    """
+    chunks = _chunks(lines, chunk_size)
+    if workers <= 1:
+        for chunk in chunks:
+            output.write(evaluate_lines(chunk))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(evaluate_lines, chunk))
+            if len(pending) >= workers * 2:
+                output.write(pending.popleft().result())
+        while pending:
+            output.write(pending.popleft().result())
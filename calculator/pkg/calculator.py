@@ -1,10 +1,120 @@
+import operator
+from collections import OrderedDict
+
+# NumPy is only needed for evaluate_array and evaluate_chunks, and takes
+# longer to import than the rest of a single evaluation, so it is imported
+# on first use (see _numpy).
+_np = None
+_UFUNCS = {}
+
+# Instructions of a compiled Program.
+PUSH = 0  # push a value
+APPLY = 1  # pop b and a, push operator(a, b)
+RAISE = 2  # raise the stored exception
+LOAD = 3  # push the value of a variable
+
+# Rows evaluate_array processes at a time, bounding its temporaries.
+DEFAULT_CHUNK_ROWS = 65536
+
+
+def _numpy():
+    """Import NumPy and fill in _UFUNCS the first time it's needed."""
+    global _np
+    if _np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError(
+                "evaluate_array needs NumPy (pip install numpy)") from None
+        _UFUNCS.update({
+            operator.add: numpy.add,
+            operator.sub: numpy.subtract,
+            operator.mul: numpy.multiply,
+            operator.truediv: numpy.true_divide,
+        })
+        _np = numpy
+    return _np
+
+
+class Program:
+    """An expression compiled to RPN instructions for a value stack.
+
+    Errors are instructions too, placed where evaluation would have hit
+    them, so a program raises the same exception in the same order as
+    evaluating the text token by token.
+    """
+
+    __slots__ = ("code",)
+
+    def __init__(self, code):
+        self.code = code
+
+    def run(self, variables=None):
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        for kind, arg in self.code:
+            if kind == PUSH:
+                push(arg)
+            elif kind == APPLY:
+                b = pop()
+                push(arg(pop(), b))
+            elif kind == LOAD:
+                push(float(_lookup(variables, arg)))
+            else:
+                exc_type, args = arg
+                raise exc_type(*args)
+        return stack[0]
+
+    def run_array(self, columns, rows):
+        """Run element-wise over float64 ``columns`` of ``rows`` values.
+
+        Any zero divisor raises ZeroDivisionError, as the scalar path would
+        for that row. Intermediate arrays are reused as outputs, so each
+        operation is one pass without a new allocation.
+        """
+        np = _numpy()
+        stack = []  # (value, owned): owned arrays are our temporaries
+        push = stack.append
+        pop = stack.pop
+        # Python floats overflow to inf silently; so do these.
+        with np.errstate(over="ignore", invalid="ignore"):
+            for kind, arg in self.code:
+                if kind == PUSH:
+                    push((arg, False))
+                elif kind == LOAD:
+                    push((_lookup(columns, arg), False))
+                elif kind == APPLY:
+                    b, b_owned = pop()
+                    a, a_owned = pop()
+                    if arg is operator.truediv and np.any(b == 0):
+                        raise ZeroDivisionError("float division by zero")
+                    out = a if a_owned else b if b_owned else None
+                    push((_UFUNCS[arg](a, b, out=out), True))
+                else:
+                    exc_type, args = arg
+                    raise exc_type(*args)
+        result, owned = stack[0]
+        if not owned:
+            # A constant, or a bare variable that mustn't be handed out.
+            result = np.array(np.broadcast_to(result, rows), dtype=np.float64)
+        return result
+
+
+def _lookup(variables, name):
+    try:
+        return variables[name]
+    except KeyError:
+        raise ValueError(f"unknown variable: {name}") from None
+
+
 class Calculator:
-    def __init__(self):
+    def __init__(self, cache_size=1024):
         self.operators = {
-            "+": lambda a, b: a + b,
-            "-": lambda a, b: a - b,
-            "*": lambda a, b: a * b,
-            "/": lambda a, b: a / b,
+            "+": operator.add,
+            "-": operator.sub,
+            "*": operator.mul,
+            "/": operator.truediv,
         }
         self.precedence = {
             "+": 1,
@@ -12,16 +122,124 @@ class Calculator:
             "*": 2,
             "/": 2,
         }
+        self.cache_size = cache_size
+        self._programs = OrderedDict()
+        self._variable_programs = OrderedDict()
 
-    def evaluate(self, expression):
+    def evaluate(self, expression, variables=None):
+        """Evaluate to a float, or None for an empty expression.
+
+        Names in the expression are looked up in ``variables``; without
+        it, a name is an invalid token as before.
+        """
+        if not expression or expression.isspace():
+            return None
+        if variables is None:
+            return self.compile(expression).run()
+        return self.compile(expression, variables=True).run(variables)
+
+    def evaluate_array(self, expression, variables, chunk_size=DEFAULT_CHUNK_ROWS,
+                       out=None):
+        """Evaluate element-wise over equal-length columns of values.
+
+        ``variables`` maps names to anything np.asarray accepts (arrays,
+        memory-mapped arrays, array-backed columns). Rows are processed
+        ``chunk_size`` at a time, so only the inputs (which may be memory
+        mapped) need to be full length; pass a preallocated ``out``, such
+        as an np.memmap, to keep the result out of memory too. Division by
+        zero in any row raises ZeroDivisionError, as evaluate would; rows
+        in earlier chunks have already been written to ``out`` by then.
+        """
+        np = _numpy()
         if not expression or expression.isspace():
             return None
-        tokens = expression.strip().split()
-        return self._evaluate_infix(tokens)
 
-    def _evaluate_infix(self, tokens):
-        values = []
+        program = self.compile(expression, variables=True)
+        columns = {name: np.asarray(values) for name, values in variables.items()}
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("variables must all have the same length")
+        rows = lengths.pop() if lengths else 1
+        if out is None:
+            out = np.empty(rows, dtype=np.float64)
+        elif len(out) != rows:
+            raise ValueError(f"out has {len(out)} rows, expected {rows}")
+
+        chunk_size = max(1, int(chunk_size))
+        for start in range(0, rows, chunk_size):
+            stop = min(start + chunk_size, rows)
+            chunk = {
+                name: np.asarray(values[start:stop], dtype=np.float64)
+                for name, values in columns.items()
+            }
+            out[start:stop] = program.run_array(chunk, stop - start)
+        return out
+
+    def evaluate_chunks(self, expression, chunks):
+        """Yield one result array per mapping of columns in ``chunks``.
+
+        For inputs that arrive in pieces (files read a block at a time),
+        so that nothing ever has to be held in full.
+        """
+        for variables in chunks:
+            yield self.evaluate_array(expression, variables)
+
+    def evaluate_many(self, expressions, return_exceptions=False):
+        """Evaluate each expression in turn and return the results as a list.
+
+        With ``return_exceptions=True`` an expression that fails gives its
+        exception in place of a result instead of stopping the batch.
+        """
+        results = []
+        append = results.append
+        compile_ = self.compile
+        for expression in expressions:
+            if not expression or expression.isspace():
+                append(None)
+                continue
+            if not return_exceptions:
+                append(compile_(expression).run())
+                continue
+            try:
+                append(compile_(expression).run())
+            except (ValueError, ArithmeticError) as e:
+                append(e)
+        return results
+
+    def compile(self, expression, variables=False):
+        """Return the Program for ``expression``, reusing a cached one.
+
+        Programs are cached by the expression's tokens, so text that only
+        differs in whitespace compiles once; the exact text is cached too,
+        so a repeat doesn't even need to be re-tokenized. With
+        ``variables=True`` names compile to variable lookups.
+        """
+        programs = self._variable_programs if variables else self._programs
+        program = programs.get(expression)
+        if program is not None:
+            programs.move_to_end(expression)
+            return program
+
+        key = " ".join(expression.split())
+        program = programs.get(key)
+        if program is None:
+            program = Program(self._compile(key.split(), variables))
+            self._remember(programs, key, program)
+        if key != expression:
+            self._remember(programs, expression, program)
+        return program
+
+    def _remember(self, programs, key, program):
+        if self.cache_size > 0:
+            programs[key] = program
+            programs.move_to_end(key)
+            if len(programs) > self.cache_size:
+                programs.popitem(last=False)
+
+    def _compile(self, tokens, variables=False):
+        code = []
         operators = []
+        depth = 0
 
         for token in tokens:
             if token in self.operators:
@@ -30,30 +248,47 @@ class Calculator:
                     and operators[-1] in self.operators
                     and self.precedence[operators[-1]] >= self.precedence[token]
                 ):
-                    self._apply_operator(operators, values)
+                    depth = self._emit_operator(code, operators.pop(), depth)
+                    if depth is None:
+                        return code
                 operators.append(token)
             else:
                 try:
-                    values.append(float(token))
+                    code.append((PUSH, float(token)))
                 except ValueError:
-                    raise ValueError(f"invalid token: {token}")
+                    if not (variables and token.isidentifier()):
+                        code.append((RAISE, (ValueError, (f"invalid token: {token}",))))
+                        return code
+                    code.append((LOAD, token))
+                depth += 1
 
         while operators:
-            self._apply_operator(operators, values)
+            depth = self._emit_operator(code, operators.pop(), depth)
+            if depth is None:
+                return code
 
-        if len(values) != 1:
-            raise ValueError("invalid expression")
+        if depth != 1:
+            code.append((RAISE, (ValueError, ("invalid expression",))))
 
-        return values[0]
+        return code
 
-    def _apply_operator(self, operators, values):
-        if not operators:
-            return
-
-        operator = operators.pop()
-        if len(values) < 2:
-            raise ValueError(f"not enough operands for operator {operator}")
+    def _emit_operator(self, code, symbol, depth):
+        """Add one operator to ``code``; returns the new depth, or None
+        if evaluation can't get past it."""
+        if depth < 2:
+            code.append((RAISE, (ValueError, (f"not enough operands for operator {symbol}",))))
+            return None
 
-        b = values.pop()
-        a = values.pop()
-        values.append(self.operators[operator](a, b))
+        function = self.operators[symbol]
+        if code[-1][0] == PUSH and code[-2][0] == PUSH:
+            # Both operands are constants: fold them now, keeping any
+            # error (division by zero) where it would have happened.
+            try:
+                value = function(code[-2][1], code[-1][1])
+            except ArithmeticError as e:
+                code[-2:] = [(RAISE, (type(e), e.args))]
+                return None
+            code[-2:] = [(PUSH, value)]
+        else:
+            code.append((APPLY, function))
+        return depth - 1
@@ -1,14 +1,30 @@
 import json
 
+# Reused for every batch line; json.dumps with arguments builds a new
+# encoder per call.
+_compact_encoder = json.JSONEncoder(separators=(",", ":"))
 
-def format_json_output(expression: str, result: float, indent: int = 2) -> str:
+
+def _result_value(result: float):
     if isinstance(result, float) and result.is_integer():
-        result_to_dump = int(result)
-    else:
-        result_to_dump = result
+        return int(result)
+    return result
 
+
+def format_json_output(expression: str, result: float, indent: int = 2) -> str:
     output_data = {
         "expression": expression,
-        "result": result_to_dump,
+        "result": _result_value(result),
     }
     return json.dumps(output_data, indent=indent)
+
+
+def format_jsonl_result(expression: str, result: float) -> str:
+    """One compact JSON line (without the newline) for a batch result."""
+    return _compact_encoder.encode(
+        {"expression": expression, "result": _result_value(result)})
+
+
+def format_jsonl_error(expression: str, error: str) -> str:
+    """One compact JSON line (without the newline) for a failed expression."""
+    return _compact_encoder.encode({"expression": expression, "error": error})
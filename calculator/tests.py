@@ -1,6 +1,16 @@
+import io
+import json
+import os
+import tempfile
 import unittest
+from pkg.batch import run_batch
 from pkg.calculator import Calculator
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class TestCalculator(unittest.TestCase):
     def setUp(self):
@@ -42,6 +52,120 @@ class TestCalculator(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.calculator.evaluate("+ 3")
 
+    def test_division_by_zero(self):
+        with self.assertRaises(ZeroDivisionError):
+            self.calculator.evaluate("4 / 0")
+
+    def test_errors_keep_evaluation_order(self):
+        # Division happens when "+" arrives, before "x" is reached.
+        with self.assertRaises(ZeroDivisionError):
+            self.calculator.evaluate("1 / 0 + x")
+        with self.assertRaisesRegex(ValueError, "invalid token: x"):
+            self.calculator.evaluate("x + 1 / 0")
+        with self.assertRaisesRegex(ValueError, "invalid expression"):
+            self.calculator.evaluate("3 4")
+
+    def test_compiled_programs_are_cached(self):
+        program = self.calculator.compile("3 + 5")
+        self.assertIs(self.calculator.compile("  3   +  5 "), program)
+        self.assertEqual(program.run(), 8)
+
+    def test_cache_is_bounded(self):
+        calculator = Calculator(cache_size=2)
+        for expression in ("1 + 1", "2 + 2", "3 + 3"):
+            calculator.evaluate(expression)
+        self.assertEqual(len(calculator._programs), 2)
+        self.assertEqual(calculator.evaluate("1 + 1"), 2)
+
+    def test_evaluate_many(self):
+        results = self.calculator.evaluate_many(["3 + 5", "", "2 * 3 - 8 / 2 + 5"])
+        self.assertEqual(results, [8, None, 7])
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate_many(["1 +"])
+
+    def test_evaluate_many_return_exceptions(self):
+        results = self.calculator.evaluate_many(
+            ["1 / 0", "$ 3", "10 / 4"], return_exceptions=True)
+        self.assertIsInstance(results[0], ZeroDivisionError)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], 2.5)
+
+    def test_variables(self):
+        self.assertEqual(self.calculator.evaluate("x * 2 + y", {"x": 3, "y": 1}), 7)
+        with self.assertRaisesRegex(ValueError, "unknown variable: y"):
+            self.calculator.evaluate("x + y", {"x": 1})
+        # Without variables a name is still an invalid token.
+        with self.assertRaisesRegex(ValueError, "invalid token: x"):
+            self.calculator.evaluate("x + 1")
+
+
+class TestBatch(unittest.TestCase):
+    def run_batch(self, lines, **kwargs):
+        output = io.StringIO()
+        run_batch(lines, output, **kwargs)
+        return output.getvalue()
+
+    def test_one_compact_line_per_expression(self):
+        output = self.run_batch(["3 + 5\n", "\n", "1 / 0\n", "10 / 4"])
+        self.assertEqual(output.splitlines(), [
+            '{"expression":"3 + 5","result":8}',
+            '{"expression":"","error":"Expression is empty or contains only whitespace."}',
+            '{"expression":"1 / 0","error":"float division by zero"}',
+            '{"expression":"10 / 4","result":2.5}',
+        ])
+
+    def test_workers_keep_input_order(self):
+        lines = [f"{i} * 2 + x\n" if i % 7 == 0 else f"{i} * 2\n" for i in range(200)]
+        serial = self.run_batch(lines)
+        parallel = self.run_batch(lines, workers=2, chunk_size=9)
+        self.assertEqual(parallel, serial)
+        records = [json.loads(line) for line in parallel.splitlines()]
+        self.assertEqual(records[3], {"expression": "3 * 2", "result": 6})
+        self.assertEqual(records[7]["error"], "invalid token: x")
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class TestVectorized(unittest.TestCase):
+    def setUp(self):
+        self.calculator = Calculator()
+
+    def test_matches_scalar_evaluation(self):
+        x = np.array([1.0, -2.5, 3.0, 1e308, float("nan")])
+        y = np.array([2.0, 4.0, -1.0, 10.0, 1.0])
+        expression = "x * y - x / y + 3"
+        result = self.calculator.evaluate_array(expression, {"x": x, "y": y}, chunk_size=2)
+        expected = [self.calculator.evaluate(expression, {"x": a, "y": b}) for a, b in zip(x, y)]
+        np.testing.assert_array_equal(result, expected)
+
+    def test_division_by_zero_raises_like_scalar(self):
+        with self.assertRaises(ZeroDivisionError):
+            self.calculator.evaluate_array("1 / x", {"x": np.array([1.0, 0.0, 2.0])})
+        with self.assertRaises(ZeroDivisionError):
+            self.calculator.evaluate("1 / x", {"x": 0.0})
+
+    def test_inputs_are_not_modified(self):
+        x = np.array([1.0, 2.0])
+        self.assertIsNot(self.calculator.evaluate_array("x", {"x": x}), x)
+        result = self.calculator.evaluate_array("x * 2 + 1", {"x": x})
+        np.testing.assert_array_equal(result, [3.0, 5.0])
+        np.testing.assert_array_equal(x, [1.0, 2.0])
+
+    def test_chunked_into_memmap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "x.dat")
+            x = np.memmap(path, dtype=np.float64, mode="w+", shape=(10000,))
+            x[:] = np.arange(10000)
+            out = np.memmap(os.path.join(directory, "out.dat"), dtype=np.float64,
+                            mode="w+", shape=(10000,))
+            self.calculator.evaluate_array("x * 2", {"x": x}, chunk_size=999, out=out)
+            np.testing.assert_array_equal(out, np.arange(10000) * 2)
+            del x, out
+
+    def test_evaluate_chunks(self):
+        chunks = [{"a": [1, 2]}, {"a": [3]}]
+        results = list(self.calculator.evaluate_chunks("a + 1", chunks))
+        self.assertEqual([list(result) for result in results], [[2.0, 3.0], [4.0]])
+
 
 if __name__ == "__main__":
     unittest.main()
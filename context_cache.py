@@ -0,0 +1,143 @@
+import json
+import sys
+
+from history import DEFAULT_CHARS_PER_TOKEN, content_chars
+from response_cache import cache_key
+
+# The API rejects explicit caches smaller than this (gemini-2.5-flash).
+MIN_CACHE_TOKENS = 1024
+DEFAULT_TTL_SECONDS = 3600
+
+
+def _config_chars(config):
+    chars = len(config.system_instruction or "")
+    for tool in config.tools or []:
+        chars += len(json.dumps(tool.model_dump(mode="json", exclude_none=True)))
+    return chars
+
+
+class ContextCache:
+    """Send a stable prompt prefix once and refer to it by name afterwards.
+
+    ``prepare`` stores the config's system instruction and tools, plus any
+    leading contents (pinned files, a resumed session's history), with
+    ``client.caches.create``. ``request`` then returns a config naming that
+    handle and the contents after the prefix, which is all a request has
+    to send. A handle saved with a session is reused by the next run while
+    it still covers most of the conversation; its TTL is refreshed rather
+    than the prefix uploaded again.
+
+    ``tokens_saved`` counts prompt tokens served from the cache, as
+    reported by each response's usage metadata.
+    """
+
+    def __init__(self, client, model, ttl=DEFAULT_TTL_SECONDS,
+                 min_tokens=MIN_CACHE_TOKENS):
+        self.client = client
+        self.model = model
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.name = None
+        self.key = None
+        self.prefix_length = 0
+        self.tokens = 0
+        self.created = False
+        self.requests = 0
+        self.tokens_saved = 0
+        self._config = None
+
+    def prepare(self, config, prefix, reuse=None):
+        """Cache ``config``'s instructions and tools followed by ``prefix``.
+
+        ``reuse`` is a ``handle()`` saved by an earlier run. Returns True if
+        requests can use a cached prefix, False if the prefix is too small
+        to cache or the cache could not be created (requests then send
+        everything, as without a ContextCache).
+        """
+        from google.genai import errors, types
+
+        if reuse and self._reusable(reuse, config, prefix):
+            try:
+                self.client.caches.update(
+                    name=reuse["name"],
+                    config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"))
+            except errors.APIError:
+                pass  # expired or deleted; create a new one
+            else:
+                self._use(config, reuse["name"], reuse["key"],
+                          reuse["prefix_length"], reuse["tokens"])
+                return True
+
+        chars = _config_chars(config) + sum(content_chars(c) for c in prefix)
+        if chars / DEFAULT_CHARS_PER_TOKEN < self.min_tokens:
+            return False
+        try:
+            cached = self.client.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=config.system_instruction,
+                    tools=config.tools,
+                    tool_config=config.tool_config,
+                    contents=list(prefix) or None,
+                    ttl=f"{self.ttl}s",
+                ))
+        except errors.APIError as e:
+            print(f"Warning: could not create a context cache: {e}",
+                  file=sys.stderr)
+            return False
+        usage = cached.usage_metadata
+        self.created = True
+        self._use(config, cached.name, cache_key(self.model, prefix, config),
+                  len(prefix), (usage and usage.total_token_count) or 0)
+        return True
+
+    def _reusable(self, handle, config, prefix):
+        """Whether ``handle`` starts ``prefix`` and is worth keeping.
+
+        It is replaced once the part of the prefix it doesn't cover (the
+        turns since it was created) would make a cache of its own.
+        """
+        length = handle["prefix_length"]
+        if length > len(prefix) or handle["key"] != cache_key(
+                self.model, prefix[:length], config):
+            return False
+        uncached = sum(content_chars(content) for content in prefix[length:])
+        return uncached / DEFAULT_CHARS_PER_TOKEN < self.min_tokens
+
+    def _use(self, config, name, key, prefix_length, tokens):
+        self.name = name
+        self.key = key
+        self.prefix_length = prefix_length
+        self.tokens = tokens
+        # What the cache holds can't be sent again alongside it.
+        self._config = config.model_copy(update={
+            "system_instruction": None,
+            "tools": None,
+            "tool_config": None,
+            "cached_content": name,
+        })
+
+    def request(self, contents):
+        """Return (config, contents) to send for the full ``contents``."""
+        return self._config, contents[self.prefix_length:]
+
+    def observe(self, usage):
+        """Count the prompt tokens one response says came from the cache."""
+        self.requests += 1
+        cached = getattr(usage, "cached_content_token_count", None)
+        self.tokens_saved += self.tokens if cached is None else cached
+
+    def handle(self):
+        """Return what a later run needs to reuse this cache, or None."""
+        if self.name is None:
+            return None
+        return {"name": self.name, "key": self.key,
+                "prefix_length": self.prefix_length, "tokens": self.tokens}
+
+    def summary(self):
+        if self.name is None:
+            return "Context cache: not used"
+        return (f"Context cache: {self.name} "
+                f"({'created' if self.created else 'reused'}, "
+                f"{self.tokens} tokens), {self.tokens_saved} prompt tokens "
+                f"served from it over {self.requests} requests")
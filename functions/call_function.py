@@ -1,46 +1,48 @@
-from google.genai import types
-from functions.get_files_info import schema_get_files_info, get_files_info
-from functions.get_file_content import schema_get_file_content, get_file_content
-from functions.run_python_file import schema_run_python_file, run_python_file
-from functions.write_file import schema_write_file, write_file
+# Importing the tool modules registers their tools, in this order.
+from functions import get_files_info, get_file_content  # noqa: F401
+from functions import search_files as search_index
+from functions import run_python_file, run_tests, write_file, edit_file  # noqa: F401
+from functions import registry
 
+# Directory the model's tools operate in; paths it passes are relative to it.
+WORKING_DIRECTORY = "./calculator"
 
-available_functions = types.Tool(
-    function_declarations=[
-        schema_get_files_info,
-        schema_get_file_content,
-        schema_run_python_file,
-        schema_write_file,
-    ],
-)
 
+def __getattr__(name):
+    # The declarations need google.genai, which takes most of a second to
+    # import, so they are only built when a request needs them.
+    if name == "available_functions":
+        return registry.declarations()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def call_function(function_call, verbose=False):
+
+def call_function(function_call, verbose=False,
+                  working_directory=WORKING_DIRECTORY, quiet=False,
+                  file_cache=None):
     """Invoke one of the declared local functions based on a types.FunctionCall.
 
     Args:
         function_call: types.FunctionCall-like object with .name and .args
         verbose: whether to print verbose messages
+        working_directory: directory injected into every tool call
+        quiet: don't print the call at all (used when stdout carries data)
+        file_cache: optional per-session FileCache for the filesystem tools
 
     Returns:
         types.Content containing a single Part.from_function_response with
         the function result placed under the "result" key.
     """
+    from google.genai import types
 
     function_name = function_call.name or ""
-    if verbose:
-        print(f"Calling function: {function_call.name}({function_call.args})")
-    else:
-        print(f" - Calling function: {function_call.name}")
-
-    function_map = {
-        "get_files_info": get_files_info,
-        "get_file_content": get_file_content,
-        "run_python_file": run_python_file,
-        "write_file": write_file,
-    }
+    if not quiet:
+        if verbose:
+            print(f"Calling function: {function_call.name}({function_call.args})")
+        else:
+            print(f" - Calling function: {function_call.name}")
 
-    if function_name not in function_map:
+    tool = registry.get(function_name)
+    if tool is None:
         return types.Content(
             role="tool",
             parts=[
@@ -53,13 +55,30 @@ def call_function(function_call, verbose=False):
 
     args = dict(function_call.args) if function_call.args else {}
     # Ensure working directory is correct for all calls
-    args["working_directory"] = "./calculator"
+    args["working_directory"] = working_directory
+    if tool.cached:
+        args["cache"] = file_cache
 
     try:
-        function_result = function_map[function_name](**args)
+        function_result = tool.function(**args)
     except Exception as e:
         function_result = f"Error calling function {function_name}: {e}"
 
+    # Keep the search index in step with the tools' own writes.
+    if tool.writes and "file_path" in args:
+        search_index.file_written(working_directory, args["file_path"])
+    elif tool.runs_code:
+        search_index.files_changed(working_directory)
+
+    if file_cache is not None:
+        if tool.writes and "file_path" in args:
+            _, target_path, _ = file_cache.resolve(
+                working_directory, args["file_path"])
+            file_cache.invalidate(target_path)
+        elif tool.runs_code:
+            # The script may have written anywhere in the working directory.
+            file_cache.invalidate_listings()
+
     return types.Content(
         role="tool",
         parts=[
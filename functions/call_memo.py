@@ -0,0 +1,88 @@
+"""Answer a session's repeated tool calls from their earlier results.
+
+A call repeats an earlier one when its name and arguments are the same.
+Only calls that can't change anything the earlier result depended on
+are answered this way:
+
+- tools that write a file or run code (``writes`` and ``runs_code``
+  tools) always run, and make every remembered result stale: a script
+  can write files, and its own output can depend on the clock, random
+  numbers or what it changed the last time;
+- anything else (reads, listings, searches) is remembered until one of
+  the above runs.
+
+The repeated result carries a note saying so, which is usually what the
+model needs to stop asking.
+"""
+import json
+import threading
+
+from functions import registry
+
+REPEAT_NOTE = (
+    "This call is identical to an earlier one and nothing has changed "
+    "since, so this is its earlier result. Calling it again will not "
+    "give a different answer."
+)
+
+
+def call_key(function_call):
+    return json.dumps(
+        [function_call.name, function_call.args or {}],
+        sort_keys=True, default=str)
+
+
+def is_repeat(content):
+    """True if ``content`` is a result answered by a CallMemo."""
+    response = content.parts[0].function_response.response or {}
+    return response.get("note") == REPEAT_NOTE
+
+
+class CallMemo:
+    """Earlier tool results of one session, keyed on the call.
+
+    ``lookup`` is called as each call is scheduled, in the model's order,
+    and ``begin`` for the ones that will run; ``store`` is called with the
+    result once it is ready. A result is only stored if nothing stale-
+    making was scheduled after its call, so calls running concurrently
+    can't bring back a result from before a write.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._results = {}
+        self._generation = 0
+
+    def lookup(self, function_call):
+        """Return the earlier result of an identical call, or None."""
+        from google.genai import types
+
+        with self._lock:
+            content = self._results.get(call_key(function_call))
+            if content is None:
+                return None
+            self.hits += 1
+        part = content.parts[0].function_response
+        return types.Content(role=content.role, parts=[
+            types.Part.from_function_response(
+                name=part.name, response={**part.response, "note": REPEAT_NOTE})])
+
+    def begin(self, function_call):
+        """Note that ``function_call`` is about to run; returns a token for ``store``."""
+        tool = registry.get(function_call.name or "")
+        if tool is None:
+            return None
+        with self._lock:
+            if tool.writes or tool.runs_code:
+                self._results.clear()
+                self._generation += 1
+                return None
+            return self._generation
+
+    def store(self, function_call, token, content):
+        if token is None:
+            return
+        with self._lock:
+            if token == self._generation:
+                self._results[call_key(function_call)] = content
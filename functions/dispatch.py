@@ -0,0 +1,195 @@
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from functions import registry
+from functions.call_function import WORKING_DIRECTORY, call_function
+from functions.result_budget import shape_results
+
+
+def _tool_flag(function_call, flag):
+    tool = registry.get(function_call.name)
+    return tool is not None and getattr(tool, flag)
+
+
+def _call_path(function_call):
+    """Return the normalized path a call touches, or "." for the whole tree."""
+    args = function_call.args or {}
+    if _tool_flag(function_call, "runs_code"):
+        # A script may read anything under the working directory.
+        return "."
+    path = args.get("file_path") or args.get("directory") or "."
+    return os.path.normpath(str(path))
+
+
+def _paths_overlap(a, b):
+    if a == "." or b == ".":
+        return True
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def _modifies(function_call):
+    return _tool_flag(function_call, "writes") or _tool_flag(function_call, "runs_code")
+
+
+def _conflicts(earlier, later):
+    # Any call touching a path a write touches must wait for it (and vice
+    # versa) to keep the model's order. A script may write anywhere, so
+    # reads and writes are ordered around it; scripts the model asked for
+    # together still run side by side.
+    if _tool_flag(earlier, "runs_code") and _tool_flag(later, "runs_code"):
+        return False
+    if not (_modifies(earlier) or _modifies(later)):
+        return False
+    return _paths_overlap(_call_path(earlier), _call_path(later))
+
+
+class FunctionCallDispatcher:
+    """Run function calls on bounded thread pools.
+
+    Calls are submitted in the order the model requested them. Independent
+    calls run concurrently (I/O tools and subprocess tools have separate
+    limits), while a call that conflicts with an earlier one, like a read
+    of a path that an earlier write_file or edit_file touches, waits for it
+    to finish. With ``serial=True`` every call waits for the one before it,
+    which keeps sequential semantics while still running off the caller's
+    thread. ``result_budget``, if given, is the characters of results that
+    one ``results()`` call may return in total (see result_budget).
+    ``memo`` is an optional CallMemo answering repeated calls without
+    running them.
+    """
+
+    def __init__(self, verbose=False, working_directory=WORKING_DIRECTORY,
+                 max_io_workers=4, max_subprocess_workers=2, serial=False,
+                 quiet=False, file_cache=None, result_budget=None, memo=None):
+        self.verbose = verbose
+        self.memo = memo
+        self.result_budget = result_budget
+        self.quiet = quiet
+        self.file_cache = file_cache
+        self.serial = serial
+        self.working_directory = working_directory
+        self._io_pool = ThreadPoolExecutor(
+            max_workers=max_io_workers, thread_name_prefix="tool-io")
+        self._subprocess_pool = ThreadPoolExecutor(
+            max_workers=max_subprocess_workers, thread_name_prefix="tool-proc")
+        self._submitted = []
+
+    def submit(self, function_call):
+        """Schedule one call and return its future of (Content, seconds)."""
+        token = None
+        if self.memo is not None:
+            repeat = self.memo.lookup(function_call)
+            if repeat is not None:
+                future = Future()
+                future.set_result((repeat, 0.0))
+                self._submitted.append((function_call, future))
+                return future
+            token = self.memo.begin(function_call)
+        if self.serial:
+            deps = [future for _, future in self._submitted[-1:]]
+        else:
+            deps = [
+                future for earlier, future in self._submitted
+                if _conflicts(earlier, function_call)
+            ]
+        # Scripts get their own, smaller pool so a few long-running ones
+        # can't starve the cheap filesystem reads.
+        if _tool_flag(function_call, "runs_code"):
+            pool = self._subprocess_pool
+        else:
+            pool = self._io_pool
+        future = pool.submit(self._run, function_call, deps, token)
+        self._submitted.append((function_call, future))
+        return future
+
+    def results(self):
+        """Wait for every submitted call and return results in request order."""
+        submitted, self._submitted = self._submitted, []
+        results = [future.result() for _, future in submitted]
+        if self.result_budget is not None:
+            results = shape_results(results, self.result_budget)
+        return results
+
+    def close(self):
+        self._io_pool.shutdown(wait=True)
+        self._subprocess_pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self, function_call, deps, token):
+        # Dependencies were submitted earlier, so they are already running
+        # or queued ahead of us in FIFO order; waiting here can't deadlock.
+        wait(deps)
+        result = _timed_call(
+            function_call, self.verbose, self.working_directory, self.quiet,
+            self.file_cache)
+        if self.memo is not None:
+            self.memo.store(function_call, token, result[0])
+        return result
+
+
+def _timed_call(function_call, verbose, working_directory, quiet=False,
+                file_cache=None):
+    start = time.perf_counter()
+    result = call_function(
+        function_call, verbose=verbose, working_directory=working_directory,
+        quiet=quiet, file_cache=file_cache)
+    return result, time.perf_counter() - start
+
+
+def _memo_call(function_call, verbose, working_directory, quiet, file_cache,
+               memo):
+    if memo is None:
+        return _timed_call(
+            function_call, verbose, working_directory, quiet, file_cache)
+    repeat = memo.lookup(function_call)
+    if repeat is not None:
+        return repeat, 0.0
+    token = memo.begin(function_call)
+    result = _timed_call(
+        function_call, verbose, working_directory, quiet, file_cache)
+    memo.store(function_call, token, result[0])
+    return result
+
+
+def dispatch_function_calls(function_calls, verbose=False,
+                            working_directory=WORKING_DIRECTORY,
+                            parallel=False, max_io_workers=4,
+                            max_subprocess_workers=2, quiet=False,
+                            file_cache=None, result_budget=None, memo=None):
+    """Run a turn's function calls and return [(Content, seconds), ...].
+
+    Results are always in the order of ``function_calls``. With
+    ``parallel=False`` the calls run one after another on this thread.
+    With a ``result_budget`` the results are shaped to fit that many
+    characters between them. With a ``memo`` (a CallMemo), repeats of
+    earlier calls are answered from it instead of running.
+    """
+    if not parallel or len(function_calls) < 2:
+        results = [
+            _memo_call(function_call, verbose, working_directory, quiet,
+                       file_cache, memo)
+            for function_call in function_calls
+        ]
+        if result_budget is not None:
+            results = shape_results(results, result_budget)
+        return results
+
+    with FunctionCallDispatcher(
+        verbose=verbose,
+        working_directory=working_directory,
+        max_io_workers=max_io_workers,
+        max_subprocess_workers=max_subprocess_workers,
+        quiet=quiet,
+        file_cache=file_cache,
+        result_budget=result_budget,
+        memo=memo,
+    ) as dispatcher:
+        for function_call in function_calls:
+            dispatcher.submit(function_call)
+        return dispatcher.results()
@@ -0,0 +1,208 @@
+import os
+import re
+import tempfile
+from typing import Annotated
+
+from functions.registry import tool
+
+_HUNK_HEADER = re.compile(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class PatchError(Exception):
+    pass
+
+
+def _parse_diff(diff):
+    """Split a unified diff into hunks of (old_start, [(kind, text), ...]).
+
+    "--- " and "+++ " lines are file headers only outside a hunk: before
+    the first one, or once a hunk has as many old and new lines as its
+    header says. Inside a hunk they remove a line starting "-- " or add
+    one starting "++ ".
+    """
+    hunks = []
+    lines = None
+    old_left = new_left = 0
+    for line in diff.splitlines():
+        match = _HUNK_HEADER.match(line)
+        if match:
+            lines = []
+            hunks.append((int(match.group(1)), lines))
+            old_left = int(match.group(2) or 1)
+            new_left = int(match.group(4) or 1)
+            continue
+        if lines is None or (line.startswith(("--- ", "+++ "))
+                             and old_left <= 0 and new_left <= 0):
+            # File headers and anything before the first hunk.
+            continue
+        if line.startswith("\\"):
+            # "\ No newline at end of file"
+            continue
+        if line[:1] in (" ", "-", "+"):
+            lines.append((line[0], line[1:]))
+        elif line == "":
+            # Some tools drop the space on empty context lines.
+            lines.append((" ", ""))
+        else:
+            raise PatchError(f"unexpected line in diff: {line!r}")
+        kind = lines[-1][0]
+        old_left -= kind != "+"
+        new_left -= kind != "-"
+    if not hunks:
+        raise PatchError("no hunks found; expected lines starting with @@")
+    return hunks
+
+
+def _find_block(lines, block, expected, start):
+    """Index where ``block`` matches ``lines``, nearest to ``expected``."""
+    stripped = [line.rstrip("\r\n") for line in lines]
+    last = len(lines) - len(block)
+    for distance in range(0, len(lines) + 1):
+        for pos in (expected - distance, expected + distance):
+            if start <= pos <= last and stripped[pos:pos + len(block)] == block:
+                return pos
+        if expected - distance < start and expected + distance > last:
+            break
+    return None
+
+
+def _apply_diff(text, diff):
+    """Apply a unified diff to ``text``; returns (text, removed, added)."""
+    lines = text.splitlines(keepends=True)
+    newline = "\r\n" if lines and lines[0].endswith("\r\n") else "\n"
+    ends_with_newline = not lines or lines[-1].endswith(("\n", "\r"))
+
+    result = []
+    pos = 0
+    removed = added = 0
+    for number, (old_start, hunk) in enumerate(_parse_diff(diff), 1):
+        old = [line_text for kind, line_text in hunk if kind != "+"]
+        if old:
+            found = _find_block(lines, old, old_start - 1, pos)
+        else:
+            # Pure insertion: "@@ -N,0" inserts after line N.
+            found = old_start if pos <= old_start <= len(lines) else None
+        if found is None:
+            raise PatchError(
+                f"hunk {number} (@@ -{old_start}) does not match the file; "
+                f"re-read the file and try again")
+
+        result.extend(lines[pos:found])
+        cursor = found
+        for kind, line_text in hunk:
+            if kind == " ":
+                result.append(lines[cursor])
+                cursor += 1
+            elif kind == "-":
+                cursor += 1
+                removed += 1
+            else:
+                result.append(line_text + newline)
+                added += 1
+        pos = cursor
+
+    result.extend(lines[pos:])
+    # A line that used to be last may no longer be; the file keeps
+    # whether it ends with a newline.
+    for i in range(len(result) - 1):
+        if not result[i].endswith(("\n", "\r")):
+            result[i] += newline
+    new_text = "".join(result)
+    if not ends_with_newline and new_text.endswith(newline):
+        new_text = new_text[:-len(newline)]
+    return new_text, removed, added
+
+
+def _replace(text, old_string, new_string, replace_all):
+    """Exact string replacement; returns (text, occurrences)."""
+    if not old_string:
+        raise PatchError("old_string must not be empty")
+    count = text.count(old_string)
+    if count == 0 and "\r\n" in text and "\n" in old_string:
+        # The model writes "\n"; match a file with Windows line endings.
+        old_string = old_string.replace("\n", "\r\n")
+        new_string = new_string.replace("\n", "\r\n")
+        count = text.count(old_string)
+    if count == 0:
+        raise PatchError("old_string was not found in the file")
+    if count > 1 and not replace_all:
+        raise PatchError(
+            f"old_string occurs {count} times; include more surrounding "
+            f"text to make it unique, or set replace_all")
+    return text.replace(old_string, new_string), count
+
+
+def _write_atomic(target_path, text):
+    """Replace the file with ``text`` via a temporary file and a rename."""
+    mode = os.stat(target_path).st_mode
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(target_path), prefix=".edit-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        os.chmod(tmp_path, mode & 0o7777)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@tool(
+    "Edits an existing file relative to the working directory, either by replacing an exact string or by applying a unified diff. Prefer this over write_file for changes to existing files: only the change is sent, and the edit fails without writing anything if the file doesn't match",
+    writes=True,
+)
+def edit_file(
+    working_directory,
+    file_path: Annotated[str, "Path to the file to edit, relative to the working directory"],
+    old_string: Annotated[str | None, "Exact text to replace, including whitespace; it must occur exactly once unless replace_all is set"] = None,
+    new_string: Annotated[str | None, "Text to put in place of old_string"] = None,
+    replace_all: Annotated[bool, "Replace every occurrence of old_string (default false)"] = False,
+    diff: Annotated[str | None, "Unified diff to apply instead of old_string/new_string; each hunk's context and removed lines must match the file"] = None,
+):
+    try:
+        working_dir_abs = os.path.abspath(working_directory)
+        target_path = os.path.normpath(
+            os.path.join(working_dir_abs, file_path))
+
+        # Ensure target_path is inside working_directory
+        if os.path.commonpath([working_dir_abs, target_path]) != working_dir_abs:
+            return f'Error: Cannot edit "{file_path}" as it is outside the permitted working directory'
+
+        if not os.path.isfile(target_path):
+            return f'Error: File not found or is not a regular file: "{file_path}"'
+
+        if (diff is None) == (old_string is None):
+            return 'Error: Pass either old_string and new_string, or diff'
+
+        # newline="" keeps line endings as they are on disk.
+        try:
+            with open(target_path, "r", encoding="utf-8", newline="") as f:
+                text = f.read()
+        except UnicodeDecodeError:
+            return f'Error: "{file_path}" is not a UTF-8 text file'
+
+        try:
+            if diff is not None:
+                new_text, removed, added = _apply_diff(text, diff)
+                change = f"removed {removed} and added {added} lines"
+            else:
+                new_text, count = _replace(
+                    text, old_string, new_string or "", replace_all)
+                change = f"replaced {count} occurrence{'s' if count > 1 else ''}"
+        except PatchError as e:
+            return f'Error: Could not edit "{file_path}": {e}'
+
+        if new_text == text:
+            return f'No changes made to "{file_path}"'
+
+        try:
+            _write_atomic(target_path, new_text)
+        except OSError as e:
+            return f'Error: {e}'
+
+        return f'Successfully edited "{file_path}": {change} ({len(new_text)} characters now)'
+    except Exception as e:
+        return f'Error: {e}'
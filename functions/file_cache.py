@@ -0,0 +1,68 @@
+import os
+import threading
+
+
+class FileCache:
+    """Per-session cache behind get_file_content and get_files_info.
+
+    File contents are keyed on the resolved path and validated against the
+    file's mtime and size, so a repeat read of an unchanged file costs one
+    os.stat. Directory listings are validated against the directory's
+    mtime, which doesn't change when a file inside it is rewritten, so
+    callers must report writes through ``invalidate`` (write_file and
+    edit_file) or ``invalidate_listings`` (scripts that may have written
+    anything).
+    """
+
+    def __init__(self):
+        self.reads_saved = 0
+        self._lock = threading.Lock()
+        self._resolved = {}
+        self._contents = {}
+        self._listings = {}
+
+    def resolve(self, working_directory, path):
+        """Return (working_dir_abs, target_path, inside) for a tool path."""
+        key = (working_directory, path)
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            working_dir_abs = os.path.abspath(working_directory)
+            target_path = os.path.normpath(os.path.join(working_dir_abs, path))
+            inside = os.path.commonpath(
+                [working_dir_abs, target_path]) == working_dir_abs
+            resolved = (working_dir_abs, target_path, inside)
+            self._resolved[key] = resolved
+        return resolved
+
+    def get_content(self, target_path, st):
+        return self._lookup(self._contents, target_path, st)
+
+    def put_content(self, target_path, st, content):
+        with self._lock:
+            self._contents[target_path] = (st.st_mtime_ns, st.st_size, content)
+
+    def get_listing(self, target_dir, st):
+        return self._lookup(self._listings, target_dir, st)
+
+    def put_listing(self, target_dir, st, listing):
+        with self._lock:
+            self._listings[target_dir] = (st.st_mtime_ns, st.st_size, listing)
+
+    def invalidate(self, target_path):
+        """Forget a written file and the listing of its directory."""
+        with self._lock:
+            self._contents.pop(target_path, None)
+            self._listings.pop(target_path, None)
+            self._listings.pop(os.path.dirname(target_path), None)
+
+    def invalidate_listings(self):
+        with self._lock:
+            self._listings.clear()
+
+    def _lookup(self, entries, path, st):
+        with self._lock:
+            entry = entries.get(path)
+            if entry is None or entry[:2] != (st.st_mtime_ns, st.st_size):
+                return None
+            self.reads_saved += 1
+            return entry[2]
@@ -1,54 +1,198 @@
+import io
+import mmap
 import os
+import stat
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Annotated
 
-# Try to import google.genai types for schema declaration; tests/envs
-# without the package should still be able to import this module.
-try:
-    from google.genai import types
-except Exception:
-    types = None
+from functions.registry import tool
 
 MAX_CHARS = 10000
 
+# A NUL byte in the first SNIFF_BYTES marks a file as binary.
+SNIFF_BYTES = 8192
 
-def get_file_content(working_directory, file_path):
+# Line-offset indexes of recently read files, keyed by path and checked
+# against mtime/size, so repeated line-range reads don't rescan the file.
+LINE_INDEX_CACHE_SIZE = 16
+_line_indexes = OrderedDict()
+_line_indexes_lock = threading.Lock()
+
+
+class _LineIndex:
+    """Byte offsets of line starts, extended lazily as far as requested."""
+
+    def __init__(self):
+        self.starts = array("q", [0])
+        self.scanned_to = 0
+        self.complete = False
+        self.lock = threading.Lock()
+
+    def ensure(self, mm, line_count):
+        """Index at least ``line_count`` + 1 line starts (or the whole file)."""
+        with self.lock:
+            find = mm.find
+            starts = self.starts
+            pos = self.scanned_to
+            while len(starts) <= line_count and not self.complete:
+                newline = find(b"\n", pos)
+                if newline < 0:
+                    self.complete = True
+                    pos = len(mm)
+                    break
+                pos = newline + 1
+                starts.append(pos)
+            self.scanned_to = pos
+
+    def line_total(self, size):
+        """Number of lines, once the index is complete."""
+        return len(self.starts) - (1 if self.starts[-1] >= size else 0)
+
+
+def _line_index(target_path, st):
+    key = (st.st_mtime_ns, st.st_size)
+    with _line_indexes_lock:
+        entry = _line_indexes.get(target_path)
+        if entry is None or entry[0] != key:
+            entry = (key, _LineIndex())
+            _line_indexes[target_path] = entry
+        _line_indexes.move_to_end(target_path)
+        while len(_line_indexes) > LINE_INDEX_CACHE_SIZE:
+            _line_indexes.popitem(last=False)
+        return entry[1]
+
+
+def _is_binary(sample):
+    return b"\0" in sample
+
+
+def _char_bounds(mm, start, end):
+    """Move [start, end) off the middle of UTF-8 sequences."""
+    while start < end and (mm[start] & 0xC0) == 0x80:
+        start += 1
+    if end < len(mm):
+        while end > start and (mm[end] & 0xC0) == 0x80:
+            end -= 1
+    return start, end
+
+
+def _read_range(target_path, st, file_path, offset, length, start_line, end_line):
+    """Serve a byte or line range from a memory-mapped file."""
+    if st.st_size == 0:
+        return ""
+    with open(target_path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if _is_binary(mm[:SNIFF_BYTES]):
+            return f'Error: "{file_path}" appears to be a binary file'
+
+        if start_line is None and end_line is None:
+            offset = int(offset or 0)
+            length = MAX_CHARS if length is None else min(int(length), MAX_CHARS)
+            if offset < 0 or length < 0:
+                return 'Error: offset and length must not be negative'
+            if offset >= st.st_size:
+                return f'Error: offset {offset} is past the end of "{file_path}" ({st.st_size} bytes)'
+            start, end = _char_bounds(mm, offset, min(offset + length, st.st_size))
+            content = mm[start:end].decode("utf-8", errors="replace")
+            if end < st.st_size:
+                content += f'[...Read bytes {start}-{end} of {st.st_size} in "{file_path}"]'
+            return content
+
+        start_line = int(start_line or 1)
+        if start_line < 1:
+            return 'Error: start_line must be at least 1'
+        if end_line is not None:
+            end_line = int(end_line)
+            if end_line < start_line:
+                return 'Error: end_line must not be before start_line'
+
+        index = _line_index(target_path, st)
+        index.ensure(mm, start_line if end_line is None else end_line)
+        starts = index.starts
+        if start_line > len(starts) or starts[start_line - 1] >= st.st_size:
+            index.ensure(mm, st.st_size)
+            return f'Error: start_line {start_line} is past the end of "{file_path}" ({index.line_total(st.st_size)} lines)'
+
+        start = starts[start_line - 1]
+        if end_line is not None and end_line < len(starts):
+            stop = starts[end_line]
+        else:
+            stop = st.st_size
+        start, end = _char_bounds(mm, start, min(stop, start + MAX_CHARS))
+        content = mm[start:end].decode("utf-8", errors="replace")
+        if end < stop:
+            content += f'[...Truncated at {MAX_CHARS} characters; continue from byte offset {end} of "{file_path}"]'
+        return content
+
+
+@tool(
+    f"Reads and returns the contents of a file relative to the working directory, truncating very large files. Returns at most {MAX_CHARS} characters; use a line range or byte range to read further into a large file",
+)
+def get_file_content(
+    working_directory,
+    file_path: Annotated[str, "Path to the file to read, relative to the working directory"],
+    cache=None,
+    offset: Annotated[int | None, "Optional byte offset to start reading at (ignored when a line range is given)"] = None,
+    length: Annotated[int | None, f"Optional number of bytes to read from offset (at most {MAX_CHARS})"] = None,
+    start_line: Annotated[int | None, "Optional first line to return (1-based)"] = None,
+    end_line: Annotated[int | None, "Optional last line to return (inclusive)"] = None,
+):
     try:
-        working_dir_abs = os.path.abspath(working_directory)
-        target_path = os.path.normpath(
-            os.path.join(working_dir_abs, file_path))
+        if cache is not None:
+            working_dir_abs, target_path, inside = cache.resolve(
+                working_directory, file_path)
+        else:
+            working_dir_abs = os.path.abspath(working_directory)
+            target_path = os.path.normpath(
+                os.path.join(working_dir_abs, file_path))
+            inside = os.path.commonpath(
+                [working_dir_abs, target_path]) == working_dir_abs
 
         # Ensure target_path is inside working_directory
-        if os.path.commonpath([working_dir_abs, target_path]) != working_dir_abs:
+        if not inside:
             return f'Error: Cannot read "{file_path}" as it is outside the permitted working directory'
 
-        if not os.path.isfile(target_path):
+        try:
+            st = os.stat(target_path)
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
             return f'Error: File not found or is not a regular file: "{file_path}"'
 
-        # Read up to MAX_CHARS and detect truncation
-        try:
-            with open(target_path, "r", encoding="utf-8", errors="replace") as f:
-                content = f.read(MAX_CHARS)
-                if f.read(1):
-                    content += f'[...File "{file_path}" truncated at {MAX_CHARS} characters]'
-            return content
-        except OSError as e:
-            return f'Error: {e}'
-    except Exception as e:
-        return f'Error: {e}'
+        if any(v is not None for v in (offset, length, start_line, end_line)):
+            try:
+                return _read_range(target_path, st, file_path, offset, length,
+                                   start_line, end_line)
+            except OSError as e:
+                return f'Error: {e}'
 
+        cached = cache.get_content(target_path, st) if cache is not None else None
+        if cached is not None:
+            content, truncated = cached
+        else:
+            # Read up to MAX_CHARS and detect truncation; content is None
+            # for a binary file.
+            try:
+                with open(target_path, "rb") as raw:
+                    if _is_binary(raw.read(SNIFF_BYTES)):
+                        content, truncated = None, False
+                    else:
+                        raw.seek(0)
+                        f = io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+                        content = f.read(MAX_CHARS)
+                        truncated = bool(f.read(1))
+                        f.detach()
+            except OSError as e:
+                return f'Error: {e}'
+            if cache is not None:
+                cache.put_content(target_path, st, (content, truncated))
 
-if types is not None:
-    schema_get_file_content = types.FunctionDeclaration(
-        name="get_file_content",
-        description="Reads and returns the contents of a file relative to the working directory, truncating very large files",
-        parameters=types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                "file_path": types.Schema(
-                    type=types.Type.STRING,
-                    description="Path to the file to read, relative to the working directory",
-                ),
-            },
-        ),
-    )
-else:
-    schema_get_file_content = None
+        if content is None:
+            return f'Error: "{file_path}" appears to be a binary file'
+        if truncated:
+            content += f'[...File "{file_path}" truncated at {MAX_CHARS} characters]'
+        return content
+    except Exception as e:
+        return f'Error: {e}'
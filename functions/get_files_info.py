@@ -1,55 +1,169 @@
 import os
+import stat
+from typing import Annotated
 
-# Try to import google.genai types for schema declaration; tests/envs
-# without the package should still be able to import this module.
-try:
-    from google.genai import types
-except Exception:
-    types = None
+from functions.gitignore import Pattern, match_any, read_gitignore
+from functions.registry import tool
 
 
-def get_files_info(working_directory, directory="."):
+# Entries returned per call unless the model asks for another limit.
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+
+
+def _patterns(value):
+    """Compile include/exclude globs; the model may send one string."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    return [Pattern(pattern) for pattern in value]
+
+
+def _walk(dir_path, prefix, ignore_prefix, depth, options, ignored, after):
+    """Yield (rel_path, entry) under ``dir_path`` in sorted pre-order.
+
+    ``after`` holds the path components of a continuation cursor while the
+    walk is still on the cursor's path; subtrees sorting before it are
+    skipped without being scanned.
+    """
+    max_depth, include, exclude, gitignore = options
     try:
-        working_dir_abs = os.path.abspath(working_directory)
-        target_dir = os.path.normpath(os.path.join(working_dir_abs, directory))
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return
+
+    if gitignore and any(entry.name == ".gitignore" for entry in entries):
+        ignored = ignored + read_gitignore(dir_path, ignore_prefix)
+
+    for entry in entries:
+        name = entry.name
+        sub_after = None
+        if after is not None:
+            if name < after[depth]:
+                continue
+            if name == after[depth]:
+                if len(after) > depth + 1:
+                    sub_after = after
+            else:
+                after = None
+
+        rel_path = prefix + name
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if gitignore and (name == ".git" or match_any(
+                ignored, ignore_prefix + name, is_dir)):
+            continue
+        if exclude and match_any(exclude, rel_path, is_dir):
+            continue
+
+        if after is None and (not include or match_any(include, rel_path, is_dir)):
+            yield rel_path, entry
+        if (depth + 1 < max_depth and is_dir
+                and not entry.is_symlink()):
+            yield from _walk(entry.path, rel_path + "/", ignore_prefix + name + "/",
+                             depth + 1, options, ignored, sub_after)
+
+
+@tool(
+    f"Lists files in a specified directory relative to the working directory, providing file size and directory status. Can walk subdirectories too, in sorted order, skipping .gitignore'd entries; at most {DEFAULT_LIMIT} entries are returned per call unless a limit is given, with a cursor to continue from",
+)
+def get_files_info(
+    working_directory,
+    directory: Annotated[str, "Directory path to list files from, relative to the working directory (default is the working directory itself)"] = ".",
+    cache=None,
+    max_depth: Annotated[int, "Directory levels to list: 1 (default) lists only the directory's own entries; use a large value to map the whole tree"] = 1,
+    include: Annotated[list[str] | None, 'Optional globs an entry must match to be listed, such as "*.py" (name) or "pkg/**/*.py" (path); subdirectories are still walked'] = None,
+    exclude: Annotated[list[str] | None, "Optional globs of entries to leave out; excluded directories are not walked"] = None,
+    gitignore: Annotated[bool, "Skip entries ignored by .gitignore files, and .git itself (default true)"] = True,
+    limit: Annotated[int | None, f"Maximum entries to return (default {DEFAULT_LIMIT}, at most {MAX_LIMIT})"] = None,
+    cursor: Annotated[str | None, "Cursor from a previous listing that stopped early, to continue after it"] = None,
+):
+    try:
+        if cache is not None:
+            working_dir_abs, target_dir, inside = cache.resolve(
+                working_directory, directory)
+        else:
+            working_dir_abs = os.path.abspath(working_directory)
+            target_dir = os.path.normpath(os.path.join(working_dir_abs, directory))
+            inside = os.path.commonpath(
+                [working_dir_abs, target_dir]) == working_dir_abs
 
         # Ensure target_dir is inside working_directory
-        if os.path.commonpath([working_dir_abs, target_dir]) != working_dir_abs:
+        if not inside:
             return f'Error: Cannot list "{directory}" as it is outside the permitted working directory'
 
-        if not os.path.isdir(target_dir):
+        try:
+            dir_stat = os.stat(target_dir)
+        except OSError:
+            dir_stat = None
+        if dir_stat is None or not stat.S_ISDIR(dir_stat.st_mode):
             return f'Error: "{directory}" is not a directory'
 
+        max_depth = int(max_depth)
+        limit = DEFAULT_LIMIT if limit is None else int(limit)
+        if max_depth < 1 or limit < 1:
+            return 'Error: max_depth and limit must be at least 1'
+        limit = min(limit, MAX_LIMIT)
+
+        # Only the plain one-level listing is cached: a deeper one can go
+        # stale without the top directory's mtime changing.
+        cacheable = (cache is not None and max_depth == 1 and not include
+                     and not exclude and gitignore and cursor is None
+                     and limit == DEFAULT_LIMIT)
+        if cacheable:
+            listing = cache.get_listing(target_dir, dir_stat)
+            if listing is not None:
+                return listing
+
+        # .gitignore files between the working directory and the listed
+        # directory apply too; paths are matched relative to the former.
+        ignored = []
+        ignore_prefix = ""
+        if gitignore:
+            rel_dir = os.path.relpath(target_dir, working_dir_abs)
+            parts = [] if rel_dir == "." else rel_dir.split(os.sep)
+            path = working_dir_abs
+            for part in parts:
+                ignored += read_gitignore(path, ignore_prefix)
+                path = os.path.join(path, part)
+                ignore_prefix += part + "/"
+
+        after = tuple(cursor.strip("/").split("/")) if cursor else None
+        options = (max_depth, _patterns(include), _patterns(exclude), gitignore)
+
         items = []
-        for name in sorted(os.listdir(target_dir)):
-            path = os.path.join(target_dir, name)
+        last_path = None
+        more = False
+        for rel_path, entry in _walk(target_dir, "", ignore_prefix, 0, options,
+                                     ignored, after):
+            if len(items) == limit:
+                more = True
+                break
+            # One stat per returned entry (DirEntry caches it); an entry
+            # that can't be stat'ed (such as a dangling symlink) is a
+            # zero-size non-directory, as before.
             try:
-                is_dir = os.path.isdir(path)
-                size = os.path.getsize(path) if os.path.exists(path) else 0
-            except OSError as e:
-                return f'Error: {e}'
+                st = entry.stat()
+            except OSError:
+                is_dir, size = False, 0
+            else:
+                is_dir, size = stat.S_ISDIR(st.st_mode), st.st_size
+
+            items.append(f'- {rel_path}: file_size={size} bytes, is_dir={is_dir}')
+            last_path = rel_path
 
-            items.append(f'- {name}: file_size={size} bytes, is_dir={is_dir}')
+        if more:
+            items.append(
+                f'[...Listing stopped after {limit} entries; call again with '
+                f'cursor="{last_path}" to continue]')
 
-        return "\n".join(items)
+        listing = "\n".join(items)
+        if cacheable:
+            cache.put_listing(target_dir, dir_stat, listing)
+        return listing
     except Exception as e:
         return f'Error: {e}'
-
-
-if types is not None:
-    # Schema for LLM function declaration
-    schema_get_files_info = types.FunctionDeclaration(
-        name="get_files_info",
-        description="Lists files in a specified directory relative to the working directory, providing file size and directory status",
-        parameters=types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                "directory": types.Schema(
-                    type=types.Type.STRING,
-                    description="Directory path to list files from, relative to the working directory (default is the working directory itself)",
-                ),
-            },
-        ),
-    )
-else:
-    schema_get_files_info = None
@@ -0,0 +1,97 @@
+import os
+import re
+
+
+def _translate(pattern):
+    """Translate a gitignore-style glob into a regular expression.
+
+    ``*`` and ``?`` don't match "/", ``**`` matches across directories.
+    """
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                if pattern.startswith("**/", i):
+                    out.append("(?:.*/)?")
+                    i += 3
+                else:
+                    out.append(".*")
+                    i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body[0] in "!^":
+                    body = "^" + body[1:]
+                out.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class Pattern:
+    """One gitignore-style pattern, relative to the directory ``base``.
+
+    A pattern without a slash matches an entry's name at any depth; one
+    with a slash matches the path from ``base``. A trailing slash only
+    matches directories, and a leading "!" re-includes an entry.
+    """
+
+    def __init__(self, pattern, base=""):
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        self.anchored = "/" in pattern
+        self.base = base
+        self.regex = re.compile(_translate(pattern.lstrip("/")) + r"\Z")
+
+    def matches(self, rel_path, is_dir):
+        """Match a "/"-separated path; ``base`` is a prefix of the same form."""
+        if self.dir_only and not is_dir:
+            return False
+        if not rel_path.startswith(self.base):
+            return False
+        if self.anchored:
+            return self.regex.match(rel_path[len(self.base):]) is not None
+        return self.regex.match(rel_path.rpartition("/")[2]) is not None
+
+
+def match_any(patterns, rel_path, is_dir):
+    """Apply patterns in order; the last one that matches decides."""
+    matched = False
+    for pattern in patterns:
+        if pattern.negate == matched and pattern.matches(rel_path, is_dir):
+            matched = not pattern.negate
+    return matched
+
+
+def read_gitignore(directory, base=""):
+    """Patterns from ``directory``/.gitignore, or [] if there isn't one."""
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="utf-8",
+                  errors="replace") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    patterns = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        patterns.append(Pattern(line, base))
+    return patterns
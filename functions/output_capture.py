@@ -0,0 +1,142 @@
+import os
+import threading
+
+# Per-stream defaults: how much of the start and end of a script's output
+# is kept, and (optionally) how much output kills the script outright.
+OUTPUT_HEAD_BYTES = 16 * 1024
+OUTPUT_TAIL_BYTES = 16 * 1024
+KILL_AFTER_BYTES = None
+
+_READ_SIZE = 64 * 1024
+
+
+def set_output_limits(head_bytes=None, tail_bytes=None, kill_after_bytes=None):
+    """Change the per-stream capture limits used by run_python_file.
+
+    ``kill_after_bytes=None`` turns killing on large output off.
+    """
+    global OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES, KILL_AFTER_BYTES
+    if head_bytes is not None:
+        OUTPUT_HEAD_BYTES = head_bytes
+    if tail_bytes is not None:
+        OUTPUT_TAIL_BYTES = tail_bytes
+    KILL_AFTER_BYTES = kill_after_bytes
+
+
+class BoundedCapture:
+    """Capture one output stream in constant memory.
+
+    The first ``head_bytes`` are kept as-is and the last ``tail_bytes`` in
+    a ring buffer; everything in between is only counted. Once more than
+    ``kill_after_bytes`` have arrived, ``on_limit`` is called once (the
+    caller uses it to kill the process).
+    """
+
+    def __init__(self, name, head_bytes=None, tail_bytes=None,
+                 kill_after_bytes=None, on_limit=None):
+        self.name = name
+        self.head_bytes = OUTPUT_HEAD_BYTES if head_bytes is None else head_bytes
+        self.tail_bytes = OUTPUT_TAIL_BYTES if tail_bytes is None else tail_bytes
+        self.kill_after_bytes = (
+            KILL_AFTER_BYTES if kill_after_bytes is None else kill_after_bytes)
+        self.on_limit = on_limit
+        self.total_bytes = 0
+        self.limit_hit = False
+        self._head = bytearray()
+        self._tail = bytearray(self.tail_bytes)
+        self._tail_start = 0
+        self._tail_len = 0
+
+    def feed(self, data):
+        self.total_bytes += len(data)
+
+        room = self.head_bytes - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+            data = data[room:]
+        if data and self.tail_bytes:
+            self._feed_tail(data)
+
+        if (self.kill_after_bytes is not None and not self.limit_hit
+                and self.total_bytes > self.kill_after_bytes):
+            self.limit_hit = True
+            if self.on_limit is not None:
+                self.on_limit()
+
+    def _feed_tail(self, data):
+        size = self.tail_bytes
+        if len(data) >= size:
+            self._tail[:] = data[-size:]
+            self._tail_start = 0
+            self._tail_len = size
+            return
+        end = (self._tail_start + self._tail_len) % size
+        first = min(len(data), size - end)
+        self._tail[end:end + first] = data[:first]
+        self._tail[:len(data) - first] = data[first:]
+        overflow = self._tail_len + len(data) - size
+        if overflow > 0:
+            self._tail_start = (self._tail_start + overflow) % size
+            self._tail_len = size
+        else:
+            self._tail_len += len(data)
+
+    @property
+    def dropped_bytes(self):
+        return self.total_bytes - len(self._head) - self._tail_len
+
+    def tail(self):
+        end = self._tail_start + self._tail_len
+        if end <= self.tail_bytes:
+            return bytes(self._tail[self._tail_start:end])
+        return bytes(self._tail[self._tail_start:] +
+                     self._tail[:end - self.tail_bytes])
+
+    def text(self):
+        """Decode the kept output, marking where bytes were dropped.
+
+        Newlines are translated like subprocess's text mode does.
+        """
+        head = _decode(bytes(self._head))
+        tail = _decode(self.tail())
+        if not self.dropped_bytes:
+            return head + tail
+        return (
+            f"{head}\n[... {self.dropped_bytes} bytes of {self.name} "
+            f"truncated ({self.total_bytes} bytes total) ...]\n{tail}"
+        )
+
+
+def _decode(data):
+    text = data.decode("utf-8", errors="replace")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _drain(fd, capture):
+    try:
+        while True:
+            data = os.read(fd, _READ_SIZE)
+            if not data:
+                break
+            capture.feed(data)
+    finally:
+        os.close(fd)
+
+
+def start_readers(stdout_fd, stderr_fd, on_limit=None):
+    """Capture two pipes on background threads.
+
+    Returns (stdout_capture, stderr_capture, threads); the threads close the
+    file descriptors when the pipes reach EOF.
+    """
+    captures = (
+        BoundedCapture("stdout", on_limit=on_limit),
+        BoundedCapture("stderr", on_limit=on_limit),
+    )
+    threads = [
+        threading.Thread(target=_drain, args=(fd, capture), daemon=True)
+        for fd, capture in zip((stdout_fd, stderr_fd), captures)
+    ]
+    for thread in threads:
+        thread.start()
+    return captures[0], captures[1], threads
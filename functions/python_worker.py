@@ -0,0 +1,313 @@
+"""Warm worker pool for run_python_file.
+
+Each worker is a long-lived ``python`` process that has already imported
+PRELOAD_MODULES. For every request it forks a clean child that runs the
+script the way ``python script.py args...`` would, with stdout and stderr
+going straight into pipes created by the caller (the pipe ends travel over
+a Unix socket), so per-call cost is a fork instead of interpreter startup.
+
+Run as a script, this module is the worker itself.
+"""
+import atexit
+import json
+import os
+import queue
+import runpy
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import traceback
+
+if __name__ == "__main__":
+    # Started as a worker: make the package importable from the repo root,
+    # as it is in the agent. Children reset sys.path[0] to their script.
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from functions.output_capture import start_readers  # noqa: E402
+
+# Imported once in each worker, so forked children start with them loaded.
+PRELOAD_MODULES = [
+    "argparse",
+    "collections",
+    "json",
+    "math",
+    "re",
+    "unittest",
+]
+
+POOL_SIZE = 2
+
+_MAX_MESSAGE = 65536
+
+
+def is_available():
+    return hasattr(os, "fork") and hasattr(socket, "send_fds")
+
+
+def _read_line(sock, buffer):
+    """Read one newline-terminated message, keeping leftovers in ``buffer``."""
+    while b"\n" not in buffer:
+        data = sock.recv(_MAX_MESSAGE)
+        if not data:
+            raise ConnectionError("python worker closed the connection")
+        buffer.extend(data)
+    line, _, rest = bytes(buffer).partition(b"\n")
+    buffer[:] = rest
+    return json.loads(line)
+
+
+class _Worker:
+    def __init__(self):
+        self.sock, worker_sock = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                ["python", os.path.abspath(__file__), str(worker_sock.fileno())],
+                pass_fds=(worker_sock.fileno(),),
+                stdin=subprocess.DEVNULL,
+            )
+        finally:
+            worker_sock.close()
+        self.buffer = bytearray()
+
+    def run(self, command, cwd, timeout, preload=()):
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        try:
+            request = {"path": command[1], "args": command[2:], "cwd": cwd,
+                       "preload": list(preload)}
+            socket.send_fds(
+                self.sock, [json.dumps(request).encode("utf-8") + b"\n"],
+                [stdout_w, stderr_w])
+        except OSError:
+            for fd in (stdout_r, stderr_r):
+                os.close(fd)
+            raise
+        finally:
+            # The worker has its own copies; closing ours lets reads see EOF.
+            os.close(stdout_w)
+            os.close(stderr_w)
+
+        try:
+            pid = _read_line(self.sock, self.buffer)["pid"]
+        except BaseException:
+            os.close(stdout_r)
+            os.close(stderr_r)
+            raise
+
+        stdout, stderr, readers = start_readers(
+            stdout_r, stderr_r, on_limit=lambda: _kill(pid))
+        try:
+            self.sock.settimeout(timeout)
+            try:
+                returncode = _read_line(self.sock, self.buffer)["returncode"]
+                timed_out = False
+            except socket.timeout:
+                timed_out = True
+                _kill(pid)
+                self.sock.settimeout(None)
+                _read_line(self.sock, self.buffer)
+            finally:
+                self.sock.settimeout(None)
+        finally:
+            for reader in readers:
+                reader.join()
+
+        if timed_out:
+            raise subprocess.TimeoutExpired(command, timeout)
+
+        return subprocess.CompletedProcess(command, returncode, stdout, stderr)
+
+    def close(self):
+        self.sock.close()
+        self.process.wait()
+
+
+def _kill(pid):
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class _Pool:
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._workers = []
+
+    def warm_up(self):
+        with self._lock:
+            while self._started < self.size:
+                self._start_worker()
+
+    def run(self, command, cwd, timeout, preload=()):
+        worker = self._acquire()
+        try:
+            return worker.run(command, cwd, timeout, preload)
+        except (OSError, ValueError, KeyError):
+            # The worker died or the conversation broke; replace it.
+            self._discard(worker)
+            worker = None
+            raise
+        finally:
+            if worker is not None:
+                self._idle.put(worker)
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._started = 0
+        for worker in workers:
+            worker.close()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle.empty() and self._started < self.size:
+                self._start_worker()
+        return self._idle.get()
+
+    def _start_worker(self):
+        worker = _Worker()
+        self._workers.append(worker)
+        self._started += 1
+        self._idle.put(worker)
+
+    def _discard(self, worker):
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+                self._started -= 1
+        worker.sock.close()
+        worker.process.kill()
+        worker.process.wait()
+
+
+_pool = _Pool(POOL_SIZE)
+atexit.register(_pool.close)
+
+
+def reserve(count):
+    """Let ``count`` scripts run at once, starting more workers as needed.
+
+    The pool never shrinks; it keeps POOL_SIZE workers or the most any
+    caller reserved.
+    """
+    with _pool._lock:
+        _pool.size = max(_pool.size, count)
+
+
+def warm_up():
+    """Start the worker processes now instead of on the first request."""
+    _pool.warm_up()
+
+
+def run(command, cwd, timeout, preload=()):
+    """Run ``command`` (["python", script, *args]) in a forked warm worker.
+
+    ``preload`` names installed modules the script will import; the
+    worker imports them first and keeps them for later requests (see
+    _preload).
+
+    Returns a subprocess.CompletedProcess whose stdout/stderr are
+    BoundedCaptures, and raises subprocess.TimeoutExpired like
+    subprocess.run would.
+    """
+    return _pool.run(command, cwd, timeout, preload)
+
+
+def _run_script(target_path, args, cwd):
+    """In the forked child: run a script as ``python target_path *args`` would."""
+    os.chdir(cwd)
+    sys.argv = [target_path, *args]
+    sys.path[0] = os.path.dirname(target_path)
+
+    exit_code = 0
+    try:
+        runpy.run_path(target_path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as e:
+        # Drop the runpy frames so the traceback looks like the script's own.
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != target_path:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    os._exit(exit_code & 0xFF)
+
+
+_preload_skipped = set()
+
+
+def _preload(names):
+    """Import ``names`` into this worker, so its children start with them.
+
+    Only modules installed outside the repository are imported: a script's
+    own modules may change between runs, so each child imports them.
+    Modules that can't be found or fail to import are skipped, for the
+    child to report.
+    """
+    import importlib.util
+
+    root = sys.path[0] + os.sep
+    for name in names:
+        if name in sys.modules or name in _preload_skipped:
+            continue
+        try:
+            spec = importlib.util.find_spec(name)
+            if spec is None or not spec.origin or spec.origin.startswith(root):
+                raise ImportError(name)
+            __import__(name)
+        except Exception:
+            _preload_skipped.add(name)
+
+
+def _serve(sock):
+    for name in PRELOAD_MODULES:
+        __import__(name)
+
+    buffer = bytearray()
+    while True:
+        msg, fds, _, _ = socket.recv_fds(sock, _MAX_MESSAGE, 2)
+        if not msg:
+            return
+        buffer.extend(msg)
+        while b"\n" not in buffer:
+            buffer.extend(sock.recv(_MAX_MESSAGE))
+        line, _, rest = bytes(buffer).partition(b"\n")
+        buffer[:] = rest
+        request = json.loads(line)
+        _preload(request.get("preload", ()))
+
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            os.dup2(fds[0], 1)
+            os.dup2(fds[1], 2)
+            for fd in fds:
+                os.close(fd)
+            _run_script(request["path"], request["args"], request["cwd"])
+        for fd in fds:
+            os.close(fd)
+
+        sock.sendall(json.dumps({"pid": pid}).encode("utf-8") + b"\n")
+        _, status = os.waitpid(pid, 0)
+        returncode = os.waitstatus_to_exitcode(status)
+        sock.sendall(json.dumps({"returncode": returncode}).encode("utf-8") + b"\n")
+
+
+if __name__ == "__main__":
+    _serve(socket.socket(fileno=int(sys.argv[1])))
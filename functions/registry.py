@@ -0,0 +1,211 @@
+"""Tools the model can call, declared once with the ``tool`` decorator.
+
+A tool is a plain function whose model-facing parameters are annotated
+with ``Annotated[type, "description"]``:
+
+    @tool("Counts the lines of a file relative to the working directory")
+    def count_lines(working_directory,
+                    file_path: Annotated[str, "Path to the file"]):
+        ...
+
+``working_directory`` (and ``cache``, the session's FileCache, for tools
+that take it) are supplied by call_function and left out of the schema.
+The FunctionDeclarations are generated from the signatures the first
+time a request needs them (google.genai is only imported then) and
+reused after that.
+
+Tools in other packages are loaded through the ``ai_bot.tools`` entry
+point group; pointing an entry point at a module that uses ``@tool`` is
+enough:
+
+    [project.entry-points."ai_bot.tools"]
+    my_tools = "my_package.tools"
+"""
+import sys
+import threading
+import types as pytypes
+import typing
+
+ENTRY_POINT_GROUP = "ai_bot.tools"
+
+# Arguments call_function passes itself; the model never sees them.
+INJECTED_PARAMETERS = {"working_directory", "cache"}
+
+# Python annotation -> google.genai Type name.
+_TYPE_NAMES = {str: "STRING", int: "INTEGER", float: "NUMBER", bool: "BOOLEAN"}
+
+
+class Tool:
+    """A registered tool: its function, schema and how to dispatch it.
+
+    ``cached`` is set when the function takes a ``cache`` argument (a
+    session's FileCache). ``writes`` marks tools that modify the file at
+    their ``file_path``, and ``runs_code`` tools that may change anything
+    under the working directory.
+    """
+
+    __slots__ = ("name", "function", "description", "parameters", "cached",
+                 "writes", "runs_code")
+
+    def __init__(self, function, description, writes=False, runs_code=False):
+        self.name = function.__name__
+        self.function = function
+        self.description = description
+        self.parameters = _parameters(function)
+        self.cached = "cache" in _argument_names(function)
+        self.writes = writes
+        self.runs_code = runs_code
+
+    def declaration(self):
+        from google.genai import types
+
+        return types.FunctionDeclaration(
+            name=self.name,
+            description=self.description,
+            parameters=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    name: _schema(types, annotation, description)
+                    for name, annotation, description in self.parameters
+                },
+            ),
+        )
+
+
+def _argument_names(function):
+    # What inspect.signature would give, without importing inspect.
+    code = function.__code__
+    return code.co_varnames[:code.co_argcount + code.co_kwonlyargcount]
+
+
+def _parameters(function):
+    """Return [(name, type, description), ...] for the model-facing arguments."""
+    hints = typing.get_type_hints(function, include_extras=True)
+    parameters = []
+    for name in _argument_names(function):
+        if name in INJECTED_PARAMETERS:
+            continue
+        hint = hints.get(name)
+        if typing.get_origin(hint) is not typing.Annotated:
+            raise TypeError(
+                f"{function.__name__}: parameter {name!r} needs an "
+                f"Annotated[type, \"description\"] annotation")
+        annotation, description = typing.get_args(hint)[:2]
+        _type_name(annotation)  # fail at import time, not on first request
+        parameters.append((name, annotation, description))
+    return parameters
+
+
+def _optional_type(annotation):
+    """``int | None`` -> ``int``."""
+    if typing.get_origin(annotation) in (typing.Union, pytypes.UnionType):
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _type_name(annotation):
+    annotation = _optional_type(annotation)
+    if typing.get_origin(annotation) is list:
+        return "ARRAY"
+    try:
+        return _TYPE_NAMES[annotation]
+    except (KeyError, TypeError):
+        raise TypeError(f"unsupported tool parameter type: {annotation!r}") from None
+
+
+def _schema(types, annotation, description=None):
+    annotation = _optional_type(annotation)
+    type_name = _type_name(annotation)
+    items = None
+    if type_name == "ARRAY":
+        (item,) = typing.get_args(annotation)
+        items = _schema(types, item)
+    return types.Schema(
+        type=getattr(types.Type, type_name), items=items, description=description)
+
+
+_tools = {}
+_lock = threading.Lock()
+_declarations = None
+_plugins_lock = threading.RLock()
+_plugins_loading = False
+_plugins_loaded = False
+
+
+def tool(description, writes=False, runs_code=False):
+    """Register the decorated function as a tool; returns it unchanged."""
+    def register(function):
+        global _declarations
+        spec = Tool(function, description, writes=writes, runs_code=runs_code)
+        with _lock:
+            _tools[spec.name] = spec
+            _declarations = None
+        return function
+    return register
+
+
+def unregister(name):
+    """Remove the tool called ``name``, if there is one."""
+    global _declarations
+    with _lock:
+        if _tools.pop(name, None) is not None:
+            _declarations = None
+
+
+def get(name):
+    """Return the Tool called ``name``, or None."""
+    if not _plugins_loaded:
+        load_plugins()
+    return _tools.get(name)
+
+
+def tools():
+    """Return the registered Tools in registration order."""
+    if not _plugins_loaded:
+        load_plugins()
+    with _lock:
+        return list(_tools.values())
+
+
+def declarations():
+    """Return a types.Tool declaring every registered tool.
+
+    Built on first use and reused until another tool is registered, so
+    the configs that include it can be reused too.
+    """
+    global _declarations
+    from google.genai import types
+
+    registered = tools()
+    with _lock:
+        if _declarations is None:
+            _declarations = types.Tool(function_declarations=[
+                spec.declaration() for spec in registered])
+        return _declarations
+
+
+def load_plugins():
+    """Import the tool modules registered under ENTRY_POINT_GROUP, once.
+
+    A plugin that fails to load is reported on stderr and skipped.
+    """
+    global _plugins_loading, _plugins_loaded
+    with _plugins_lock:
+        # A plugin that looks up tools while it loads gets what is
+        # registered so far rather than loading the plugins again.
+        if _plugins_loaded or _plugins_loading:
+            return
+        _plugins_loading = True
+        from importlib.metadata import entry_points
+
+        try:
+            for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+                try:
+                    entry_point.load()
+                except Exception as e:
+                    print(f"Warning: could not load tool plugin {entry_point.name!r}: {e}",
+                          file=sys.stderr)
+        finally:
+            _plugins_loaded = True
@@ -0,0 +1,157 @@
+"""Fit the tool results of one turn into a shared character budget.
+
+``shape_results`` splits the budget across a turn's results: results
+smaller than an equal share keep their full size and what they don't use
+goes to the larger ones. A result over its share is shaped to fit:
+
+- runs of identical lines are collapsed to one line and a count;
+- failed runs keep a short head and a long tail, enough to hold the last
+  traceback in full where possible;
+- anything else keeps its head and tail.
+
+Where lines are dropped, a note says which lines and how many characters
+were elided, so the model can ask for them specifically.
+"""
+
+# A result is never shaped below this, whatever its share; a turn with
+# many calls can exceed a small budget by up to this much per call.
+MIN_RESULT_CHARS = 400
+
+# Runs of at least this many identical lines are collapsed.
+REPEAT_MIN = 3
+
+_TRACEBACK = "Traceback (most recent call last):"
+_FAILURE_PREFIXES = ("Process exited with code", "Error")
+
+
+def allocate(sizes, budget):
+    """Split ``budget`` across results of ``sizes``; returns a limit each."""
+    limits = [0] * len(sizes)
+    remaining = budget
+    order = sorted(range(len(sizes)), key=sizes.__getitem__)
+    for position, index in enumerate(order):
+        share = remaining // (len(sizes) - position)
+        limits[index] = min(sizes[index], max(share, MIN_RESULT_CHARS))
+        remaining = max(0, remaining - limits[index])
+    return limits
+
+
+def _collapse(lines):
+    """Return [(text, first_line, last_line)] with repeated runs collapsed.
+
+    Line numbers are 1-based and refer to the original text.
+    """
+    entries = []
+    i = 0
+    while i < len(lines):
+        j = i
+        while j + 1 < len(lines) and lines[j + 1] == lines[i]:
+            j += 1
+        if j - i + 1 >= REPEAT_MIN:
+            entries.append((
+                f"{lines[i]}\n[... previous line repeated {j - i} more times ...]",
+                i + 1, j + 1))
+        else:
+            for k in range(i, j + 1):
+                entries.append((lines[k], k + 1, k + 1))
+        i = j + 1
+    return entries
+
+
+def _is_failure(text):
+    return text.startswith(_FAILURE_PREFIXES) or _TRACEBACK in text
+
+
+def _note(first, last, chars):
+    lines = f"line {first}" if first == last else f"lines {first}-{last}"
+    return (f"[... {lines} ({chars} characters) elided to fit this turn's "
+            f"tool result budget ...]")
+
+
+def shape(text, limit):
+    """Return ``text`` cut down to at most ``limit`` characters."""
+    if len(text) <= limit:
+        return text
+    lines = text.split("\n")
+    entries = _collapse(lines)
+    collapsed = "\n".join(entry[0] for entry in entries)
+    if len(collapsed) <= limit:
+        return collapsed
+
+    # Reserve room for the note, sized for the largest numbers it can hold.
+    digits = len(str(len(lines)))
+    reserve = len(_note(1, 2, 0)) - 3 + 2 * digits + len(str(len(text)))
+    available = limit - reserve - 2
+    if _is_failure(text):
+        tail_budget = available * 3 // 4
+        start = collapsed.rfind(_TRACEBACK)
+        if start != -1 and tail_budget < len(collapsed) - start <= available - 80:
+            # Room for the whole traceback and a little of the head.
+            tail_budget = len(collapsed) - start
+    else:
+        tail_budget = available // 2
+
+    tail = []
+    used = 0
+    for entry in reversed(entries):
+        if used + len(entry[0]) + 1 > tail_budget:
+            break
+        tail.append(entry)
+        used += len(entry[0]) + 1
+    tail.reverse()
+
+    head = []
+    head_budget = available - used
+    used = 0
+    for entry in entries[:len(entries) - len(tail)]:
+        if used + len(entry[0]) + 1 > head_budget:
+            break
+        head.append(entry)
+        used += len(entry[0]) + 1
+
+    if not head and not tail:
+        # A single line longer than the limit, such as minified code.
+        note = _note(1, len(lines), len(text) - available)
+        half = available // 2
+        return f"{text[:half]}\n{note}\n{text[len(text) - (available - half):]}"
+
+    elided = entries[len(head):len(entries) - len(tail)]
+    first, last = elided[0][1], elided[-1][2]
+    chars = sum(len(line) + 1 for line in lines[first - 1:last])
+    return "\n".join(
+        [entry[0] for entry in head]
+        + [_note(first, last, chars)]
+        + [entry[0] for entry in tail])
+
+
+def shape_results(results, budget):
+    """Fit a turn's [(Content, seconds), ...] results into ``budget`` characters.
+
+    Returns the results with over-budget "result" strings replaced; other
+    keys of the response are kept.
+    """
+    from google.genai import types
+
+    texts = []
+    responses = []
+    for content, _ in results:
+        response = content.parts[0].function_response.response or {}
+        result = response.get("result")
+        texts.append(result if isinstance(result, str) else None)
+        responses.append(response)
+
+    sizes = [0 if text is None else len(text) for text in texts]
+    if sum(sizes) <= budget:
+        return results
+
+    shaped = []
+    for (content, seconds), text, response, limit in zip(
+            results, texts, responses, allocate(sizes, budget)):
+        if text is not None and len(text) > limit:
+            name = content.parts[0].function_response.name
+            content = types.Content(role=content.role, parts=[
+                types.Part.from_function_response(
+                    name=name,
+                    response={**response, "result": shape(text, limit)})])
+        shaped.append((content, seconds))
+    return shaped
@@ -1,15 +1,38 @@
 import os
 import subprocess
+from typing import Annotated
 
-# Try to import google.genai types for schema declaration; tests/envs
-# without the package should still be able to import this module.
-try:
-    from google.genai import types
-except Exception:
-    types = None
+from functions import python_worker
+from functions.output_capture import start_readers
+from functions.registry import tool
 
+# "subprocess" starts a fresh interpreter per call; "forkserver" forks each
+# run from a warm worker that already has common modules imported.
+EXECUTION_BACKENDS = ("subprocess", "forkserver")
+_execution_backend = "subprocess"
 
-def run_python_file(working_directory, file_path, args=None):
+
+def set_execution_backend(backend):
+    """Select how run_python_file starts scripts (see EXECUTION_BACKENDS)."""
+    global _execution_backend
+    if backend not in EXECUTION_BACKENDS:
+        raise ValueError(f"unknown execution backend: {backend}")
+    if backend == "forkserver":
+        if not python_worker.is_available():
+            raise ValueError("the forkserver backend is not available on this platform")
+        python_worker.warm_up()
+    _execution_backend = backend
+
+
+@tool(
+    "Executes a Python file located in the working directory and returns stdout/stderr and exit code",
+    runs_code=True,
+)
+def run_python_file(
+    working_directory,
+    file_path: Annotated[str, "Path to the Python file to execute, relative to the working directory"],
+    args: Annotated[list[str] | None, "Optional list of string arguments to pass to the Python program"] = None,
+):
     try:
         working_dir_abs = os.path.abspath(working_directory)
         target_path = os.path.normpath(
@@ -36,22 +59,21 @@ def run_python_file(working_directory, file_path, args=None):
                 command.append(str(args))
 
         try:
-            proc = subprocess.run(
-                command,
-                cwd=working_dir_abs,
-                capture_output=True,
-                text=True,
-                timeout=30,
-            )
+            proc = run_script(command, cwd=working_dir_abs, timeout=30)
         except Exception as e:
             return f'Error: executing Python file: {e}'
 
         parts = []
         if proc.returncode != 0:
             parts.append(f'Process exited with code {proc.returncode}')
+        for capture in (proc.stdout, proc.stderr):
+            if capture.limit_hit:
+                parts.append(
+                    f'Process killed after writing more than '
+                    f'{capture.kill_after_bytes} bytes to {capture.name}')
 
-        stdout_text = proc.stdout or ''
-        stderr_text = proc.stderr or ''
+        stdout_text = proc.stdout.text()
+        stderr_text = proc.stderr.text()
 
         if not stdout_text and not stderr_text:
             parts.append('No output produced')
@@ -66,24 +88,52 @@ def run_python_file(working_directory, file_path, args=None):
         return f'Error: executing Python file: {e}'
 
 
-if types is not None:
-    schema_run_python_file = types.FunctionDeclaration(
-        name="run_python_file",
-        description="Executes a Python file located in the working directory and returns stdout/stderr and exit code",
-        parameters=types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                "file_path": types.Schema(
-                    type=types.Type.STRING,
-                    description="Path to the Python file to execute, relative to the working directory",
-                ),
-                "args": types.Schema(
-                    type=types.Type.ARRAY,
-                    items=types.Schema(type=types.Type.STRING),
-                    description="Optional list of string arguments to pass to the Python program",
-                ),
-            },
-        ),
-    )
-else:
-    schema_run_python_file = None
+def run_script(command, cwd, timeout, preload=()):
+    """Run a ``python`` command with the selected execution backend.
+
+    ``preload`` is passed on to python_worker.run under the forkserver
+    backend. Returns a CompletedProcess whose stdout/stderr are BoundedCaptures;
+    raises subprocess.TimeoutExpired if it runs past ``timeout``.
+    """
+    if _execution_backend == "forkserver":
+        return python_worker.run(command, cwd=cwd, timeout=timeout, preload=preload)
+    return _run_subprocess(command, cwd=cwd, timeout=timeout)
+
+
+def reserve_workers(count):
+    """Make room for ``count`` concurrent run_script calls.
+
+    Subprocesses are started on demand, so only the forkserver backend's
+    worker pool needs to grow.
+    """
+    if _execution_backend == "forkserver":
+        python_worker.reserve(count)
+
+
+def _run_subprocess(command, cwd, timeout):
+    """Like subprocess.run(..., capture_output=True, timeout=timeout), but
+    reads the pipes incrementally into bounded captures.
+
+    Returns a CompletedProcess whose stdout/stderr are BoundedCaptures.
+    """
+    proc = subprocess.Popen(
+        command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Hand the descriptors to the reader threads, which close them at EOF.
+    stdout_fd = os.dup(proc.stdout.fileno())
+    stderr_fd = os.dup(proc.stderr.fileno())
+    proc.stdout.close()
+    proc.stderr.close()
+    stdout, stderr, readers = start_readers(
+        stdout_fd, stderr_fd, on_limit=proc.kill)
+
+    try:
+        returncode = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        for reader in readers:
+            reader.join()
+
+    return subprocess.CompletedProcess(command, returncode, stdout, stderr)
@@ -0,0 +1,532 @@
+"""Run the unittest tests of the working directory, rerunning only what changed.
+
+Each test is mapped to the local modules it uses by reading the source:
+it depends on its test file and on the modules behind the imported names
+that its method, its class's other methods and the test file's helpers
+refer to, plus whatever those modules import in turn. A result is cached
+under a hash of those files' contents, so a test reruns only once one of
+them changed, through write_file, edit_file or anything else. Imports
+made at runtime by name (importlib, ``__import__``) are not seen.
+
+Tests run in ``python`` processes, optionally several at once, started
+through run_python_file's execution backend. Under the forkserver
+backend they are forked from warm python_worker processes that keep the
+installed modules the tests import (NumPy, say) loaded between calls,
+and the worker pool grows to the number of processes asked for. The tool
+returns a short summary that only spells out what failed.
+"""
+import ast
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from typing import Annotated
+
+from functions.registry import tool
+from functions.run_python_file import reserve_workers, run_script
+
+DEFAULT_PATTERN = "test*.py"
+MAX_WORKERS = 8
+TIMEOUT = 120
+
+# Characters of a failure report kept; the end of a traceback says most.
+MAX_DETAIL_CHARS = 1500
+
+_RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "unittest_runner.py")
+_SKIP_DIRS = {"__pycache__", "node_modules", "venv"}
+_OUTCOMES = ("passed", "failed", "error", "skipped")
+
+_projects = {}
+_projects_lock = threading.Lock()
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class _TestFile:
+    """What a test file's analysis found; see _analyze."""
+
+    __slots__ = ("module", "tests", "shared")
+
+    def __init__(self, module, tests, shared):
+        self.module = module
+        self.tests = tests
+        self.shared = shared
+
+
+class _FileState:
+    """Cached results of one test file's tests, by test id.
+
+    ``complete`` is cleared when a run hit an error outside any test (an
+    import error, a failing setUpClass): the results may then be missing
+    tests, so the next call runs the whole file again.
+    """
+
+    __slots__ = ("digest", "results", "complete")
+
+    def __init__(self, digest):
+        self.digest = digest
+        self.results = {}
+        self.complete = True
+
+
+class _Project:
+    """What run_tests keeps about one working directory between calls."""
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.files = {}
+        self._digests = {}
+        self._imports = {}
+        self._analyses = {}
+
+    def _memo(self, memo, path, compute):
+        # Recomputed only when the file's mtime or size changes.
+        key = _stat_key(path)
+        if key is None:
+            return None
+        entry = memo.get(path)
+        if entry is None or entry[0] != key:
+            entry = (key, compute(path))
+            memo[path] = entry
+        return entry[1]
+
+    def digest(self, path):
+        def compute(path):
+            with open(path, "rb") as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        return self._memo(self._digests, path, compute)
+
+    def module_name(self, path):
+        rel = os.path.relpath(path, self.root)[:-len(".py")]
+        parts = rel.split(os.sep)
+        if parts[-1] == "__init__":
+            parts.pop()
+        return ".".join(parts)
+
+    def module_files(self, name):
+        """Return the files importing module ``name`` runs, or [] if not local.
+
+        A submodule's packages are included: their __init__ runs first.
+        """
+        parts = name.split(".")
+        files = []
+        for i in range(1, len(parts) + 1):
+            base = os.path.join(self.root, *parts[:i])
+            if os.path.isfile(base + ".py") and i == len(parts):
+                files.append(base + ".py")
+            elif os.path.isfile(os.path.join(base, "__init__.py")):
+                files.append(os.path.join(base, "__init__.py"))
+            elif not os.path.isdir(base):
+                return []
+        return files
+
+    def _import_targets(self, path, node):
+        """Return [(bound name, [module names])] for an import statement."""
+        if isinstance(node, ast.Import):
+            return [(alias.asname or alias.name.split(".")[0],
+                     [alias.name]) for alias in node.names]
+        base = node.module or ""
+        if node.level:
+            package = self.module_name(path).split(".")
+            if not path.endswith("__init__.py"):
+                package.pop()
+            package = package[:len(package) - node.level + 1]
+            base = ".".join(package + ([base] if base else []))
+        # "from pkg import name" imports pkg.name if that is a module.
+        return [(alias.asname or alias.name,
+                 [f"{base}.{alias.name}" if base else alias.name, base])
+                for alias in node.names]
+
+    def _resolve(self, modules):
+        for module in modules:
+            files = self.module_files(module) if module else []
+            if files:
+                return files
+        return []
+
+    def _scan_imports(self, path):
+        """Return (local files, other modules) a module imports anywhere."""
+        try:
+            with open(path, "rb") as f:
+                tree = ast.parse(f.read(), path)
+        except (SyntaxError, ValueError):
+            return [], []
+        files = set()
+        external = set()
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                for _, modules in self._import_targets(path, node):
+                    resolved = self._resolve(modules)
+                    files.update(resolved)
+                    if not resolved and not getattr(node, "level", 0):
+                        external.add(modules[-1] or modules[0])
+        return sorted(files), sorted(external)
+
+    def imports(self, path):
+        """Return the local files a module imports, anywhere in its source."""
+        scanned = self._memo(self._imports, path, self._scan_imports)
+        return scanned[0] if scanned else []
+
+    def external_imports(self, files):
+        """Return the modules from outside the project that ``files`` import."""
+        names = set()
+        for path in files:
+            scanned = self._memo(self._imports, path, self._scan_imports)
+            if scanned:
+                names.update(scanned[1])
+        return names
+
+    def closure(self, files):
+        """Return ``files`` and every local file they import, transitively."""
+        seen = set(files)
+        pending = list(files)
+        while pending:
+            for imported in self.imports(pending.pop()):
+                if imported not in seen:
+                    seen.add(imported)
+                    pending.append(imported)
+        return seen
+
+    def analyze(self, path):
+        return self._memo(self._analyses, path, self._analyze)
+
+    def _analyze(self, path):
+        """Map a test file's tests to the local files their names import.
+
+        Returns a _TestFile: ``tests`` maps each test id found in the
+        source to the files it uses directly; ``shared`` holds the files
+        every test of the file depends on, those imported by module-level
+        code and those not attributed to any test.
+        """
+        module = self.module_name(path)
+        try:
+            with open(path, "rb") as f:
+                tree = ast.parse(f.read(), path)
+        except (SyntaxError, ValueError):
+            return _TestFile(module, {}, set())
+
+        imported = {}
+        definitions = {}
+        classes = {}
+        top_level = set()
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                for name, modules in self._import_targets(path, node):
+                    files = self._resolve(modules)
+                    if files:
+                        imported.setdefault(name, set()).update(files)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                                   ast.ClassDef)):
+                definitions[node.name] = _names(node)
+                if isinstance(node, ast.ClassDef):
+                    classes[node.name] = node
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    for name in _names(target):
+                        definitions[name] = _names(node.value) if node.value else set()
+            else:
+                top_level |= _names(node)
+
+        def files_for(names):
+            # Follow module-level helpers to the imports they use.
+            seen = set()
+            pending = list(names)
+            files = set()
+            while pending:
+                name = pending.pop()
+                if name in seen:
+                    continue
+                seen.add(name)
+                files |= imported.get(name, set())
+                pending.extend(definitions.get(name, ()))
+            return files
+
+        tests = {}
+        for name, node in classes.items():
+            bases = _test_case_chain(node, classes)
+            if bases is None:
+                continue
+            shared_names = set()
+            methods = {}
+            for cls in bases:
+                shared_names |= _names(cls, skip_tests=True)
+                for item in cls.body:
+                    if (isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))
+                            and item.name.startswith("test")):
+                        methods.setdefault(item.name, item)
+            for method, item in methods.items():
+                tests[f"{module}.{name}.{method}"] = files_for(shared_names | _names(item))
+
+        used = set().union(*tests.values()) if tests else set()
+        shared = files_for(top_level)
+        shared |= set().union(*imported.values()) - used if imported else set()
+        return _TestFile(module, tests, shared)
+
+    def dependencies(self, path, analysis, test_id):
+        direct = analysis.tests.get(test_id)
+        if direct is None:
+            # Not found in the source (generated, or inherited from
+            # another module): it may use anything the file imports.
+            direct = set(self.imports(path))
+        return self.closure(direct | analysis.shared) | {path}
+
+    def key(self, files):
+        digests = [f"{os.path.relpath(path, self.root)}:{self.digest(path)}"
+                   for path in sorted(files)]
+        return hashlib.sha256("\n".join(digests).encode("utf-8")).hexdigest()
+
+
+def _names(node, skip_tests=False):
+    """Return every name ``node`` refers to, including attribute bases.
+
+    With ``skip_tests``, a class's test methods are left out.
+    """
+    names = set()
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        if (skip_tests and current is not node
+                and isinstance(current, (ast.FunctionDef, ast.AsyncFunctionDef))
+                and current.name.startswith("test")):
+            continue
+        if isinstance(current, ast.Name):
+            names.add(current.id)
+        pending.extend(ast.iter_child_nodes(current))
+    return names
+
+
+def _test_case_chain(node, classes, seen=()):
+    """Return the class and its same-file bases if it is a TestCase, else None."""
+    chain = [node]
+    is_test = False
+    for base in node.bases:
+        name = base.attr if isinstance(base, ast.Attribute) else getattr(base, "id", "")
+        if name in classes and name not in seen and name != node.name:
+            inherited = _test_case_chain(classes[name], classes, seen + (node.name,))
+            if inherited is not None:
+                chain.extend(inherited)
+                is_test = True
+            else:
+                chain.append(classes[name])
+        elif name.endswith("TestCase"):
+            is_test = True
+    return chain if is_test else None
+
+
+def _belongs(test_id, module):
+    return test_id == module or test_id.startswith(module + ".")
+
+
+def _project(working_dir_abs):
+    with _projects_lock:
+        project = _projects.get(working_dir_abs)
+        if project is None:
+            project = _projects[working_dir_abs] = _Project(working_dir_abs)
+        return project
+
+
+def forget(working_directory):
+    """Drop the analysis and results kept for a working directory that is going away."""
+    with _projects_lock:
+        _projects.pop(os.path.abspath(working_directory), None)
+
+
+def _find_test_files(working_dir_abs, paths, pattern):
+    """Return (test files, error) for ``paths`` (files or directories)."""
+    files = []
+    for path in paths or ["."]:
+        target = os.path.normpath(os.path.join(working_dir_abs, path))
+        if os.path.commonpath([working_dir_abs, target]) != working_dir_abs:
+            return None, f'Error: Cannot run tests in "{path}" as it is outside the permitted working directory'
+        if os.path.isfile(target):
+            if not target.endswith(".py"):
+                return None, f'Error: "{path}" is not a Python file'
+            files.append(target)
+        elif os.path.isdir(target):
+            for dirpath, dirnames, filenames in os.walk(target):
+                dirnames[:] = sorted(
+                    d for d in dirnames if not d.startswith(".") and d not in _SKIP_DIRS)
+                files.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                             if name.endswith(".py") and fnmatch(name, pattern))
+        else:
+            return None, f'Error: "{path}" does not exist'
+    return list(dict.fromkeys(files)), None
+
+
+def _run_shard(working_dir_abs, names, shard, count, preload):
+    """Run one worker's share of ``names``; returns {test id: record}.
+
+    Under the forkserver backend the tests run in a warm python_worker
+    that keeps the ``preload`` modules imported between calls, so a rerun
+    only pays for importing the project's own modules.
+    """
+    fd, results_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        command = ["python", _RUNNER, results_path, str(shard), str(count), *names]
+        try:
+            proc = run_script(
+                command, cwd=working_dir_abs, timeout=TIMEOUT, preload=preload)
+        except Exception as e:
+            return {f"run_tests worker {shard}": {
+                "outcome": "error", "detail": str(e) or type(e).__name__,
+                "seconds": 0.0}}
+        try:
+            with open(results_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            detail = proc.stderr.text().strip() or f"exited with code {proc.returncode}"
+            return {f"run_tests worker {shard}": {
+                "outcome": "error", "detail": detail, "seconds": 0.0}}
+    finally:
+        os.remove(results_path)
+
+
+def _trim(detail):
+    detail = (detail or "").strip()
+    if len(detail) > MAX_DETAIL_CHARS:
+        detail = "..." + detail[-MAX_DETAIL_CHARS:]
+    return "    " + detail.replace("\n", "\n    ")
+
+
+def _summary(results, ran, cached, seconds):
+    counts = {outcome: 0 for outcome in _OUTCOMES}
+    for record in results.values():
+        counts[record["outcome"]] += 1
+    lines = [
+        f"{len(results)} tests: " + ", ".join(
+            f"{counts[outcome]} {outcome}" for outcome in _OUTCOMES if counts[outcome])
+        + f" ({ran} run in {seconds:.2f}s, {cached} unchanged and not rerun)"
+    ]
+    for test_id, record in results.items():
+        if record["outcome"] in ("failed", "error"):
+            note = " (cached)" if record.get("cached") else ""
+            lines.append(f"{record['outcome'].upper()}: {test_id}{note}")
+            lines.append(_trim(record["detail"]))
+    return "\n".join(lines)
+
+
+@tool(
+    "Runs the unittest tests in the working directory and returns a short pass/fail summary; only tests whose code or dependencies changed since the last run are rerun, the other results come from a cache",
+    runs_code=True,
+)
+def run_tests(
+    working_directory,
+    paths: Annotated[list[str] | None, f'Test files or directories to run, relative to the working directory (default: every "{DEFAULT_PATTERN}" file)'] = None,
+    pattern: Annotated[str, f'File name pattern of test files in a directory (default "{DEFAULT_PATTERN}")'] = DEFAULT_PATTERN,
+    workers: Annotated[int, "Processes to spread the tests over (default 1)"] = 1,
+    rerun_all: Annotated[bool, "Rerun every test, ignoring cached results"] = False,
+):
+    try:
+        working_dir_abs = os.path.abspath(working_directory)
+        if isinstance(paths, str):
+            paths = [paths]
+        test_files, error = _find_test_files(working_dir_abs, paths, pattern)
+        if error:
+            return error
+        if not test_files:
+            return "No test files found"
+
+        project = _project(working_dir_abs)
+        with project.lock:
+            started = time.perf_counter()
+            names = []
+            plans = []
+            # Keyed on the files as they were before the run: a test may
+            # write to them.
+            keys = {}
+            for path in test_files:
+                analysis = project.analyze(path)
+                digest = project.digest(path)
+                state = project.files.get(path)
+                if (rerun_all or state is None or not state.complete
+                        or state.digest != digest):
+                    # New or changed test file: run all of it, which
+                    # also finds the tests the analysis can't.
+                    names.append(analysis.module)
+                    plans.append((path, analysis, _FileState(digest), None))
+                    for test_id in analysis.tests:
+                        keys[test_id] = project.key(
+                            project.dependencies(path, analysis, test_id))
+                    continue
+                stale = []
+                for test_id, record in state.results.items():
+                    keys[test_id] = project.key(
+                        project.dependencies(path, analysis, test_id))
+                    if record["key"] != keys[test_id]:
+                        stale.append(test_id)
+                names.extend(stale)
+                plans.append((path, analysis, state, set(stale)))
+
+            preload = sorted(project.external_imports(project.closure(test_files)))
+            workers = max(1, min(int(workers), MAX_WORKERS))
+            records = {}
+            if names:
+                if workers == 1:
+                    records = _run_shard(working_dir_abs, names, 0, 1, preload)
+                else:
+                    reserve_workers(workers)
+                    with ThreadPoolExecutor(workers) as pool:
+                        for shard in pool.map(
+                                lambda i: _run_shard(
+                                    working_dir_abs, names, i, workers, preload),
+                                range(workers)):
+                            records.update(shard)
+            seconds = time.perf_counter() - started
+
+            # Results that belong to no test file: errors outside any
+            # test, which can't be told apart by file.
+            outside = {test_id: record for test_id, record in records.items()
+                       if not any(_belongs(test_id, analysis.module)
+                                  for _, analysis, _, _ in plans)}
+            broken = any(record["outcome"] == "error" for record in outside.values())
+            results = {}
+            ran = cached = 0
+            for path, analysis, state, stale in plans:
+                if broken:
+                    state.complete = False
+                project.files[path] = state
+                load_error = next(
+                    (record for test_id, record in records.items()
+                     if record.get("load") and _belongs(test_id, analysis.module)),
+                    None)
+                if load_error is not None:
+                    # The file doesn't import, so none of its tests can
+                    # pass, whatever their cached results say.
+                    state.complete = False
+                    results[analysis.module] = load_error
+                    ran += 1
+                    continue
+                if stale is not None:
+                    for test_id in stale:
+                        if test_id not in records:
+                            state.results.pop(test_id, None)
+                            state.complete = False
+                for test_id, record in records.items():
+                    if _belongs(test_id, analysis.module):
+                        record["key"] = keys.get(test_id) or project.key(
+                            project.dependencies(path, analysis, test_id))
+                        state.results[test_id] = record
+                for test_id, record in state.results.items():
+                    if stale is None or test_id in stale:
+                        ran += 1
+                        results[test_id] = record
+                    else:
+                        cached += 1
+                        results[test_id] = dict(record, cached=True)
+            results.update(outside)
+            return _summary(results, ran, cached, seconds)
+    except Exception as e:
+        return f"Error: running tests: {e}"
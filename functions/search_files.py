@@ -0,0 +1,295 @@
+import os
+import re
+import stat
+import threading
+import time
+from collections import defaultdict
+from typing import Annotated
+
+from functions.get_file_content import SNIFF_BYTES
+from functions.gitignore import match_any, read_gitignore
+from functions.registry import tool
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parser
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse as sre_parser
+
+DEFAULT_MAX_MATCHES = 50
+MAX_MATCHES = 500
+MAX_LINE_CHARS = 200
+
+# Larger files (and binary ones) are left out of the index.
+MAX_FILE_BYTES = 1024 * 1024
+
+# A query re-checks file mtimes at most this often; writes made through
+# write_file, edit_file or run_python_file are picked up straight away.
+RESCAN_INTERVAL = 1.0
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _trigrams(data):
+    """Distinct byte trigrams of ``data``, ASCII-lowercased, as int tuples."""
+    data = data.lower()
+    return set(zip(data, data[1:], data[2:]))
+
+
+def _literal_runs(parsed):
+    """Literal strings every match of a parsed regex must contain.
+
+    Only ASCII literals are used, since the index is ASCII-lowercased;
+    anything this can't reason about just ends the current run.
+    """
+    runs, run = [], []
+    for op, av in parsed:
+        if op is sre_constants.LITERAL and av < 128:
+            run.append(chr(av))
+            continue
+        runs.append("".join(run))
+        run = []
+        if op is sre_constants.SUBPATTERN:
+            runs += _literal_runs(av[-1])
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+            runs += _literal_runs(av[2])
+    runs.append("".join(run))
+    return [run for run in runs if len(run) >= 3]
+
+
+def _query_trigrams(pattern, is_regex):
+    if is_regex:
+        try:
+            runs = _literal_runs(sre_parser.parse(pattern))
+        except Exception:
+            runs = []
+    else:
+        runs = ["".join(c if ord(c) < 128 else "\0" for c in pattern)]
+    grams = set()
+    for run in runs:
+        for part in run.split("\0"):
+            grams |= _trigrams(part.encode("ascii"))
+    return grams
+
+
+class SearchIndex:
+    """Trigram index over the text files under ``root``.
+
+    Each indexed file gets an id and its trigrams (of the ASCII-lowercased
+    bytes) point at that id. A changed file is re-indexed under a new id
+    and its old id is only marked dead; postings are swept once dead ids
+    outnumber live ones, so updates never need the old trigrams.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._files = {}  # rel_path -> (mtime_ns, size, file_id or None)
+        self._paths = {}  # live file_id -> rel_path
+        self._postings = defaultdict(set)
+        self._dead = set()
+        self._next_id = 0
+        self._scanned_at = None
+        self._lock = threading.Lock()
+
+    def mark_stale(self):
+        with self._lock:
+            self._scanned_at = None
+
+    def update(self, rel_path):
+        """Re-index one file now (it was written, or is gone)."""
+        with self._lock:
+            if self._scanned_at is None:
+                return
+            try:
+                st = os.stat(os.path.join(self.root, rel_path))
+            except OSError:
+                st = None
+            if st is None or not stat.S_ISREG(st.st_mode):
+                self._drop(rel_path)
+            else:
+                self._index_file(rel_path, st)
+
+    def search(self, pattern, is_regex=False, ignore_case=False, directory="",
+               max_matches=DEFAULT_MAX_MATCHES):
+        """Return (["path:line: text", ...], stopped_early)."""
+        flags = re.IGNORECASE if ignore_case else 0
+        compiled = re.compile(pattern if is_regex else re.escape(pattern), flags)
+        # Checks a whole file at once, so ^ and $ must match at every line.
+        in_file = re.compile(compiled.pattern, flags | re.MULTILINE)
+        grams = _query_trigrams(pattern, is_regex)
+
+        with self._lock:
+            if (self._scanned_at is None
+                    or time.monotonic() - self._scanned_at > RESCAN_INTERVAL):
+                self._rescan()
+            if grams:
+                postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+                ids = set(postings[0]).intersection(*postings[1:]) - self._dead
+            else:
+                ids = set(self._paths)
+            paths = sorted(self._paths[file_id] for file_id in ids)
+
+        if directory:
+            paths = [path for path in paths if path.startswith(directory)]
+
+        results = []
+        for path in paths:
+            try:
+                with open(os.path.join(self.root, path), "rb") as f:
+                    text = f.read().decode("utf-8", errors="replace")
+            except OSError:
+                continue
+            if in_file.search(text) is None:
+                continue
+            for lineno, line in enumerate(text.splitlines(), 1):
+                if compiled.search(line) is None:
+                    continue
+                if len(results) == max_matches:
+                    return results, True
+                results.append(f"{path}:{lineno}: {line[:MAX_LINE_CHARS]}")
+        return results, False
+
+    def _rescan(self):
+        seen = set()
+        self._walk(self.root, "", [], seen)
+        for rel_path in set(self._files) - seen:
+            self._drop(rel_path)
+        if len(self._dead) > max(1000, len(self._paths)):
+            for ids in self._postings.values():
+                ids -= self._dead
+            self._postings = defaultdict(
+                set, {g: ids for g, ids in self._postings.items() if ids})
+            self._dead.clear()
+        self._scanned_at = time.monotonic()
+
+    def _walk(self, dir_path, prefix, ignored, seen):
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except OSError:
+            return
+        if any(entry.name == ".gitignore" for entry in entries):
+            ignored = ignored + read_gitignore(dir_path, prefix)
+        for entry in entries:
+            rel_path = prefix + entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if entry.name == ".git" or match_any(ignored, rel_path, is_dir):
+                continue
+            if is_dir:
+                self._walk(entry.path, rel_path + "/", ignored, seen)
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            seen.add(rel_path)
+            known = self._files.get(rel_path)
+            if known is None or known[:2] != (st.st_mtime_ns, st.st_size):
+                self._index_file(rel_path, st)
+
+    def _index_file(self, rel_path, st):
+        self._drop(rel_path)
+        file_id = None
+        if st.st_size <= MAX_FILE_BYTES:
+            try:
+                with open(os.path.join(self.root, rel_path), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None and b"\0" not in data[:SNIFF_BYTES]:
+                file_id = self._next_id
+                self._next_id += 1
+                self._paths[file_id] = rel_path
+                for gram in _trigrams(data):
+                    self._postings[gram].add(file_id)
+        self._files[rel_path] = (st.st_mtime_ns, st.st_size, file_id)
+
+    def _drop(self, rel_path):
+        known = self._files.pop(rel_path, None)
+        if known is not None and known[2] is not None:
+            del self._paths[known[2]]
+            self._dead.add(known[2])
+
+
+def _index_for(working_dir_abs, create=True):
+    with _indexes_lock:
+        index = _indexes.get(working_dir_abs)
+        if index is None and create:
+            index = _indexes[working_dir_abs] = SearchIndex(working_dir_abs)
+        return index
+
+
+def _rel_path(working_dir_abs, path):
+    return os.path.relpath(path, working_dir_abs).replace(os.sep, "/")
+
+
+def file_written(working_directory, file_path):
+    """Tell an existing index that write_file or edit_file changed ``file_path``."""
+    working_dir_abs = os.path.abspath(working_directory)
+    index = _index_for(working_dir_abs, create=False)
+    if index is not None:
+        target_path = os.path.normpath(os.path.join(working_dir_abs, file_path))
+        index.update(_rel_path(working_dir_abs, target_path))
+
+
+def forget(working_directory):
+    """Drop the index of a working directory that is going away."""
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(working_directory), None)
+
+
+def files_changed(working_directory):
+    """Make the next search re-check every file (a script ran)."""
+    index = _index_for(os.path.abspath(working_directory), create=False)
+    if index is not None:
+        index.mark_stale()
+
+
+@tool(
+    "Searches the text files in the working directory for a substring or regular expression and returns matching lines as path:line: text. Prefer this over reading files one by one to find where something is defined or used",
+)
+def search_files(
+    working_directory,
+    pattern: Annotated[str, "Text to search for, or a Python regular expression if regex is true"],
+    regex: Annotated[bool, "Treat pattern as a regular expression (default false)"] = False,
+    ignore_case: Annotated[bool, "Match case-insensitively (default false)"] = False,
+    directory: Annotated[str, "Only search under this directory, relative to the working directory (default is the working directory itself)"] = ".",
+    max_matches: Annotated[int | None, f"Maximum matching lines to return (default {DEFAULT_MAX_MATCHES}, at most {MAX_MATCHES})"] = None,
+):
+    try:
+        working_dir_abs = os.path.abspath(working_directory)
+        target_dir = os.path.normpath(os.path.join(working_dir_abs, directory))
+        if os.path.commonpath([working_dir_abs, target_dir]) != working_dir_abs:
+            return f'Error: Cannot search "{directory}" as it is outside the permitted working directory'
+        if not os.path.isdir(target_dir):
+            return f'Error: "{directory}" is not a directory'
+        if not pattern:
+            return 'Error: pattern must not be empty'
+
+        max_matches = (DEFAULT_MAX_MATCHES if max_matches is None
+                       else min(int(max_matches), MAX_MATCHES))
+        prefix = _rel_path(working_dir_abs, target_dir)
+        prefix = "" if prefix == "." else prefix + "/"
+
+        try:
+            results, stopped = _index_for(working_dir_abs).search(
+                pattern, is_regex=regex, ignore_case=ignore_case,
+                directory=prefix, max_matches=max_matches)
+        except re.error as e:
+            return f'Error: Invalid regular expression: {e}'
+
+        if not results:
+            return f'No matches found for "{pattern}"'
+        if stopped:
+            results.append(
+                f"[...Stopped after {max_matches} matches; narrow the pattern "
+                f"or directory to see more]")
+        return "\n".join(results)
+    except Exception as e:
+        return f'Error: {e}'
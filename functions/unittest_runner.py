@@ -0,0 +1,139 @@
+"""Runs unittest tests for run_tests and writes their results as JSON.
+
+Usage: python unittest_runner.py RESULTS_PATH SHARD COUNT NAME...
+
+Each NAME is a module, class or test id, as ``python -m unittest`` takes
+them. The tests are grouped by class and every COUNT-th group starting
+from SHARD is run, so COUNT processes given the same names split them
+between them. Output printed by a test is buffered, as with
+``unittest -b``, and only kept in the report of a test that fails.
+
+RESULTS_PATH gets {test id: {"outcome", "detail", "seconds"}}. Errors
+outside a test (a module that fails to import, a failing setUpClass) are
+reported under unittest's own ids for them, which are not test ids, or
+under the NAME that could not be loaded, with "load" set.
+"""
+import json
+import os
+import sys
+import time
+import traceback
+import unittest
+
+_OWN_FILES = {os.path.abspath(__file__), unittest.loader.__file__}
+
+# Worst first: a test with failing subtests is reported as failed.
+_RANK = {"error": 0, "failed": 1, "skipped": 2, "passed": 3}
+
+
+class _Result(unittest.TestResult):
+    def __init__(self):
+        super().__init__()
+        self.buffer = True
+        self.records = {}
+        self._started = {}
+
+    def startTest(self, test):
+        self._started[test.id()] = time.perf_counter()
+        super().startTest(test)
+
+    def _record(self, test, outcome, detail=None):
+        test_id = test.id()
+        started = self._started.get(test_id)
+        record = {
+            "outcome": outcome,
+            "detail": detail,
+            "seconds": time.perf_counter() - started if started else 0.0,
+        }
+        previous = self.records.get(test_id)
+        if previous is None or _RANK[outcome] < _RANK[previous["outcome"]]:
+            self.records[test_id] = record
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, "passed")
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, "failed", self.failures[-1][1])
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, "error", self.errors[-1][1])
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, "skipped", reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, "passed")
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, "failed", "unexpected success")
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            failed = issubclass(err[0], test.failureException)
+            self._record(test, "failed" if failed else "error",
+                         self._exc_info_to_string(err, test))
+
+
+def _flatten(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from _flatten(test)
+        else:
+            yield test
+
+
+def _load(names):
+    """Load ``names`` one at a time, so one broken module spares the rest.
+
+    Returns (tests, {name: traceback}) for the names that failed to load.
+    """
+    loader = unittest.TestLoader()
+    tests = []
+    errors = {}
+    for name in names:
+        try:
+            tests.extend(_flatten(loader.loadTestsFromName(name)))
+        except Exception as e:
+            # A syntax error, or an exception raised while importing.
+            # Start the traceback at the import, as python would.
+            tb = e.__traceback__
+            while tb is not None and tb.tb_frame.f_code.co_filename in _OWN_FILES:
+                tb = tb.tb_next
+            errors[name] = "".join(
+                traceback.format_exception(type(e), e, tb or e.__traceback__))
+    return tests, errors
+
+
+def main():
+    results_path, shard, count, *names = sys.argv[1:]
+    # Import the project's modules, not this directory's.
+    sys.path[0] = os.getcwd()
+
+    tests, errors = _load(names)
+    groups = {}
+    for test in tests:
+        key = (type(test).__module__, type(test).__qualname__)
+        groups.setdefault(key, []).append(test)
+    selected = list(groups.values())[int(shard)::int(count)]
+
+    suite = unittest.TestSuite(test for group in selected for test in group)
+    result = _Result()
+    suite.run(result)
+    if int(shard) == 0:
+        for name, detail in errors.items():
+            result.records[name] = {
+                "outcome": "error", "detail": detail, "seconds": 0.0, "load": True}
+
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(result.records, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,18 @@
 import os
+from typing import Annotated
 
-# Try to import google.genai types for schema declaration; tests/envs
-# without the package should still be able to import this module.
-try:
-    from google.genai import types
-except Exception:
-    types = None
+from functions.registry import tool
 
 
-def write_file(working_directory, file_path, content):
+@tool(
+    "Writes content to a file (creates or overwrites) relative to the working directory",
+    writes=True,
+)
+def write_file(
+    working_directory,
+    file_path: Annotated[str, "Path to the file to write, relative to the working directory"],
+    content: Annotated[str, "String content to write to the file"],
+):
     try:
         working_dir_abs = os.path.abspath(working_directory)
         target_path = os.path.normpath(
@@ -40,25 +44,3 @@ def write_file(working_directory, file_path, content):
         return f'Successfully wrote to "{file_path}" ({len(content)} characters written)'
     except Exception as e:
         return f'Error: {e}'
-
-
-if types is not None:
-    schema_write_file = types.FunctionDeclaration(
-        name="write_file",
-        description="Writes content to a file (creates or overwrites) relative to the working directory",
-        parameters=types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                "file_path": types.Schema(
-                    type=types.Type.STRING,
-                    description="Path to the file to write, relative to the working directory",
-                ),
-                "content": types.Schema(
-                    type=types.Type.STRING,
-                    description="String content to write to the file",
-                ),
-            },
-        ),
-    )
-else:
-    schema_write_file = None
@@ -0,0 +1,185 @@
+"""Limits on an agent run, and a final answer forced when one is reached.
+
+A Governor holds the limits and is shared by every run, like the
+RequestScheduler; ``start`` returns the Run that one session reports its
+model and tool usage to. Before each model call the loop asks the Run
+for a ``stop_reason``. When there is one, that call is the last: the
+model is told why and asked to answer with what it has, with function
+calling turned off (see ``final_config``). The request to stop is only
+sent, not added to the conversation.
+
+A run is stopped when:
+
+- ``max_seconds`` of wall time have passed since it started;
+- its model calls have used ``max_tokens`` prompt and response tokens
+  between them, as reported by usage_metadata;
+- its tools have run for ``max_tool_seconds``;
+- ``max_stalled_turns`` turns in a row made no progress: every call was
+  a repeat of an earlier one, or failed;
+- it is on its last allowed iteration.
+
+Limits are checked between turns, so a run can go over one by the turn
+that crossed it and the final call. With ``dedupe`` each run has a
+CallMemo, and repeated calls are answered from it instead of running.
+The Governor counts why each run ended, by the names in STOP_REASONS.
+"""
+import threading
+import time
+from collections import Counter
+
+from functions.call_memo import CallMemo, is_repeat
+
+# Why a run ended. "answered" is the model finishing on its own and
+# "error" an exception; the others are the governor stopping the run.
+STOP_REASONS = ("answered", "time_limit", "token_limit", "tool_time_limit",
+                "no_progress", "max_iterations", "error")
+
+_EXPLANATIONS = {
+    "time_limit": "the time allowed for this request has run out",
+    "token_limit": "the token budget for this request has been used up",
+    "tool_time_limit": "the time allowed for running tools has run out",
+    "no_progress": "the last tool calls only repeated earlier ones or failed",
+    "max_iterations": "this is the last turn allowed for this request",
+}
+
+_FAILURE_PREFIXES = ("Error", "Process exited with code")
+
+
+def _failed(content):
+    response = content.parts[0].function_response.response or {}
+    if "error" in response:
+        return True
+    result = response.get("result")
+    return isinstance(result, str) and result.startswith(_FAILURE_PREFIXES)
+
+
+def final_prompt(reason):
+    """Return the user Content asking for a final answer after ``reason``."""
+    from google.genai import types
+
+    return types.Content(role="user", parts=[types.Part(text=(
+        f"Stop calling tools: {_EXPLANATIONS[reason]}. Give your final "
+        "answer now, from what you have found so far, and say what is "
+        "left undone if anything is."))])
+
+
+def final_config(config):
+    """Return ``config`` with function calling turned off.
+
+    ``config`` must not use a context cache: a request using one can't
+    set a tool config (the cache holds it).
+    """
+    from google.genai import types
+
+    return config.model_copy(update={"tool_config": types.ToolConfig(
+        function_calling_config=types.FunctionCallingConfig(
+            mode=types.FunctionCallingConfigMode.NONE))})
+
+
+def answer_contents(contents):
+    """Return a forced final response's Contents without function calls.
+
+    Calls made anyway are dropped rather than left in the history without
+    results, and a Content left with nothing is dropped too.
+    """
+    from google.genai import types
+
+    answers = []
+    for content in contents:
+        parts = [part for part in content.parts or [] if part.function_call is None]
+        if parts:
+            answers.append(types.Content(role=content.role, parts=parts))
+    return answers
+
+
+class Governor:
+    """Limits shared by every run, and counts of why runs ended.
+
+    A limit of None is no limit. ``clock`` can be replaced to test
+    without waiting.
+    """
+
+    def __init__(self, max_seconds=None, max_tokens=None, max_tool_seconds=None,
+                 max_stalled_turns=3, dedupe=True, clock=time.monotonic):
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.max_tool_seconds = max_tool_seconds
+        self.max_stalled_turns = max_stalled_turns
+        self.dedupe = dedupe
+        self.clock = clock
+        self.stop_reasons = Counter()
+        self.repeats_answered = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        return Run(self)
+
+    def _finished(self, run):
+        with self._lock:
+            self.stop_reasons[run.reason] += 1
+            if run.memo is not None:
+                self.repeats_answered += run.memo.hits
+
+    def stats(self):
+        with self._lock:
+            return {
+                "stop_reasons": dict(self.stop_reasons),
+                "repeats_answered": self.repeats_answered,
+            }
+
+    def summary(self):
+        stats = self.stats()
+        reasons = ", ".join(
+            f"{reason} {stats['stop_reasons'][reason]}"
+            for reason in STOP_REASONS if reason in stats["stop_reasons"])
+        return (f"Governor: runs ended by {reasons or 'nothing yet'}; "
+                f"{stats['repeats_answered']} repeated calls answered without running")
+
+
+class Run:
+    """One session's usage, checked against its Governor's limits."""
+
+    def __init__(self, governor):
+        self.governor = governor
+        self.memo = CallMemo() if governor.dedupe else None
+        self.started = governor.clock()
+        self.tokens = 0
+        self.tool_seconds = 0.0
+        self.stalled_turns = 0
+        self.reason = None
+
+    def observe_model(self, prompt_tokens, response_tokens):
+        self.tokens += (prompt_tokens or 0) + (response_tokens or 0)
+
+    def observe_tools(self, results):
+        """Record a turn's [(Content, seconds), ...] tool results."""
+        progress = False
+        for content, seconds in results:
+            self.tool_seconds += seconds
+            if not is_repeat(content) and not _failed(content):
+                progress = True
+        self.stalled_turns = 0 if progress else self.stalled_turns + 1
+
+    def stop_reason(self, last_turn=False):
+        """Return why the next model call must be the last, or None."""
+        governor = self.governor
+        if (governor.max_seconds is not None
+                and governor.clock() - self.started >= governor.max_seconds):
+            return "time_limit"
+        if governor.max_tokens is not None and self.tokens >= governor.max_tokens:
+            return "token_limit"
+        if (governor.max_tool_seconds is not None
+                and self.tool_seconds >= governor.max_tool_seconds):
+            return "tool_time_limit"
+        if (governor.max_stalled_turns
+                and self.stalled_turns >= governor.max_stalled_turns):
+            return "no_progress"
+        if last_turn:
+            return "max_iterations"
+        return None
+
+    def finish(self, reason):
+        """Record why the run ended; only the first call counts."""
+        if self.reason is None:
+            self.reason = reason
+            self.governor._finished(self)
@@ -0,0 +1,125 @@
+import json
+
+# Rough starting point until the first usage_metadata arrives, and the
+# range calibration is allowed to move it within.
+DEFAULT_CHARS_PER_TOKEN = 4.0
+MIN_CHARS_PER_TOKEN = 1.0
+MAX_CHARS_PER_TOKEN = 8.0
+
+
+def _part_chars(part):
+    if part.text is not None:
+        return len(part.text)
+    if part.function_call is not None:
+        return len(part.function_call.name or "") + len(
+            json.dumps(part.function_call.args or {}, default=str))
+    if part.function_response is not None:
+        return len(part.function_response.name or "") + len(
+            json.dumps(part.function_response.response or {}, default=str))
+    return 0
+
+
+def content_chars(content):
+    return sum(_part_chars(part) for part in content.parts or [])
+
+
+def _excerpt(text, keep_chars):
+    """Keep the head and tail of ``text``, noting how much was elided."""
+    head = keep_chars // 2
+    tail = keep_chars - head
+    elided = len(text) - keep_chars
+    return (
+        f"{text[:head]}\n"
+        f"[... {elided} characters of this earlier result elided ...]\n"
+        f"{text[-tail:]}"
+    )
+
+
+class HistoryManager:
+    """Keep the contents sent to the model within a token budget.
+
+    The full ``messages`` list is left untouched; ``compact`` returns the
+    view to send. The messages before ``start`` (the user prompt, and
+    anything pinned or cached ahead of it) and the last ``keep_recent``
+    messages are sent as-is. Older function results over ``excerpt_chars``
+    are cut to a head/tail excerpt, oldest first, and if that is still not
+    enough they are replaced by a one-line stub. Parts are rewritten, never
+    dropped, so every function call keeps its matching function response.
+    """
+
+    def __init__(self, token_budget, keep_recent=4, excerpt_chars=800):
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.excerpt_chars = excerpt_chars
+        self.chars_per_token = DEFAULT_CHARS_PER_TOKEN
+        self.last_tokens_saved = 0
+        self.total_tokens_saved = 0
+        self._sent_chars = 0
+
+    def compact(self, messages, start=1):
+        total = sum(content_chars(content) for content in messages)
+        budget_chars = self.token_budget * self.chars_per_token
+        compacted = list(messages)
+        saved_chars = 0
+
+        candidates = range(start, max(start, len(messages) - self.keep_recent))
+        for shrink in (self._excerpt_part, self._stub_part):
+            for i in candidates:
+                if total - saved_chars <= budget_chars:
+                    break
+                content = self._shrink_content(messages[i], shrink)
+                removed = content_chars(compacted[i]) - content_chars(content)
+                if removed > 0:
+                    compacted[i] = content
+                    saved_chars += removed
+
+        self._sent_chars = total - saved_chars
+        self.last_tokens_saved = int(saved_chars / self.chars_per_token)
+        self.total_tokens_saved += self.last_tokens_saved
+        return compacted
+
+    def observe(self, prompt_tokens):
+        """Calibrate the chars-per-token estimate from usage_metadata."""
+        if prompt_tokens and self._sent_chars:
+            self.chars_per_token = min(
+                MAX_CHARS_PER_TOKEN,
+                max(MIN_CHARS_PER_TOKEN, self._sent_chars / prompt_tokens))
+
+    def _shrink_content(self, content, shrink):
+        from google.genai import types
+
+        parts = []
+        for part in content.parts or []:
+            if part.function_response is not None:
+                new_part = shrink(part)
+                if new_part is not None and _part_chars(new_part) < _part_chars(part):
+                    part = new_part
+            parts.append(part)
+        return types.Content(role=content.role, parts=parts)
+
+    def _excerpt_part(self, part):
+        result = (part.function_response.response or {}).get("result")
+        if not isinstance(result, str) or len(result) <= self.excerpt_chars:
+            return None
+        return self._replace_result(part, _excerpt(result, self.excerpt_chars))
+
+    def _stub_part(self, part):
+        response = part.function_response.response or {}
+        size = len(json.dumps(response, default=str))
+        stub = (
+            f"[Earlier {part.function_response.name} result elided "
+            f"({size} characters); call the function again if you need it]"
+        )
+        if size <= len(stub):
+            return None
+        return self._replace_result(part, stub)
+
+    @staticmethod
+    def _replace_result(part, result):
+        from google.genai import types
+
+        return types.Part(function_response=types.FunctionResponse(
+            id=part.function_response.id,
+            name=part.function_response.name,
+            response={"result": result},
+        ))
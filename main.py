@@ -1,22 +1,54 @@
 import os
 import argparse
+import itertools
 import sys
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+import time
+from context_cache import DEFAULT_TTL_SECONDS, ContextCache
 from prompts import system_prompt
-from functions.call_function import available_functions, call_function
+from functions.call_function import WORKING_DIRECTORY
+from functions.dispatch import FunctionCallDispatcher, dispatch_function_calls
+from functions.file_cache import FileCache
+from functions.output_capture import set_output_limits
+from functions.run_python_file import EXECUTION_BACKENDS, set_execution_backend
+from governor import Governor, answer_contents, final_config, final_prompt
+from history import DEFAULT_CHARS_PER_TOKEN, HistoryManager, content_chars
+from response_cache import ResponseCache, cache_key
+from scheduler import RequestScheduler
+from session import DEFAULT_SESSION_DIR, Session
+from tracing import Tracer
 
-load_dotenv()
-api_key = os.environ.get("GEMINI_API_KEY")
+# google.genai takes most of a second to import, so it is imported where
+# it's first needed rather than here: --help, and anything that only
+# needs the tools, never load it.
 
-if api_key is None:
-    raise RuntimeError(
-        "GEMINI_API_KEY not found in environment. Create a .env file with GEMINI_API_KEY='your_api_key_here' and don't commit it."
-    )
+MODEL = "gemini-2.5-flash"
+MAX_ITERATIONS = 20
+
+_client = None
+
+
+def get_client():
+    """Return the Gemini client, creating it on first use."""
+    global _client
+    if _client is None:
+        from dotenv import load_dotenv
+        from google import genai
+
+        load_dotenv()
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if api_key is None:
+            raise RuntimeError(
+                "GEMINI_API_KEY not found in environment. Create a .env file with GEMINI_API_KEY='your_api_key_here' and don't commit it."
+            )
+        _client = genai.Client(api_key=api_key)
+    return _client
 
-# Create Gemini client
-client = genai.Client(api_key=api_key)
+
+def __getattr__(name):
+    # ``main.client`` predates get_client.
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def main():
@@ -24,59 +56,260 @@ def main():
     parser.add_argument("user_prompt", type=str, help="User prompt")
     parser.add_argument("--verbose", action="store_true",
                         help="Enable verbose output")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Run the function calls of one turn concurrently")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the response and start tools as soon as they arrive")
+    parser.add_argument("--max-io-workers", type=int, default=4,
+                        help="Concurrent filesystem tool calls in --parallel mode")
+    parser.add_argument("--max-subprocess-workers", type=int, default=2,
+                        help="Concurrent run_python_file calls in --parallel mode")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse responses to identical requests within this run")
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Also keep cached responses on disk in this directory (implies --cache)")
+    parser.add_argument("--cache-max-bytes", type=int, default=64 * 1024 * 1024,
+                        help="Size limit of the on-disk response cache")
+    parser.add_argument("--history-budget", type=int, default=None,
+                        help="Compact older tool results to keep the sent history under this many tokens")
+    parser.add_argument("--result-budget", type=int, default=8000,
+                        help="Shape each turn's tool results to fit about this many tokens in total (0 for no limit)")
+    parser.add_argument("--python-backend", choices=EXECUTION_BACKENDS,
+                        default="subprocess",
+                        help="How run_python_file starts scripts (forkserver reuses warm workers)")
+    parser.add_argument("--kill-output-after", type=int, default=None,
+                        help="Kill a script once it writes more than this many bytes to stdout or stderr")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Append timing and token spans to this JSONL file and print a summary at exit")
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="Keep model requests under this many per minute")
+    parser.add_argument("--tpm", type=int, default=None,
+                        help="Keep model tokens under this many per minute")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="Retry rate-limited or failed model requests this many times")
+    parser.add_argument("--session-dir", type=str, default=DEFAULT_SESSION_DIR,
+                        help="Directory sessions are saved in")
+    parser.add_argument("--resume", type=str, default=None, metavar="SESSION",
+                        help="Continue a saved session (its id, or \"last\")")
+    parser.add_argument("--context-cache", action="store_true",
+                        help="Cache the system instruction, tools and pinned context on the server and send only what follows")
+    parser.add_argument("--context-cache-ttl", type=int, default=DEFAULT_TTL_SECONDS,
+                        help="Seconds the context cache is kept after its last use")
+    parser.add_argument("--pin", action="append", default=[], metavar="FILE",
+                        help="Put this file's contents ahead of the conversation (repeatable)")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Ask for a final answer once the run has taken this many seconds")
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="Ask for a final answer once model calls have used this many tokens")
+    parser.add_argument("--max-tool-seconds", type=float, default=None,
+                        help="Ask for a final answer once tools have run for this many seconds")
+    parser.add_argument("--max-stalled-turns", type=int, default=3,
+                        help="Ask for a final answer after this many turns of only repeated or failed calls (0 to never)")
+    parser.add_argument("--no-dedupe", dest="dedupe", action="store_false",
+                        help="Run repeated identical tool calls again instead of reusing their results")
     args = parser.parse_args()
 
-    prompt = args.user_prompt
+    if args.resume:
+        try:
+            session = Session.load(args.resume, args.session_dir)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+    else:
+        session = Session.create(args.session_dir)
+    pinned = [pinned_content(path) for path in args.pin]
+
+    client = get_client()
+    set_execution_backend(args.python_backend)
+    set_output_limits(kill_after_bytes=args.kill_output_after)
+
+    cache = None
+    if args.cache or args.cache_dir:
+        cache = ResponseCache(
+            directory=args.cache_dir, max_bytes=args.cache_max_bytes)
+
+    tracer = Tracer(args.trace) if args.trace else None
+    scheduler = RequestScheduler(
+        rpm=args.rpm, tpm=args.tpm, max_retries=args.max_retries)
+    context_cache = None
+    if args.context_cache:
+        context_cache = ContextCache(client, MODEL, ttl=args.context_cache_ttl)
+
+    try:
+        final_text = run_agent(
+            client,
+            args.user_prompt,
+            verbose=args.verbose,
+            parallel=args.parallel,
+            stream=args.stream,
+            max_io_workers=args.max_io_workers,
+            max_subprocess_workers=args.max_subprocess_workers,
+            cache=cache,
+            history=(HistoryManager(args.history_budget)
+                     if args.history_budget else None),
+            tracer=tracer,
+            scheduler=scheduler,
+            result_budget=(int(args.result_budget * DEFAULT_CHARS_PER_TOKEN)
+                           if args.result_budget else None),
+            session=session,
+            context_cache=context_cache,
+            pinned=pinned,
+            governor=Governor(
+                max_seconds=args.max_seconds,
+                max_tokens=args.max_tokens,
+                max_tool_seconds=args.max_tool_seconds,
+                max_stalled_turns=args.max_stalled_turns,
+                dedupe=args.dedupe,
+            ),
+        )
+    except Exception as e:
+        print("Request to Gemini API failed:", e)
+        raise
+    finally:
+        if tracer is not None:
+            tracer.close()
+            print(tracer.summary())
+        if context_cache is not None:
+            print(context_cache.summary())
+        if session.messages:
+            print(f"Session {session.id} saved; continue it with --resume {session.id}")
+
+    if final_text is None:
+        sys.exit(1)
+
+
+def run_agent(client, prompt, verbose=False, parallel=False, stream=False,
+              max_io_workers=4, max_subprocess_workers=2,
+              working_directory=WORKING_DIRECTORY, cache=None, history=None,
+              tracer=None, scheduler=None, result_budget=None, session=None,
+              context_cache=None, pinned=None, governor=None):
+    """Run the tool-calling loop for one prompt and return the final text.
+
+    With ``stream=True`` the response is generated with
+    ``generate_content_stream``: text is printed as it arrives and each
+    function call starts running as soon as its part is received.
+    ``cache`` is an optional ResponseCache consulted before every request,
+    and ``history`` an optional HistoryManager that compacts what is sent.
+    ``tracer`` is an optional Tracer that records model and tool spans.
+    ``scheduler`` is an optional RequestScheduler that rate limits model
+    requests and retries the ones that fail transiently.
+    ``result_budget`` caps the characters of tool results one turn adds
+    to the history; results over their share are shaped to fit.
+    ``session`` is an optional Session: its history comes before the
+    prompt and each completed turn is saved to it. ``pinned`` contents go
+    ahead of the whole conversation. ``context_cache`` is an optional
+    ContextCache holding the config, pinned contents and resumed history,
+    so that requests only send the turns of this run. ``governor`` is an
+    optional Governor: it answers repeated tool calls, and once one of
+    its limits is reached the next response is asked to be the final
+    answer, without tools.
+
+    Returns None if the model is still calling tools after the maximum
+    number of iterations (with a governor, the last one is forced to be
+    an answer), or if a forced final response has no text.
+    """
+    from google.genai import types
 
     # Build messages list using types.Content
-    messages = [types.Content(role="user", parts=[types.Part(text=prompt)])]
+    messages = list(session.messages) if session is not None else []
+    messages.append(types.Content(role="user", parts=[types.Part(text=prompt)]))
+    pinned = list(pinned or [])
+    file_cache = FileCache()
+    run = governor.start() if governor is not None else None
+    memo = run.memo if run is not None else None
+
+    dispatcher = None
+    if stream:
+        dispatcher = FunctionCallDispatcher(
+            verbose=verbose,
+            working_directory=working_directory,
+            max_io_workers=max_io_workers,
+            max_subprocess_workers=max_subprocess_workers,
+            serial=not parallel,
+            file_cache=file_cache,
+            result_budget=result_budget,
+            memo=memo,
+        )
 
+    config = build_config()
+    request_config = config
+    if context_cache is not None:
+        prefix = pinned + messages[:-1]
+        reuse = session.context_cache if session is not None else None
+        if not context_cache.prepare(config, prefix, reuse=reuse):
+            context_cache = None
+        elif session is not None and context_cache.handle() != reuse:
+            session.save_context_cache(context_cache.handle())
     try:
         # Allow the model to iterate with tool calls until it returns a final answer.
-        for _ in range(20):
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=messages,
-                config=types.GenerateContentConfig(
-                    system_instruction=system_prompt,
-                    temperature=0,
-                    tools=[available_functions],
-                ),
-            )
+        for iteration in range(1, MAX_ITERATIONS + 1):
+            forced = None
+            if run is not None:
+                forced = run.stop_reason(last_turn=iteration == MAX_ITERATIONS)
+            contents = pinned + messages
+            if history is not None:
+                # Pinned contents, the cached prefix and the prompt are
+                # sent as they are.
+                contents = history.compact(contents, start=(
+                    context_cache.prefix_length if context_cache is not None
+                    else len(pinned)) + 1)
+            if forced is not None:
+                # Sent but not kept: a resumed session shouldn't be told to
+                # stop again. A cached config can't turn function calling
+                # off, so the final call goes without the context cache.
+                print(f"Stopping ({forced}); asking for a final answer.")
+                request_config = final_config(config)
+                contents = contents + [final_prompt(forced)]
+            elif context_cache is not None:
+                request_config, contents = context_cache.request(contents)
+            if tracer is not None:
+                tracer.history(
+                    iteration, len(messages),
+                    sum(content_chars(content) for content in messages),
+                    sum(content_chars(content) for content in contents))
+
+            started = time.perf_counter()
+            if forced is not None:
+                response = generate_response(
+                    client, contents, request_config, cache, scheduler)
+                usage = getattr(response, "usage_metadata", None)
+                candidates = getattr(response, "candidates", None) or []
+                model_contents = answer_contents(cand.content for cand in candidates)
+                function_calls = None
+            elif stream:
+                model_content, usage, function_calls = _stream_turn(
+                    client, contents, request_config, dispatcher, cache, scheduler)
+                model_contents = [model_content]
+            else:
+                response = generate_response(
+                    client, contents, request_config, cache, scheduler)
+                usage = getattr(response, "usage_metadata", None)
+                candidates = getattr(response, "candidates", None) or []
+                model_contents = [cand.content for cand in candidates]
+                # Handle any function calls the model requested
+                function_calls = getattr(response, "function_calls", None)
+            model_seconds = time.perf_counter() - started
 
             # Verify usage metadata is present
-            usage = getattr(response, "usage_metadata", None)
             if usage is None:
                 raise RuntimeError(
                     "Gemini API response missing usage metadata; request may have failed."
                 )
 
-            # Helper to extract token counts from either dict-like or object-like usage
-            def _get_token(u, *names):
-                for name in names:
-                    if isinstance(u, dict):
-                        val = u.get(name)
-                    else:
-                        val = getattr(u, name, None)
-                    if val is not None:
-                        return val
-                return None
-
-            prompt_tokens = _get_token(
-                usage, "prompt_tokens", "input_tokens", "prompt_token_count")
-            response_tokens = _get_token(
-                usage, "response_tokens", "completion_tokens", "response_token_count")
+            prompt_tokens, response_tokens = usage_tokens(usage)
+            if history is not None:
+                history.observe(prompt_tokens)
+            if context_cache is not None:
+                context_cache.observe(usage)
+            if run is not None:
+                run.observe_model(prompt_tokens, response_tokens)
+            if tracer is not None:
+                tracer.model_call(
+                    iteration, model_seconds, prompt_tokens, response_tokens)
 
             # Add model candidates to history so the model can see its own outputs
-            candidates = getattr(response, "candidates", None)
-            if candidates:
-                for cand in candidates:
-                    messages.append(cand.content)
-
-            # Handle any function calls the model requested
-            function_calls = getattr(response, "function_calls", None)
+            messages.extend(model_contents)
 
-            if args.verbose:
+            if verbose:
                 print(f"User prompt: {prompt}")
                 if prompt_tokens is None:
                     print("Prompt tokens: unknown")
@@ -88,48 +321,288 @@ def main():
                 else:
                     print(f"Response tokens: {response_tokens}")
 
+                if history is not None:
+                    print(f"History tokens saved: ~{history.last_tokens_saved}")
+
                 print("Response:")
 
             if function_calls:
-                function_responses = []
-                for function_call in function_calls:
-                    function_call_result = call_function(
-                        function_call, verbose=args.verbose)
-
-                    if not getattr(function_call_result, "parts", None):
-                        raise RuntimeError("call_function returned no parts")
-
-                    part = function_call_result.parts[0]
-                    if getattr(part, "function_response", None) is None:
-                        raise RuntimeError(
-                            "function_response is missing from part")
-
-                    if getattr(part.function_response, "response", None) is None:
-                        raise RuntimeError(
-                            "function_response.response is missing")
+                if stream:
+                    # The calls were submitted while the response streamed in.
+                    results = dispatcher.results()
+                else:
+                    results = dispatch_function_calls(
+                        function_calls,
+                        verbose=verbose,
+                        working_directory=working_directory,
+                        parallel=parallel,
+                        max_io_workers=max_io_workers,
+                        max_subprocess_workers=max_subprocess_workers,
+                        file_cache=file_cache,
+                        result_budget=result_budget,
+                        memo=memo,
+                    )
+                if run is not None:
+                    run.observe_tools(results)
 
+                function_responses = []
+                for function_call, (function_call_result, elapsed) in zip(
+                        function_calls, results):
+                    part = function_response_part(function_call_result)
                     function_responses.append(part)
+                    if tracer is not None:
+                        tracer.tool_call(
+                            iteration, function_call,
+                            part.function_response.response, elapsed)
 
-                    if args.verbose:
+                    if verbose:
                         print(f"-> {part.function_response.response}")
+                        print(f"   ({part.function_response.name} took {elapsed:.3f}s)")
 
                 # Append the function results as a user message so the model sees them
                 messages.append(types.Content(
                     role="user", parts=function_responses))
+                if session is not None:
+                    session.save(messages)
                 # Continue the loop to let the model react to the tool results
                 continue
 
             # No function calls => final assistant response
-            if not function_calls:
-                print(response.text)
-                break
+            if session is not None:
+                session.save(messages)
+            if run is not None:
+                run.finish(forced or "answered")
+                if tracer is not None:
+                    tracer.record("stop", iteration=iteration, reason=run.reason)
+            if forced is not None:
+                text = answer_text(model_contents)
+                if text is None:
+                    print("No final answer was given.")
+                    return None
+                print(text)
+                return text
+            if stream:
+                # The text has already been printed as it arrived.
+                return _content_text(model_contents[0])
+            print(response.text)
+            return response.text
+    except Exception:
+        if run is not None:
+            run.finish("error")
+        raise
+    finally:
+        if dispatcher is not None:
+            dispatcher.close()
+        if verbose:
+            print(f"File cache: {file_cache.reads_saved} reads saved")
+            if memo is not None:
+                print(f"Repeated calls answered: {memo.hits}")
+            if cache is not None:
+                print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+
+    print("Maximum iterations reached without a final response.")
+    return None
+
+
+_config = None
+
+
+def build_config():
+    """Return the generation config, reusing it while the tools don't change.
+
+    The config must be treated as read-only: every request shares it.
+    """
+    global _config
+    from google.genai import types
+    from functions import registry
+
+    tools = registry.declarations()
+    if _config is None or _config.tools[0] is not tools:
+        _config = types.GenerateContentConfig(
+            system_instruction=system_prompt,
+            temperature=0,
+            tools=[tools],
+        )
+    return _config
+
+
+def pinned_content(path):
+    """Return a file's text as a user Content to pin ahead of a conversation."""
+    from google.genai import types
 
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    return types.Content(role="user", parts=[
+        types.Part(text=f"Contents of {path}:\n{text}")])
+
+
+def _get_token(u, *names):
+    """Extract a token count from either dict-like or object-like usage."""
+    for name in names:
+        if isinstance(u, dict):
+            val = u.get(name)
         else:
-            print("Maximum iterations reached without a final response.")
-            sys.exit(1)
-    except Exception as e:
-        print("Request to Gemini API failed:", e)
-        raise
+            val = getattr(u, name, None)
+        if val is not None:
+            return val
+    return None
+
+
+def usage_tokens(usage):
+    """Return (prompt_tokens, response_tokens) from usage metadata."""
+    prompt_tokens = _get_token(
+        usage, "prompt_tokens", "input_tokens", "prompt_token_count")
+    response_tokens = _get_token(
+        usage, "response_tokens", "completion_tokens", "response_token_count",
+        "candidates_token_count")
+    return prompt_tokens, response_tokens
+
+
+def generate_response(client, messages, config, cache=None, scheduler=None):
+    """Call generate_content, answering from ``cache`` when possible.
+
+    With a ``scheduler`` the request waits for rate-limit capacity and is
+    retried if it fails transiently.
+    """
+    if cache is None:
+        return _generate(client, messages, config, scheduler)
+
+    key = cache_key(MODEL, messages, config)
+    response = cache.get(key)
+    if response is None:
+        response = _generate(client, messages, config, scheduler)
+        cache.put(key, response)
+    return response
+
+
+def _generate(client, messages, config, scheduler):
+    if scheduler is None:
+        return client.models.generate_content(
+            model=MODEL, contents=messages, config=config)
+    return scheduler.call(
+        client.models.generate_content,
+        model=MODEL, contents=messages, config=config,
+        prompt_chars=sum(content_chars(content) for content in messages))
+
+
+def _open_stream(client, messages, config):
+    """Start a stream and wait for its first chunk.
+
+    Errors (a 429, a dropped connection) surface by the first chunk, and
+    until then nothing has been printed or dispatched, so this is the part
+    of a streamed request that can safely be retried.
+    """
+    chunks = client.models.generate_content_stream(
+        model=MODEL, contents=messages, config=config)
+    first = next(chunks, None)
+    return chunks if first is None else itertools.chain([first], chunks)
+
+
+def _stream_turn(client, messages, config, dispatcher, cache=None,
+                 scheduler=None):
+    """Stream one model response, dispatching function calls as they arrive.
+
+    Returns the model's Content (adjacent text chunks merged, so history
+    matches a non-streamed response), the final usage metadata and the
+    function calls that were submitted to ``dispatcher``. A cached response
+    is replayed as a single chunk. With a ``scheduler``, opening the stream
+    is rate limited and retried; a failure after the first chunk is not.
+    """
+    from google.genai import types
+
+    parts = []
+    usage = None
+    function_calls = []
+    printed_text = False
+
+    key = None
+    cached = None
+    if cache is not None:
+        key = cache_key(MODEL, messages, config)
+        cached = cache.get(key)
+    if cached is not None:
+        chunks = [cached]
+    elif scheduler is None:
+        chunks = client.models.generate_content_stream(
+            model=MODEL, contents=messages, config=config)
+    else:
+        # Usage only arrives with the last chunk, so the scheduler keeps
+        # its estimate for this request.
+        chunks = scheduler.call(
+            _open_stream, client, messages, config,
+            prompt_chars=sum(content_chars(content) for content in messages),
+            usage=lambda chunks: None)
+
+    for chunk in chunks:
+        if getattr(chunk, "usage_metadata", None) is not None:
+            usage = chunk.usage_metadata
+
+        candidates = getattr(chunk, "candidates", None)
+        if not candidates or candidates[0].content is None:
+            continue
+
+        for part in candidates[0].content.parts or []:
+            if part.function_call is not None:
+                dispatcher.submit(part.function_call)
+                function_calls.append(part.function_call)
+                parts.append(part)
+            elif part.text is not None and not part.thought:
+                print(part.text, end="", flush=True)
+                printed_text = True
+                if parts and _is_plain_text(parts[-1]):
+                    parts[-1] = types.Part(text=parts[-1].text + part.text)
+                else:
+                    parts.append(part)
+            else:
+                parts.append(part)
+
+    if printed_text:
+        print()
+
+    content = types.Content(role="model", parts=parts)
+    if key is not None and cached is None:
+        cache.put(key, types.GenerateContentResponse(
+            candidates=[types.Candidate(content=content)],
+            usage_metadata=usage,
+        ))
+    return content, usage, function_calls
+
+
+def _is_plain_text(part):
+    return (
+        part.text is not None
+        and not part.thought
+        and part.function_call is None
+    )
+
+
+def _content_text(content):
+    return "".join(
+        part.text for part in content.parts or []
+        if part.text is not None and not part.thought
+    )
+
+
+def answer_text(contents):
+    """Return the text of a forced final answer's Contents, or None."""
+    return "".join(_content_text(content) for content in contents) or None
+
+
+def function_response_part(function_call_result):
+    """Return the function_response Part from call_function's result."""
+    if not getattr(function_call_result, "parts", None):
+        raise RuntimeError("call_function returned no parts")
+
+    part = function_call_result.parts[0]
+    if getattr(part, "function_response", None) is None:
+        raise RuntimeError(
+            "function_response is missing from part")
+
+    if getattr(part.function_response, "response", None) is None:
+        raise RuntimeError(
+            "function_response.response is missing")
+
+    return part
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+# The config last hashed and its dump; requests share one config object.
+_last_config = (None, None)
+
+
+def _config_dump(config):
+    global _last_config
+    last, dump = _last_config
+    if last is not config:
+        dump = config.model_dump(mode="json", exclude_none=True)
+        _last_config = (config, dump)
+    return dump
+
+
+def cache_key(model, contents, config):
+    """Return a stable hash of everything that determines a response.
+
+    The config dump covers the system instruction, tool declarations and
+    sampling parameters, so changing any of them changes the key.
+    """
+    payload = {
+        "model": model,
+        "contents": [
+            content.model_dump(mode="json", exclude_none=True)
+            for content in contents
+        ],
+        "config": _config_dump(config),
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Content-addressed cache for generate_content responses.
+
+    Entries live in an in-memory LRU and, if ``directory`` is given, in an
+    on-disk store shared between runs. The disk store evicts its least
+    recently used files once it grows past ``max_bytes``.
+    """
+
+    def __init__(self, max_entries=128, directory=None,
+                 max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_sizes = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for entry in os.scandir(directory):
+                if entry.is_file() and entry.name.endswith(".json"):
+                    self._disk_sizes[entry.name[:-5]] = entry.stat().st_size
+
+    def get(self, key):
+        """Return the cached response for ``key`` or None, counting hits/misses."""
+        from google.genai import types
+
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            elif key in self._disk_sizes:
+                data = self._read_disk(key)
+                if data is not None:
+                    self._remember(key, data)
+
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        return types.GenerateContentResponse.model_validate_json(data)
+
+    def put(self, key, response):
+        data = response.model_dump_json(exclude_none=True)
+        with self._lock:
+            self._remember(key, data)
+            if self.directory is not None:
+                self._write_disk(key, data)
+
+    def _remember(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = f.read()
+            # Touch the file so eviction treats it as recently used.
+            os.utime(path)
+        except OSError:
+            self._disk_sizes.pop(key, None)
+            return None
+        return data
+
+    def _write_disk(self, key, data):
+        # Write to a temp file and rename so a concurrent reader never
+        # sees a half-written entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._disk_sizes[key] = len(data.encode("utf-8"))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        total = sum(self._disk_sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        def mtime(key):
+            try:
+                return os.stat(self._path(key)).st_mtime_ns
+            except OSError:
+                return 0
+
+        for key in sorted(self._disk_sizes, key=mtime):
+            if total <= self.max_bytes:
+                break
+            total -= self._disk_sizes.pop(key)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
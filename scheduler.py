@@ -0,0 +1,200 @@
+import random
+import sys
+import threading
+import time
+
+from history import DEFAULT_CHARS_PER_TOKEN, MAX_CHARS_PER_TOKEN, MIN_CHARS_PER_TOKEN
+
+# HTTP status codes worth retrying: timeouts, rate limits, server trouble.
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    """True for rate limits, server errors and dropped connections."""
+    if getattr(error, "code", None) in RETRYABLE_CODES:
+        return True
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # The SDK's transport errors come from httpx; if nothing has imported
+    # it, the error can't be one of them.
+    httpx = sys.modules.get("httpx")
+    return httpx is not None and isinstance(error, httpx.TransportError)
+
+
+def retry_delay_hint(error):
+    """Seconds the server asked us to wait (google.rpc.RetryInfo), if any."""
+    details = getattr(error, "details", None)
+    if not isinstance(details, dict):
+        return None
+    for detail in (details.get("error") or {}).get("details") or []:
+        delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+        if isinstance(delay, str) and delay.endswith("s"):
+            try:
+                return float(delay[:-1])
+            except ValueError:
+                return None
+    return None
+
+
+def token_counts(response):
+    """(prompt, response) tokens from a response's usage_metadata, or None.
+
+    Thinking tokens count as response tokens: they are generated, and
+    charged, the same way.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    prompt = getattr(usage, "prompt_token_count", None) or 0
+    candidates = ((getattr(usage, "candidates_token_count", None) or 0)
+                  + (getattr(usage, "thoughts_token_count", None) or 0))
+    if not prompt and not candidates:
+        return None
+    return prompt, candidates
+
+
+class TokenBucket:
+    """Continuously refilling allowance of ``per_minute`` units.
+
+    ``reserve`` always succeeds: it takes the units now, letting the level
+    go negative, and returns how long the caller must wait before using
+    them. Because every reservation queues behind the ones before it,
+    callers are served in FIFO order without a separate queue.
+    """
+
+    def __init__(self, per_minute, now):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = now
+
+    def reserve(self, amount, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount):
+        """Give back (or, if negative, take) units after the fact."""
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RequestScheduler:
+    """Rate limits and retries model calls, shared by every session.
+
+    ``rpm`` and ``tpm`` are the requests/minute and tokens/minute quotas
+    (None for no limit). Before each attempt a request reserves one
+    request and its estimated tokens, and waits out whatever the buckets
+    say; once the response arrives its usage_metadata replaces the
+    estimate. Retryable errors are retried up to ``max_retries`` times
+    with full-jitter exponential backoff, or after the delay the server
+    asks for, whichever is longer.
+
+    ``clock``, ``sleep``, ``async_sleep`` (asyncio.sleep by default) and
+    ``rng`` can be replaced to test without waiting.
+    """
+
+    def __init__(self, rpm=None, tpm=None, max_retries=5, base_delay=1.0,
+                 max_delay=60.0, clock=time.monotonic, sleep=time.sleep,
+                 async_sleep=None, rng=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.async_sleep = async_sleep
+        self.rng = rng or random.Random()
+        self.chars_per_token = DEFAULT_CHARS_PER_TOKEN
+        self.response_tokens = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+        now = clock()
+        self._requests = TokenBucket(rpm, now) if rpm else None
+        self._tokens = TokenBucket(tpm, now) if tpm else None
+
+    def call(self, function, *args, prompt_chars=0, usage=token_counts, **kwargs):
+        """Run ``function(*args, **kwargs)`` under the limits, retrying.
+
+        ``prompt_chars`` sizes the token reservation; ``usage`` reads the
+        (prompt, response) tokens actually used from the result (returning
+        None keeps the estimate).
+        """
+        for attempt in range(self.max_retries + 1):
+            estimate, delay = self._reserve(prompt_chars)
+            if delay:
+                self.sleep(delay)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                backoff = self._failed(e, attempt, estimate)
+                self.sleep(backoff)
+                continue
+            self._settle(estimate, prompt_chars, usage(result))
+            return result
+
+    async def acall(self, function, *args, prompt_chars=0, usage=token_counts,
+                    **kwargs):
+        """Async ``call`` for coroutine functions."""
+        # Imported here: asyncio is a slow import, and already loaded by
+        # the time anything awaits this.
+        import asyncio
+
+        async_sleep = self.async_sleep or asyncio.sleep
+        for attempt in range(self.max_retries + 1):
+            estimate, delay = self._reserve(prompt_chars)
+            if delay:
+                await async_sleep(delay)
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as e:
+                backoff = self._failed(e, attempt, estimate)
+                await async_sleep(backoff)
+                continue
+            self._settle(estimate, prompt_chars, usage(result))
+            return result
+
+    def _reserve(self, prompt_chars):
+        with self._lock:
+            estimate = prompt_chars / self.chars_per_token + self.response_tokens
+            now = self.clock()
+            delay = 0.0
+            if self._requests is not None:
+                delay = self._requests.reserve(1, now)
+            if self._tokens is not None:
+                delay = max(delay, self._tokens.reserve(estimate, now))
+            self.requests += 1
+            self.throttled_seconds += delay
+            return estimate, delay
+
+    def _settle(self, estimate, prompt_chars, counts):
+        if counts is None:
+            return
+        prompt, response = counts
+        with self._lock:
+            if self._tokens is not None:
+                self._tokens.refund(estimate - prompt - response)
+            # Keep running estimates of the response share of a request
+            # and of how many prompt characters make a token.
+            self.response_tokens += (response - self.response_tokens) * 0.2
+            if prompt_chars and prompt:
+                self.chars_per_token = min(
+                    MAX_CHARS_PER_TOKEN,
+                    max(MIN_CHARS_PER_TOKEN, prompt_chars / prompt))
+
+    def _failed(self, error, attempt, estimate):
+        """Return how long to back off after ``error``, or re-raise it."""
+        if attempt >= self.max_retries or not is_retryable(error):
+            raise error
+        with self._lock:
+            if self._tokens is not None:
+                # A rejected request used no tokens.
+                self._tokens.refund(estimate)
+            self.retries += 1
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        backoff = self.rng.uniform(0, ceiling)
+        hint = retry_delay_hint(error)
+        if hint is not None:
+            backoff = max(backoff, min(hint, self.max_delay))
+        return backoff
@@ -0,0 +1,473 @@
+"""Long-running HTTP front end: one process, one client, many sessions.
+
+Endpoints (JSON in, JSON out):
+
+    POST   /prompt          {"prompt": "...", "session": "optional id"}
+    DELETE /sessions/<id>
+    GET    /health
+
+``POST /prompt`` streams newline-delimited JSON events as the session
+runs: "session" (its id, to continue it with), "model" after every model
+response, "tool" after every tool call, then "done" with the final text
+or "error". A new session gets its own copy of the template directory as
+its working directory; a continued one keeps its history, files and
+FileCache.
+
+At most --max-in-flight prompts run at once and --max-waiting more wait
+for a slot; beyond that requests are turned away with 503 and a
+Retry-After header instead of queueing without bound. Streamed events
+wait for the client to read them, so a slow reader slows its own session
+rather than filling the server's memory.
+
+The Gemini client is created once and its HTTP connections are kept
+alive between requests, and every module is already imported, so a
+request costs the model's time plus the tools'.
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from batch import run_session
+from functions import run_tests as test_runner, search_files as search_index
+from functions.call_function import WORKING_DIRECTORY
+from functions.file_cache import FileCache
+from governor import Governor
+from history import DEFAULT_CHARS_PER_TOKEN
+from main import build_config, get_client
+from scheduler import RequestScheduler
+
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_LINES = 100
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 411: "Length Required",
+    413: "Payload Too Large", 500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+class ServerSession:
+    """A conversation and the working directory its tools run in."""
+
+    def __init__(self, session_id, working_directory, clock):
+        self.id = session_id
+        self.working_directory = working_directory
+        self.messages = []
+        self.file_cache = FileCache()
+        self.lock = asyncio.Lock()
+        self.last_used = clock()
+        # Prompts accepted for this session and not finished yet.
+        self.pending = 0
+
+
+class AgentServer:
+    """Serve agent sessions over HTTP on the running event loop.
+
+    ``client`` is shared by every session; anything with the async
+    ``client.aio.models.generate_content`` surface works, so the server
+    can be load tested against a stub. Sessions past ``max_sessions`` or
+    idle for ``session_ttl`` seconds are dropped, least recently used
+    first, along with their working directories. ``governor``, an
+    optional Governor, applies its limits to each prompt; /health then
+    reports why prompts ended.
+    """
+
+    def __init__(self, client, template=WORKING_DIRECTORY, workspace_root=None,
+                 max_in_flight=8, max_waiting=32, max_sessions=64,
+                 session_ttl=3600, scheduler=None, result_budget=None,
+                 parallel=False, governor=None, clock=time.monotonic):
+        self.client = client
+        self.template = template
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.scheduler = scheduler
+        self.result_budget = result_budget
+        self.parallel = parallel
+        self.governor = governor
+        self.clock = clock
+        self._own_workspace_root = workspace_root is None
+        self.workspace_root = (tempfile.mkdtemp(prefix="ai-bot-sessions-")
+                               if workspace_root is None else workspace_root)
+        os.makedirs(self.workspace_root, exist_ok=True)
+        self.sessions = OrderedDict()
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._server = None
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host="127.0.0.1", port=8080):
+        # Build the tool declarations now rather than on the first request.
+        build_config()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._own_workspace_root:
+            await asyncio.to_thread(
+                shutil.rmtree, self.workspace_root, ignore_errors=True)
+
+    def stats(self):
+        stats = {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "sessions": len(self.sessions),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+        if self.governor is not None:
+            stats.update(self.governor.stats())
+        return stats
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HTTPError as e:
+                    await _send_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    return
+                if request is None:
+                    return
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    await self._route(method, path, body, writer, keep_alive)
+                except HTTPError as e:
+                    await _send_json(writer, e.status, {"error": str(e)},
+                                     keep_alive, e.headers)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body, writer, keep_alive):
+        if path == "/prompt":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            await self._prompt(_json_body(body), writer, keep_alive)
+        elif path == "/health":
+            if method != "GET":
+                raise HTTPError(405, "Use GET")
+            await _send_json(writer, 200, self.stats(), keep_alive)
+        elif path.startswith("/sessions/"):
+            if method != "DELETE":
+                raise HTTPError(405, "Use DELETE")
+            session = self.sessions.get(path[len("/sessions/"):])
+            if session is None:
+                raise HTTPError(404, "No such session")
+            if session.pending:
+                raise HTTPError(409, "Session is running a prompt")
+            await self._drop(session)
+            await _send_json(writer, 200, {"deleted": session.id}, keep_alive)
+        else:
+            raise HTTPError(404, f"No route for {path}")
+
+    async def _prompt(self, request, writer, keep_alive):
+        prompt = request.get("prompt")
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise HTTPError(400, 'Expected {"prompt": "..."}')
+        session_id = request.get("session")
+        if session_id is not None and not isinstance(session_id, str):
+            raise HTTPError(400, '"session" must be a session id string')
+        if self.in_flight + self.waiting >= self.max_in_flight + self.max_waiting:
+            self.rejected += 1
+            raise HTTPError(503, "Server is busy; retry later", [("Retry-After", "1")])
+
+        # Counted as waiting from here, so a burst can't get past the
+        # limit while sessions are being set up.
+        self.waiting += 1
+        try:
+            if session_id is None:
+                session = await self._create_session()
+            else:
+                session = self.sessions.get(session_id)
+                if session is None:
+                    raise HTTPError(404, "No such session")
+                self.sessions.move_to_end(session_id)
+            session.pending += 1
+        except BaseException:
+            self.waiting -= 1
+            raise
+
+        stream = _EventStream(writer, keep_alive)
+        try:
+            await stream.start()
+            await stream.send({"event": "session", "session": session.id})
+            try:
+                await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            try:
+                await self._run(session, prompt, stream)
+            finally:
+                self.in_flight -= 1
+                self._slots.release()
+        finally:
+            session.pending -= 1
+            session.last_used = self.clock()
+        await stream.end()
+
+    async def _run(self, session, prompt, stream):
+        async with session.lock:
+            start = len(session.messages)
+            try:
+                result = await run_session(
+                    self.client, prompt, parallel=self.parallel,
+                    working_directory=session.working_directory,
+                    scheduler=self.scheduler, result_budget=self.result_budget,
+                    messages=session.messages, file_cache=session.file_cache,
+                    on_event=stream.send, governor=self.governor)
+            except Exception as e:
+                # Leave the history as it was before this prompt, rather
+                # than ending on calls that never got their results.
+                del session.messages[start:]
+                self.failed += 1
+                await stream.send({"event": "error", "error": f"{type(e).__name__}: {e}"})
+                return
+        self.completed += 1
+        event = "error" if result.get("error") else "done"
+        await stream.send({"event": event, "session": session.id, **result})
+
+    async def _create_session(self):
+        await self._prune()
+        if len(self.sessions) >= self.max_sessions:
+            self.rejected += 1
+            raise HTTPError(503, "Too many sessions; retry later", [("Retry-After", "1")])
+        session_id = secrets.token_hex(8)
+        working_directory = os.path.join(self.workspace_root, session_id)
+        await asyncio.to_thread(
+            shutil.copytree, self.template, working_directory,
+            ignore=shutil.ignore_patterns("__pycache__"))
+        session = ServerSession(session_id, working_directory, self.clock)
+        self.sessions[session_id] = session
+        return session
+
+    async def _prune(self):
+        """Drop idle sessions past the TTL, then the least recently used
+        idle ones until there is room for a new session."""
+        now = self.clock()
+        for session in list(self.sessions.values()):
+            if not session.pending and (now - session.last_used > self.session_ttl
+                         or len(self.sessions) >= self.max_sessions):
+                await self._drop(session)
+
+    async def _drop(self, session):
+        self.sessions.pop(session.id, None)
+        # The tools keep state per working directory; this one is gone.
+        search_index.forget(session.working_directory)
+        test_runner.forget(session.working_directory)
+        await asyncio.to_thread(
+            shutil.rmtree, session.working_directory, ignore_errors=True)
+
+
+class _EventStream:
+    """A chunked application/x-ndjson response, one JSON object per line.
+
+    Every send waits for the transport to drain. If the client goes away
+    the session still runs to the end, so its history stays whole, and
+    the remaining events are dropped.
+    """
+
+    def __init__(self, writer, keep_alive):
+        self.writer = writer
+        self.keep_alive = keep_alive
+        self.closed = False
+
+    async def start(self):
+        await self._write(_head(200, [
+            ("Content-Type", "application/x-ndjson"),
+            ("Transfer-Encoding", "chunked"),
+            ("Cache-Control", "no-cache"),
+        ], self.keep_alive))
+
+    async def send(self, event):
+        data = (json.dumps(event, default=str) + "\n").encode("utf-8")
+        await self._write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    async def end(self):
+        await self._write(b"0\r\n\r\n")
+
+    async def _write(self, data):
+        if self.closed:
+            return
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except ConnectionError:
+            self.closed = True
+
+
+def _head(status, headers, keep_alive):
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _send_json(writer, status, payload, keep_alive, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(_head(status, [
+        ("Content-Type", "application/json"),
+        ("Content-Length", str(len(body))),
+        *headers,
+    ], keep_alive) + body)
+    await writer.drain()
+
+
+async def _read_request(reader):
+    """Return (method, path, headers, body), or None at end of stream."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line") from None
+
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(400, "Too many headers")
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(411, "Send a Content-Length")
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400, "Bad Content-Length") from None
+    if length < 0:
+        raise HTTPError(400, "Bad Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"Body over {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+def _json_body(body):
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "Body is not valid JSON") from None
+    if not isinstance(request, dict):
+        raise HTTPError(400, "Body must be a JSON object")
+    return request
+
+
+async def serve(server, host, port):
+    await server.start(host, port)
+    print(f"Serving on http://{host}:{server.port} "
+          f"(sessions in {server.workspace_root})", file=sys.stderr)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the agent over HTTP")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                        help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8080,
+                        help="Port to listen on (0 picks a free one)")
+    parser.add_argument("--template", type=str, default=WORKING_DIRECTORY,
+                        help="Directory copied into each new session's working directory")
+    parser.add_argument("--workspace-root", type=str, default=None,
+                        help="Where session working directories are created (default: a temporary directory)")
+    parser.add_argument("--max-in-flight", type=int, default=8,
+                        help="Prompts run at once")
+    parser.add_argument("--max-waiting", type=int, default=32,
+                        help="Prompts waiting for a slot before requests get 503")
+    parser.add_argument("--max-sessions", type=int, default=64,
+                        help="Sessions kept; the least recently used idle one is dropped past this")
+    parser.add_argument("--session-ttl", type=int, default=3600,
+                        help="Seconds an idle session is kept")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Run the function calls of one turn concurrently")
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="Keep model requests from all sessions under this many per minute")
+    parser.add_argument("--tpm", type=int, default=None,
+                        help="Keep model tokens from all sessions under this many per minute")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="Retry rate-limited or failed model requests this many times")
+    parser.add_argument("--result-budget", type=int, default=8000,
+                        help="Shape each turn's tool results to fit about this many tokens in total (0 for no limit)")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Ask a prompt for its final answer once it has taken this many seconds")
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="Ask a prompt for its final answer once it has used this many tokens")
+    parser.add_argument("--max-tool-seconds", type=float, default=None,
+                        help="Ask a prompt for its final answer once its tools have run for this many seconds")
+    parser.add_argument("--max-stalled-turns", type=int, default=3,
+                        help="Ask for a final answer after this many turns of only repeated or failed calls (0 to never)")
+    parser.add_argument("--no-dedupe", dest="dedupe", action="store_false",
+                        help="Run repeated identical tool calls again instead of reusing their results")
+    args = parser.parse_args()
+
+    async def run():
+        server = AgentServer(
+            get_client(),
+            template=args.template,
+            workspace_root=args.workspace_root,
+            max_in_flight=args.max_in_flight,
+            max_waiting=args.max_waiting,
+            max_sessions=args.max_sessions,
+            session_ttl=args.session_ttl,
+            scheduler=RequestScheduler(
+                rpm=args.rpm, tpm=args.tpm, max_retries=args.max_retries),
+            result_budget=(int(args.result_budget * DEFAULT_CHARS_PER_TOKEN)
+                           if args.result_budget else None),
+            parallel=args.parallel,
+            governor=Governor(
+                max_seconds=args.max_seconds,
+                max_tokens=args.max_tokens,
+                max_tool_seconds=args.max_tool_seconds,
+                max_stalled_turns=args.max_stalled_turns,
+                dedupe=args.dedupe,
+            ),
+        )
+        await serve(server, args.host, args.port)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import gzip
+import json
+import os
+import secrets
+import time
+
+DEFAULT_SESSION_DIR = ".sessions"
+SUFFIX = ".jsonl.gz"
+
+
+class Session:
+    """A conversation kept on disk so a later run can continue it.
+
+    A session is a gzipped JSON-lines file of records: ``{"content": ...}``
+    for each message of the history (tool results included) and
+    ``{"context_cache": ...}`` for the ContextCache handle it last used.
+    ``save`` appends only what is new since the previous save, as a new
+    gzip member, so a long session is never rewritten.
+    """
+
+    def __init__(self, path, messages=None, context_cache=None):
+        self.path = path
+        self.messages = list(messages or [])
+        self.context_cache = context_cache
+        self._saved = len(self.messages)
+
+    @property
+    def id(self):
+        return os.path.basename(self.path)[:-len(SUFFIX)]
+
+    @classmethod
+    def create(cls, directory=DEFAULT_SESSION_DIR):
+        os.makedirs(directory, exist_ok=True)
+        session_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+        return cls(os.path.join(directory, session_id + SUFFIX))
+
+    @classmethod
+    def load(cls, session, directory=DEFAULT_SESSION_DIR):
+        """Load a session by id, by path, or the latest one with "last".
+
+        Raises FileNotFoundError if there is no such session.
+        """
+        from google.genai import types
+
+        path = session
+        if session == "last":
+            paths = [entry.path for entry in os.scandir(directory)
+                     if entry.name.endswith(SUFFIX)] if os.path.isdir(directory) else []
+            if not paths:
+                raise FileNotFoundError(f"No sessions in {directory}")
+            path = max(paths, key=os.path.getmtime)
+        elif not os.path.exists(path):
+            path = os.path.join(directory, session + SUFFIX)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No session {session!r} in {directory}")
+
+        messages = []
+        context_cache = None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if "content" in record:
+                    messages.append(types.Content.model_validate(record["content"]))
+                elif "context_cache" in record:
+                    context_cache = record["context_cache"]
+        return cls(path, messages, context_cache)
+
+    def save(self, messages):
+        """Append the messages added since the last save."""
+        self.messages = list(messages)
+        records = [{"content": content.model_dump(mode="json", exclude_none=True)}
+                   for content in messages[self._saved:]]
+        self._append(records)
+        self._saved = len(messages)
+
+    def save_context_cache(self, handle):
+        self.context_cache = handle
+        self._append([{"context_cache": handle}])
+
+    def _append(self, records):
+        if not records:
+            return
+        lines = "".join(
+            json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(lines)
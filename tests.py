@@ -0,0 +1,1840 @@
+import asyncio
+import difflib
+import gzip
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+from contextlib import redirect_stdout
+from typing import Annotated
+
+from google.genai import errors, types
+
+import batch
+import main
+from benchmarks.server_load import StubClient, request
+from context_cache import ContextCache
+from governor import Governor
+from functions.call_function import call_function
+from functions.call_memo import REPEAT_NOTE
+from functions import output_capture, python_worker, registry, result_budget, search_files
+from functions import run_tests as run_tests_module
+from functions.file_cache import FileCache
+from functions.run_python_file import (
+    run_python_file,
+    set_execution_backend,
+)
+from history import HistoryManager, content_chars
+from response_cache import ResponseCache, cache_key
+from scheduler import RequestScheduler, TokenBucket
+from server import AgentServer
+from session import Session
+from tracing import Tracer, percentile
+
+
+def make_response(parts, prompt_tokens=10, response_tokens=5):
+    return types.GenerateContentResponse(
+        candidates=[
+            types.Candidate(content=types.Content(role="model", parts=parts))
+        ],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=response_tokens,
+        ),
+    )
+
+
+def call_part(name, **args):
+    return types.Part(function_call=types.FunctionCall(name=name, args=args))
+
+
+def make_chunk(parts, usage=False):
+    """One streamed chunk; only the last chunk of a response carries usage."""
+    chunk = make_response(parts)
+    if not usage:
+        chunk.usage_metadata = None
+    return chunk
+
+
+class FakeModels:
+    def __init__(self, responses, chunk_delay=0.0):
+        self.responses = list(responses)
+        self.chunk_delay = chunk_delay
+        self.requests = []
+        self.configs = []
+
+    def generate_content(self, model, contents, config):
+        self.requests.append(list(contents))
+        self.configs.append(config)
+        return self.responses.pop(0)
+
+    def generate_content_stream(self, model, contents, config):
+        """Yield the next scripted response as a list of chunks."""
+        self.requests.append(list(contents))
+        chunks = self.responses.pop(0)
+        for i, chunk in enumerate(chunks):
+            if i and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield chunk
+
+
+class FakeClient:
+    """Stands in for genai.Client, replaying scripted responses in order."""
+
+    def __init__(self, responses, chunk_delay=0.0):
+        self.models = FakeModels(responses, chunk_delay=chunk_delay)
+
+
+SLOW_SCRIPT = "import time\ntime.sleep(0.3)\nprint('done')\n"
+
+
+class AgentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.mkdtemp()
+        with open(os.path.join(self.working_directory, "slow.py"), "w") as f:
+            f.write(SLOW_SCRIPT)
+        self.cache = None
+
+    def tearDown(self):
+        shutil.rmtree(self.working_directory)
+
+    def run_agent(self, responses, chunk_delay=0.0, **kwargs):
+        client = FakeClient(responses, chunk_delay=chunk_delay)
+        self.output = io.StringIO()
+        with redirect_stdout(self.output):
+            final_text = main.run_agent(
+                client, "prompt", working_directory=self.working_directory,
+                **kwargs)
+        return client, final_text
+
+    def call(self, name, **args):
+        with redirect_stdout(io.StringIO()):
+            result = call_function(
+                types.FunctionCall(name=name, args=args),
+                working_directory=self.working_directory,
+                file_cache=self.cache)
+        return result.parts[0].function_response.response["result"]
+
+    def tool_results(self, client, turn=1):
+        tool_message = client.models.requests[turn][-1]
+        return [
+            (part.function_response.name, part.function_response.response)
+            for part in tool_message.parts
+        ]
+
+
+class TestParallelDispatch(AgentTestCase):
+    def slow_batch(self):
+        return [
+            make_response([call_part("run_python_file", file_path="slow.py")
+                           for _ in range(4)]),
+            make_response([types.Part(text="all done")]),
+        ]
+
+    def test_parallel_reduces_wall_clock_time(self):
+        start = time.perf_counter()
+        _, final_text = self.run_agent(self.slow_batch())
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, final_text = self.run_agent(
+            self.slow_batch(), parallel=True, max_subprocess_workers=4)
+        parallel = time.perf_counter() - start
+
+        self.assertEqual(final_text, "all done")
+        self.assertGreater(sequential, 1.2)
+        self.assertLess(parallel, sequential / 2)
+
+    def test_results_keep_request_order(self):
+        for name in ("a.txt", "b.txt", "c.txt"):
+            with open(os.path.join(self.working_directory, name), "w") as f:
+                f.write(name)
+        responses = [
+            make_response([
+                call_part("run_python_file", file_path="slow.py"),
+                call_part("get_file_content", file_path="a.txt"),
+                call_part("get_file_content", file_path="b.txt"),
+                call_part("get_file_content", file_path="c.txt"),
+            ]),
+            make_response([types.Part(text="ok")]),
+        ]
+        client, _ = self.run_agent(responses, parallel=True)
+
+        results = self.tool_results(client)
+        self.assertEqual([name for name, _ in results], [
+            "run_python_file", "get_file_content", "get_file_content",
+            "get_file_content",
+        ])
+        self.assertEqual(
+            [response["result"] for _, response in results[1:]],
+            ["a.txt", "b.txt", "c.txt"],
+        )
+
+    def test_conflicting_calls_run_in_order(self):
+        responses = [
+            make_response([
+                call_part("write_file", file_path="new.txt", content="fresh"),
+                call_part("get_file_content", file_path="new.txt"),
+            ]),
+            make_response([types.Part(text="ok")]),
+        ]
+        client, _ = self.run_agent(responses, parallel=True)
+
+        results = self.tool_results(client)
+        self.assertEqual(results[1][1]["result"], "fresh")
+
+    def test_reads_wait_for_scripts(self):
+        with open(os.path.join(self.working_directory, "gen.py"), "w") as f:
+            f.write("import time\ntime.sleep(0.1)\n"
+                    "open('out.txt', 'w').write('generated')\n")
+        responses = [
+            make_response([
+                call_part("run_python_file", file_path="gen.py"),
+                call_part("get_file_content", file_path="out.txt"),
+            ]),
+            make_response([types.Part(text="ok")]),
+        ]
+        client, _ = self.run_agent(
+            responses, parallel=True, governor=Governor())
+
+        results = self.tool_results(client)
+        self.assertEqual(results[1][1], {"result": "generated"})
+
+
+class TestStreaming(AgentTestCase):
+    def test_stream_rebuilds_same_history(self):
+        with open(os.path.join(self.working_directory, "a.txt"), "w") as f:
+            f.write("contents")
+        responses = [
+            make_response([
+                types.Part(text="Let me read it."),
+                call_part("get_file_content", file_path="a.txt"),
+            ]),
+            make_response([types.Part(text="The file says contents.")]),
+        ]
+        streamed = [
+            [
+                make_chunk([types.Part(text="Let me ")]),
+                make_chunk([types.Part(text="read it.")]),
+                make_chunk([call_part("get_file_content", file_path="a.txt")],
+                           usage=True),
+            ],
+            [
+                make_chunk([types.Part(text="The file says ")]),
+                make_chunk([types.Part(text="contents.")], usage=True),
+            ],
+        ]
+
+        plain_client, plain_text = self.run_agent(responses)
+        stream_client, stream_text = self.run_agent(streamed, stream=True)
+
+        self.assertEqual(stream_text, plain_text)
+        self.assertIn("The file says contents.", self.output.getvalue())
+        self.assertEqual(
+            [c.model_dump() for c in stream_client.models.requests[1]],
+            [c.model_dump() for c in plain_client.models.requests[1]],
+        )
+
+    def test_tools_overlap_with_generation(self):
+        streamed = [
+            [
+                make_chunk([call_part("run_python_file", file_path="slow.py")]),
+                make_chunk([types.Part(text="still generating")], usage=True),
+            ],
+            [make_chunk([types.Part(text="done")], usage=True)],
+        ]
+
+        start = time.perf_counter()
+        client, final_text = self.run_agent(
+            streamed, chunk_delay=0.3, stream=True)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(final_text, "done")
+        self.assertIn("done", self.tool_results(client)[0][1]["result"])
+        # The 0.3s script ran while the stub spent 0.3s producing the
+        # second chunk, so the turn takes well under the 0.6s sum.
+        self.assertLess(elapsed, 0.5)
+
+
+class TestResponseCache(AgentTestCase):
+    def responses(self):
+        return [
+            make_response([call_part("get_files_info", directory=".")]),
+            make_response([types.Part(text="listed")]),
+        ]
+
+    def test_replay_from_disk_skips_the_model(self):
+        cache_dir = os.path.join(self.working_directory, ".cache")
+        cache = ResponseCache(directory=cache_dir)
+        _, first = self.run_agent(self.responses(), cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+        # A fresh cache over the same directory, and a client with nothing
+        # scripted: every request must be answered from disk.
+        cache = ResponseCache(directory=cache_dir)
+        client, second = self.run_agent([], cache=cache, verbose=True)
+        self.assertEqual(second, first)
+        self.assertEqual(client.models.requests, [])
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+        self.assertIn("Response cache: 2 hits, 0 misses", self.output.getvalue())
+
+    def test_streamed_responses_are_cached(self):
+        cache = ResponseCache()
+        streamed = [
+            [make_chunk([types.Part(text="hel")]),
+             make_chunk([types.Part(text="lo")], usage=True)],
+        ]
+        self.run_agent(streamed, stream=True, cache=cache)
+        client, text = self.run_agent([], stream=True, cache=cache)
+        self.assertEqual(text, "hello")
+        self.assertEqual(cache.hits, 1)
+
+    def test_key_covers_contents_and_config(self):
+        contents = [types.Content(role="user", parts=[types.Part(text="hi")])]
+        other = [types.Content(role="user", parts=[types.Part(text="hey")])]
+        config = main.build_config()
+        key = cache_key(main.MODEL, contents, config)
+
+        self.assertEqual(key, cache_key(main.MODEL, contents, main.build_config()))
+        self.assertNotEqual(key, cache_key(main.MODEL, other, config))
+        self.assertNotEqual(key, cache_key("other-model", contents, config))
+        self.assertNotEqual(key, cache_key(
+            main.MODEL, contents,
+            types.GenerateContentConfig(system_instruction="different")))
+
+    def test_disk_store_evicts_least_recently_used(self):
+        cache_dir = os.path.join(self.working_directory, ".cache")
+        response = make_response([types.Part(text="x" * 1000)])
+        size = len(response.model_dump_json(exclude_none=True))
+        cache = ResponseCache(max_entries=1, directory=cache_dir,
+                              max_bytes=size * 2)
+        cache.put("a", response)
+        cache.put("b", response)
+        os.utime(os.path.join(cache_dir, "a.json"), (0, 0))
+        cache.put("c", response)
+
+        self.assertEqual(sorted(os.listdir(cache_dir)), ["b.json", "c.json"])
+
+
+class TestFileCache(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = FileCache()
+
+    def test_repeat_reads_are_served_from_cache(self):
+        self.call("write_file", file_path="a.txt", content="one")
+        self.assertEqual(self.call("get_file_content", file_path="a.txt"), "one")
+        self.assertEqual(self.call("get_file_content", file_path="a.txt"), "one")
+        self.call("get_files_info")
+        self.call("get_files_info", directory=".")
+        self.assertEqual(self.cache.reads_saved, 2)
+
+    def test_write_file_invalidates_content_and_listing(self):
+        self.call("write_file", file_path="a.txt", content="one")
+        self.call("get_file_content", file_path="a.txt")
+        self.assertIn("a.txt: file_size=3 bytes", self.call("get_files_info"))
+
+        self.call("write_file", file_path="a.txt", content="three")
+        self.assertEqual(self.call("get_file_content", file_path="a.txt"), "three")
+        self.assertIn("a.txt: file_size=5 bytes", self.call("get_files_info"))
+        self.assertEqual(self.cache.reads_saved, 0)
+
+    def test_outside_changes_are_detected_by_stat(self):
+        path = os.path.join(self.working_directory, "a.txt")
+        self.call("write_file", file_path="a.txt", content="one")
+        self.call("get_file_content", file_path="a.txt")
+        with open(path, "w") as f:
+            f.write("changed")
+        self.assertEqual(self.call("get_file_content", file_path="a.txt"), "changed")
+
+    def test_run_python_file_invalidates_listings(self):
+        with open(os.path.join(self.working_directory, "touch.py"), "w") as f:
+            f.write("open('a.txt', 'a').write('more')\n")
+        self.call("write_file", file_path="a.txt", content="one")
+        self.assertIn("a.txt: file_size=3 bytes", self.call("get_files_info"))
+        # Growing a file leaves the directory's mtime alone.
+        self.call("run_python_file", file_path="touch.py")
+        self.assertIn("a.txt: file_size=7 bytes", self.call("get_files_info"))
+
+
+class TestRangedReads(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lines = [f"line {i:06d} " + "x" * 40 for i in range(1, 50001)]
+        with open(os.path.join(self.working_directory, "big.log"), "w") as f:
+            f.write("\n".join(self.lines) + "\n")
+
+    def test_line_range(self):
+        result = self.call("get_file_content", file_path="big.log",
+                           start_line=40000, end_line=40002)
+        self.assertEqual(result, "\n".join(self.lines[39999:40002]) + "\n")
+        # Served from the cached line index the second time.
+        result = self.call("get_file_content", file_path="big.log",
+                           start_line=39999.0, end_line=39999.0)
+        self.assertEqual(result, self.lines[39998] + "\n")
+
+    def test_open_ended_range_is_capped(self):
+        result = self.call("get_file_content", file_path="big.log", start_line=2)
+        self.assertTrue(result.startswith(self.lines[1]))
+        self.assertIn("Truncated at 10000 characters; continue from byte offset", result)
+
+    def test_start_line_past_end(self):
+        result = self.call("get_file_content", file_path="big.log", start_line=50001)
+        self.assertEqual(
+            result, 'Error: start_line 50001 is past the end of "big.log" (50000 lines)')
+
+    def test_byte_range_keeps_characters_whole(self):
+        with open(os.path.join(self.working_directory, "u.txt"), "w", encoding="utf-8") as f:
+            f.write("aé€b")
+        # Byte 2 is inside "é"; the range is moved to the next character.
+        self.assertEqual(
+            self.call("get_file_content", file_path="u.txt", offset=2, length=4),
+            '€[...Read bytes 3-6 of 7 in "u.txt"]')
+
+    def test_binary_files_are_refused(self):
+        with open(os.path.join(self.working_directory, "data.bin"), "wb") as f:
+            f.write(b"\x00\x01\x02" * 100)
+        for args in ({}, {"offset": 0, "length": 10}, {"start_line": 1}):
+            self.assertEqual(
+                self.call("get_file_content", file_path="data.bin", **args),
+                'Error: "data.bin" appears to be a binary file')
+
+
+class TestRecursiveListing(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        for path in ("pkg/a.py", "pkg/b.txt", "pkg/sub/c.py", "build/out.py",
+                     "notes.txt", ".git/HEAD"):
+            path = os.path.join(self.working_directory, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write("x")
+        with open(os.path.join(self.working_directory, ".gitignore"), "w") as f:
+            f.write("# comment\nbuild/\n*.txt\n!notes.txt\n")
+
+    def names(self, listing):
+        return [line[2:line.index(":")] for line in listing.splitlines()
+                if line.startswith("- ")]
+
+    def test_walks_in_sorted_order_respecting_gitignore(self):
+        self.assertEqual(
+            self.names(self.call("get_files_info", max_depth=10)),
+            [".gitignore", "notes.txt", "pkg", "pkg/a.py", "pkg/sub",
+             "pkg/sub/c.py", "slow.py"])
+        self.assertEqual(
+            self.names(self.call("get_files_info", directory="pkg", max_depth=1)),
+            ["a.py", "sub"])
+        self.assertIn("build/out.py", self.names(
+            self.call("get_files_info", max_depth=10, gitignore=False)))
+
+    def test_include_and_exclude(self):
+        self.assertEqual(
+            self.names(self.call("get_files_info", max_depth=10, include=["*.py"],
+                                 exclude=["sub/"])),
+            ["pkg/a.py", "slow.py"])
+        self.assertEqual(
+            self.names(self.call("get_files_info", max_depth=10,
+                                 include="pkg/**/*.py")),
+            ["pkg/a.py", "pkg/sub/c.py"])
+
+    def test_cursor_continues_where_the_limit_stopped(self):
+        full = self.names(self.call("get_files_info", max_depth=10))
+        pages, cursor = [], None
+        while True:
+            listing = self.call("get_files_info", max_depth=10, limit=3,
+                                cursor=cursor)
+            pages.append(self.names(listing))
+            if "cursor=" not in listing:
+                break
+            cursor = listing.rsplit('cursor="', 1)[1].split('"')[0]
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), full)
+
+
+class TestSearchFiles(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        files = {
+            "pkg/calc.py": "import math\n\ndef evaluate(expr):\n    return Evaluator().run(expr)\n",
+            "pkg/render.py": "def render(expression, result):\n    return f'{expression} = {result}'\n",
+            "build/calc.py": "def evaluate(expr):\n    pass\n",
+            ".gitignore": "build/\n",
+        }
+        for path, content in files.items():
+            path = os.path.join(self.working_directory, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(content)
+
+    def test_substring_and_regex_matches(self):
+        self.assertEqual(self.call("search_files", pattern="def evaluate"),
+                         "pkg/calc.py:3: def evaluate(expr):")
+        self.assertEqual(
+            self.call("search_files", pattern=r"def (render|evaluate)\(", regex=True),
+            "pkg/calc.py:3: def evaluate(expr):\n"
+            "pkg/render.py:1: def render(expression, result):")
+        self.assertEqual(self.call("search_files", pattern="EVALUATOR", ignore_case=True),
+                         "pkg/calc.py:4:     return Evaluator().run(expr)")
+        self.assertEqual(self.call("search_files", pattern="nothing here"),
+                         'No matches found for "nothing here"')
+
+    def test_anchored_regex_matches_any_line(self):
+        self.assertEqual(self.call("search_files", pattern="^def evaluate", regex=True),
+                         "pkg/calc.py:3: def evaluate(expr):")
+        self.assertEqual(self.call("search_files", pattern=r"import math$", regex=True),
+                         "pkg/calc.py:1: import math")
+
+    def test_match_cap(self):
+        result = self.call("search_files", pattern="e", max_matches=2)
+        self.assertEqual(len(result.splitlines()), 3)
+        self.assertIn("Stopped after 2 matches", result)
+
+    def test_index_follows_write_file(self):
+        self.call("search_files", pattern="evaluate")
+        with unittest.mock.patch.object(search_files, "RESCAN_INTERVAL", 3600):
+            self.call("write_file", file_path="pkg/new.py", content="x = evaluate('1')\n")
+            self.call("write_file", file_path="pkg/calc.py", content="import math\n")
+            self.assertEqual(self.call("search_files", pattern="evaluate"),
+                             "pkg/new.py:1: x = evaluate('1')")
+
+    def test_regex_literals_narrow_the_candidates(self):
+        grams = search_files._query_trigrams(r"foo(bar|baz)+qux\w*", True)
+        self.assertEqual(grams, search_files._trigrams(b"foo") | search_files._trigrams(b"qux"))
+        self.assertEqual(search_files._query_trigrams("a|bcd", True), set())
+
+
+class TestEditFile(AgentTestCase):
+    ORIGINAL = "".join(f"line {i}\n" for i in range(1, 201))
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.working_directory, "big.txt")
+        with open(self.path, "w") as f:
+            f.write(self.ORIGINAL)
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_exact_replacement(self):
+        self.assertEqual(
+            self.call("edit_file", file_path="big.txt", old_string="line 42\n",
+                      new_string="line forty-two\n"),
+            'Successfully edited "big.txt": replaced 1 occurrence (1699 characters now)')
+        self.assertEqual(self.read(), self.ORIGINAL.replace("line 42\n", "line forty-two\n"))
+
+        result = self.call("edit_file", file_path="big.txt", old_string="line 1",
+                           new_string="x")
+        self.assertIn("occurs 111 times", result)
+        result = self.call("edit_file", file_path="big.txt", old_string="line 42\n",
+                           new_string="")
+        self.assertIn("was not found", result)
+
+    def test_unified_diff_with_shifted_lines(self):
+        new = self.ORIGINAL.replace("line 150\n", "line 150\nline 150.5\n")
+        diff = "".join(difflib.unified_diff(
+            self.ORIGINAL.splitlines(True), new.splitlines(True), "a/big.txt", "b/big.txt"))
+        # The file moved on since the diff was made; the hunk still applies.
+        with open(self.path, "w") as f:
+            f.write("header\n" + self.ORIGINAL)
+        self.assertEqual(
+            self.call("edit_file", file_path="big.txt", diff=diff),
+            'Successfully edited "big.txt": removed 0 and added 1 lines (1710 characters now)')
+        self.assertEqual(self.read(), "header\n" + new)
+
+    def test_mismatched_context_leaves_file_alone(self):
+        diff = "@@ -10,2 +10,2 @@\n line 10\n-line 99\n+changed\n"
+        result = self.call("edit_file", file_path="big.txt", diff=diff)
+        self.assertIn("hunk 1 (@@ -10) does not match the file", result)
+        self.assertEqual(self.read(), self.ORIGINAL)
+        self.assertEqual(sorted(os.listdir(self.working_directory)),
+                         ["big.txt", "slow.py"])
+
+    def test_dashed_lines_inside_a_hunk_are_not_headers(self):
+        with open(self.path, "w") as f:
+            f.write("keep\n-- comment\n")
+        diff = "--- a/big.txt\n+++ b/big.txt\n@@ -1,2 +1,1 @@\n keep\n--- comment\n"
+        self.call("edit_file", file_path="big.txt", diff=diff)
+        self.assertEqual(self.read(), "keep\n")
+
+        diff = "@@ -1,1 +1,2 @@\n keep\n+++ counter\n"
+        self.call("edit_file", file_path="big.txt", diff=diff)
+        self.assertEqual(self.read(), "keep\n++ counter\n")
+
+    def test_edit_invalidates_file_cache(self):
+        self.cache = FileCache()
+        self.call("get_file_content", file_path="big.txt")
+        self.call("edit_file", file_path="big.txt", old_string="line 200\n",
+                  new_string="")
+        self.assertNotIn("line 200", self.call("get_file_content", file_path="big.txt"))
+
+
+class TestTracing(AgentTestCase):
+    def responses(self):
+        return [
+            make_response([
+                call_part("get_files_info"),
+                call_part("run_python_file", file_path="slow.py"),
+            ], prompt_tokens=100, response_tokens=20),
+            make_response([types.Part(text="done")], prompt_tokens=300,
+                          response_tokens=7),
+        ]
+
+    def test_spans_are_written_as_jsonl(self):
+        path = os.path.join(self.working_directory, "trace.jsonl")
+        tracer = Tracer(path)
+        self.run_agent(self.responses(), tracer=tracer)
+        tracer.close()
+
+        with open(path) as f:
+            spans = [json.loads(line) for line in f]
+        self.assertEqual([(s["span"], s["iteration"]) for s in spans], [
+            ("history", 1), ("model", 1), ("tool", 1), ("tool", 1),
+            ("history", 2), ("model", 2),
+        ])
+        self.assertEqual(spans[0]["messages"], 1)
+        self.assertEqual(spans[4]["messages"], 3)
+        tool = spans[3]
+        self.assertEqual(tool["name"], "run_python_file")
+        self.assertEqual(tool["args_chars"], len('{"file_path": "slow.py"}'))
+        self.assertGreater(tool["result_chars"], 0)
+        self.assertGreaterEqual(tool["seconds"], 0.3)
+
+    def test_summary_reports_percentiles_and_tokens(self):
+        tracer = Tracer()
+        self.run_agent(self.responses(), tracer=tracer)
+        lines = tracer.summary().splitlines()
+        self.assertEqual(lines[0].split(":")[0], "Trace summary")
+        self.assertEqual([line.split()[0] for line in lines[2:5]],
+                         ["model", "run_python_file", "get_files_info"])
+        self.assertEqual(lines[-1], "Tokens: 400 prompt + 27 response = 427 total")
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile([3.0], 0.95), 3.0)
+
+
+class TestAgentLoopBenchmark(unittest.TestCase):
+    def test_scripted_session_reports_metrics(self):
+        from benchmarks import agent_loop
+
+        metrics = agent_loop.run_benchmark(turns=2, calls_per_turn=3, output_kb=4)
+        self.assertEqual(metrics["iterations"], 3)
+        self.assertEqual(
+            {name: tool["calls"] for name, tool in metrics["tools"].items()},
+            {"get_files_info": 1, "get_file_content": 2, "search_files": 1,
+             "run_python_file": 2})
+        self.assertGreater(metrics["history_chars_per_iteration"], 4 * 1024)
+
+        baseline = dict(metrics, iterations_per_sec=metrics["iterations_per_sec"] * 3)
+        lines, regressed = agent_loop.compare(metrics, baseline, 0.5)
+        self.assertTrue(regressed)
+        self.assertIn("REGRESSION", lines[0])
+        self.assertFalse(agent_loop.compare(metrics, metrics, 0.5)[1])
+
+
+class TestLazyImports(unittest.TestCase):
+    def run_python(self, code, env=None):
+        return subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env, check=True,
+        ).stdout
+
+    def test_entry_points_do_not_import_the_sdk(self):
+        from benchmarks import import_time
+
+        metrics = import_time.run_benchmark(repeat=1)
+        for module, result in metrics["modules"].items():
+            self.assertFalse(result["imports_sdk"], module)
+
+        slower = {"modules": {
+            module: {"import_ms": result["import_ms"] * 3, "imports_sdk": False}
+            for module, result in metrics["modules"].items()}}
+        self.assertFalse(import_time.compare(metrics, metrics, 0.5)[1])
+        self.assertTrue(import_time.compare(slower, metrics, 0.5)[1])
+        # A machine that got slower across the board is not a regression.
+        slower["reference_ms"] = metrics["reference_ms"] * 3
+        self.assertFalse(import_time.compare(slower, metrics, 0.5)[1])
+
+    def test_help_works_without_an_api_key(self):
+        env = {k: v for k, v in os.environ.items() if k != "GEMINI_API_KEY"}
+        output = self.run_python(
+            "import sys; sys.argv = ['main.py', '--help']\n"
+            "import main\n"
+            "try:\n    main.main()\nexcept SystemExit:\n    pass\n"
+            "print('google.genai' in sys.modules)",
+            env=env)
+        self.assertIn("usage: main.py", output)
+        self.assertTrue(output.endswith("False\n"))
+
+    def test_tools_work_without_the_sdk(self):
+        output = self.run_python(
+            "import sys; sys.modules['google.genai'] = None\n"
+            "import functions.call_function\n"
+            "from functions import registry\n"
+            "print(len(registry.tools()))\n"
+            "print(registry.get('write_file').function('calculator', '../x.txt', ''))")
+        self.assertEqual(output.splitlines(), [
+            "7",
+            'Error: Cannot write to "../x.txt" as it is outside the permitted working directory',
+        ])
+
+
+def count_lines(working_directory,
+                file_path: Annotated[str, "Path to the file"],
+                cache=None,
+                patterns: Annotated[list[str] | None, "Only count lines containing these"] = None):
+    with open(os.path.join(working_directory, file_path)) as f:
+        lines = f.read().splitlines()
+    if patterns:
+        lines = [line for line in lines if any(p in line for p in patterns)]
+    return f"{len(lines)} lines"
+
+
+class TestToolRegistry(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.tool("Counts the lines of a file", writes=True)(count_lines)
+        self.addCleanup(registry.unregister, "count_lines")
+
+    def test_declarations_come_from_annotations(self):
+        declaration = {
+            d.name: d for d in registry.declarations().function_declarations
+        }["count_lines"]
+        self.assertEqual(declaration.description, "Counts the lines of a file")
+        properties = declaration.parameters.properties
+        self.assertEqual(list(properties), ["file_path", "patterns"])
+        self.assertEqual(properties["file_path"].type, types.Type.STRING)
+        self.assertEqual(properties["patterns"].type, types.Type.ARRAY)
+        self.assertEqual(properties["patterns"].items.type, types.Type.STRING)
+        self.assertEqual(properties["patterns"].description,
+                         "Only count lines containing these")
+
+    def test_registered_tool_is_dispatched(self):
+        with open(os.path.join(self.working_directory, "a.txt"), "w") as f:
+            f.write("one\ntwo\nthree\n")
+        self.assertEqual(self.call("count_lines", file_path="a.txt"), "3 lines")
+        self.assertEqual(
+            self.call("count_lines", file_path="a.txt", patterns=["o"]), "2 lines")
+        tool = registry.get("count_lines")
+        self.assertTrue(tool.cached)
+        self.assertTrue(tool.writes)
+        self.assertFalse(tool.runs_code)
+
+    def test_config_is_reused_until_the_tools_change(self):
+        config = main.build_config()
+        self.assertIs(main.build_config(), config)
+        self.assertIn("count_lines", [
+            d.name for d in config.tools[0].function_declarations])
+
+        registry.unregister("count_lines")
+        new_config = main.build_config()
+        self.assertIsNot(new_config, config)
+        self.assertEqual(
+            [d.name for d in new_config.tools[0].function_declarations],
+            ["get_files_info", "get_file_content", "search_files",
+             "run_python_file", "run_tests", "write_file", "edit_file"])
+
+    def test_parameters_need_descriptions(self):
+        def untyped(working_directory, path):
+            pass
+
+        def unsupported(working_directory, path: Annotated[dict, "A path"]):
+            pass
+
+        for function in (untyped, unsupported):
+            with self.assertRaises(TypeError):
+                registry.tool("Broken")(function)
+        self.assertIsNone(registry.get("untyped"))
+
+    def test_plugins_load_through_entry_points(self):
+        class EntryPoint:
+            def __init__(self, name, load):
+                self.name = name
+                self.load = load
+
+        def load_plugin():
+            registry.tool("Counts the lines of a file")(count_lines)
+
+        def broken_plugin():
+            raise ImportError("no module named plugin")
+
+        registry.unregister("count_lines")
+        plugins = [EntryPoint("count", load_plugin), EntryPoint("broken", broken_plugin)]
+        stderr = io.StringIO()
+        with unittest.mock.patch.object(registry, "_plugins_loaded", False), \
+                unittest.mock.patch.object(registry, "_plugins_loading", False), \
+                unittest.mock.patch("importlib.metadata.entry_points",
+                                    return_value=plugins) as entry_points, \
+                unittest.mock.patch("sys.stderr", stderr):
+            self.assertIsNotNone(registry.get("count_lines"))
+            registry.tools()
+
+        entry_points.assert_called_once_with(group=registry.ENTRY_POINT_GROUP)
+        self.assertIn("could not load tool plugin 'broken'", stderr.getvalue())
+
+
+FAILING_SCRIPT = """\
+for i in range(3000):
+    print(f"progress {i}")
+def fail():
+    raise ValueError("bad input")
+fail()
+"""
+
+
+class TestResultBudget(AgentTestCase):
+    def test_allocate_gives_small_results_their_full_size(self):
+        self.assertEqual(
+            result_budget.allocate([100, 5000, 20000, 300], 8000),
+            [100, 3800, 3800, 300])
+        self.assertEqual(result_budget.allocate([50, 60], 1000), [50, 60])
+        # Every result keeps a minimum, even over a tiny budget.
+        self.assertEqual(result_budget.allocate([5000, 5000], 100), [400, 400])
+
+    def test_shape_keeps_head_and_tail_and_says_what_was_elided(self):
+        text = "\n".join(f"{i:05d} INFO handled request" for i in range(2000))
+        shaped = result_budget.shape(text, 1000)
+
+        self.assertLessEqual(len(shaped), 1000)
+        self.assertTrue(shaped.startswith("00000 INFO"))
+        self.assertTrue(shaped.endswith("01999 INFO handled request"))
+        match = re.search(r"\n\[\.\.\. lines (\d+)-(\d+) \((\d+) characters\) "
+                          r"elided to fit this turn's tool result budget \.\.\.\]\n",
+                          shaped)
+        first, last, chars = map(int, match.groups())
+        # Line numbers are 1-based; the log's own numbers start at 0.
+        self.assertEqual(shaped[:match.start()].splitlines()[-1][:5], f"{first - 2:05d}")
+        self.assertEqual(shaped[match.end():][:5], f"{last:05d}")
+        self.assertEqual(chars, len("\n".join(text.split("\n")[first - 1:last])) + 1)
+
+    def test_shape_collapses_repeated_lines(self):
+        text = "start\n" + "same line\n" * 500 + "end"
+        self.assertEqual(
+            result_budget.shape(text, 400),
+            "start\nsame line\n[... previous line repeated 499 more times ...]\nend")
+
+    def test_failed_run_keeps_its_traceback(self):
+        with open(os.path.join(self.working_directory, "fail.py"), "w") as f:
+            f.write(FAILING_SCRIPT)
+        result = run_python_file(self.working_directory, "fail.py")
+        shaped = result_budget.shape(result, 1500)
+
+        self.assertLessEqual(len(shaped), 1500)
+        self.assertTrue(shaped.startswith("Process exited with code 1"))
+        traceback = result[result.index("Traceback"):]
+        self.assertTrue(shaped.endswith(traceback))
+        self.assertIn('raise ValueError("bad input")', shaped)
+
+    def test_turn_results_fit_the_budget(self):
+        with open(os.path.join(self.working_directory, "big.log"), "w") as f:
+            f.write("".join(f"line {i}\n" for i in range(5000)))
+        with open(os.path.join(self.working_directory, "small.txt"), "w") as f:
+            f.write("small")
+        calls = [
+            call_part("get_file_content", file_path="big.log"),
+            call_part("get_file_content", file_path="small.txt"),
+            call_part("get_file_content", file_path="big.log", start_line=100,
+                      end_line=2000),
+            call_part("get_files_info"),
+        ]
+        responses = [make_response(calls), make_response([types.Part(text="ok")])]
+        client, _ = self.run_agent(responses, result_budget=6000)
+
+        results = [response["result"] for _, response in self.tool_results(client)]
+        self.assertLessEqual(sum(len(result) for result in results), 6000)
+        self.assertEqual(results[1], "small")
+        self.assertIn("elided to fit this turn's tool result budget", results[0])
+        self.assertIn("elided to fit this turn's tool result budget", results[2])
+        self.assertIn("- small.txt: file_size=5 bytes", results[3])
+
+
+PROJECT_FILES = {
+    "pkg/__init__.py": "",
+    "pkg/shapes.py": "def area(w, h):\n    return w * h\n",
+    "pkg/fmt.py": (
+        "from pkg.shapes import area\n\n"
+        "def describe(w, h):\n    return f'{area(w, h)} square units'\n"),
+    "test_pkg.py": """\
+import unittest
+from pkg.shapes import area
+from pkg.fmt import describe
+
+
+class TestArea(unittest.TestCase):
+    def test_area(self):
+        self.assertEqual(area(2, 3), 6)
+
+    def test_square(self):
+        self.assertEqual(area(4, 4), 16)
+
+
+class TestDescribe(unittest.TestCase):
+    def test_describe(self):
+        self.assertEqual(describe(2, 3), "6 square units")
+""",
+}
+
+
+class TestRunTests(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        for path, content in PROJECT_FILES.items():
+            self.write(path, content)
+
+    def write(self, path, content):
+        self.call("write_file", file_path=path, content=content)
+
+    def test_only_affected_tests_rerun(self):
+        self.assertTrue(self.call("run_tests").startswith(
+            "3 tests: 3 passed (3 run in "))
+        self.assertIn("(0 run in ", self.call("run_tests"))
+
+        self.write("pkg/fmt.py", PROJECT_FILES["pkg/fmt.py"].replace("square", "sq"))
+        summary = self.call("run_tests")
+        self.assertTrue(summary.startswith("3 tests: 2 passed, 1 failed (1 run in "))
+        self.assertIn("2 unchanged and not rerun", summary)
+        self.assertIn("FAILED: test_pkg.TestDescribe.test_describe\n", summary)
+        self.assertIn("AssertionError: '6 sq units' != '6 square units'", summary)
+
+        # describe uses area, so a change to shapes reruns every test; the
+        # failure stays reported while it isn't fixed.
+        self.write("pkg/shapes.py", "def area(w, h):\n    return h * w\n")
+        summary = self.call("run_tests")
+        self.assertIn("2 passed, 1 failed (3 run in ", summary)
+
+        self.write("pkg/fmt.py", PROJECT_FILES["pkg/fmt.py"])
+        summary = self.call("run_tests")
+        self.assertTrue(summary.startswith("3 tests: 3 passed (1 run in "))
+
+    def test_results_are_keyed_on_content(self):
+        self.call("run_tests")
+        # Rewritten with the same content: nothing to rerun.
+        self.write("pkg/shapes.py", PROJECT_FILES["pkg/shapes.py"])
+        self.assertIn("(0 run in ", self.call("run_tests"))
+        self.assertIn("(3 run in ", self.call("run_tests", rerun_all=True))
+
+    def test_import_errors_fail_the_whole_file(self):
+        self.call("run_tests")
+        self.write("pkg/fmt.py", "def describe(:\n")
+        summary = self.call("run_tests")
+        self.assertTrue(summary.startswith("1 tests: 1 error"))
+        self.assertIn("ERROR: test_pkg\n", summary)
+        self.assertIn("SyntaxError", summary)
+
+        self.write("pkg/fmt.py", PROJECT_FILES["pkg/fmt.py"])
+        self.assertTrue(self.call("run_tests").startswith(
+            "3 tests: 3 passed (3 run in "))
+
+    def test_workers_split_the_tests(self):
+        summary = self.call("run_tests", workers=2, paths=["test_pkg.py"])
+        self.assertTrue(summary.startswith("3 tests: 3 passed (3 run in "))
+        self.assertEqual(
+            self.call("run_tests", paths=["pkg"]), "No test files found")
+
+    def test_uses_the_selected_backend(self):
+        with unittest.mock.patch.object(
+                python_worker, "run", side_effect=AssertionError("forked")):
+            self.assertTrue(self.call("run_tests").startswith("3 tests: 3 passed"))
+
+        self.addCleanup(setattr, python_worker._pool, "size", python_worker._pool.size)
+        self.addCleanup(set_execution_backend, "subprocess")
+        set_execution_backend("forkserver")
+        summary = self.call("run_tests", workers=3, rerun_all=True)
+        self.assertTrue(summary.startswith("3 tests: 3 passed (3 run in "))
+        self.assertGreaterEqual(python_worker._pool.size, 3)
+
+
+class TestHistoryManager(unittest.TestCase):
+    def session(self, turns, result_chars=5000):
+        messages = [types.Content(role="user", parts=[types.Part(text="prompt")])]
+        for i in range(turns):
+            messages.append(types.Content(role="model", parts=[
+                call_part("get_file_content", file_path=f"f{i}.txt")]))
+            messages.append(types.Content(role="user", parts=[
+                types.Part.from_function_response(
+                    name="get_file_content",
+                    response={"result": f"file {i} " + "x" * result_chars},
+                )]))
+        return messages
+
+    def test_under_budget_is_unchanged(self):
+        messages = self.session(2)
+        history = HistoryManager(token_budget=100000)
+        self.assertEqual(history.compact(messages), messages)
+        self.assertEqual(history.last_tokens_saved, 0)
+
+    def test_compacts_old_results_and_keeps_pairing(self):
+        messages = self.session(6)
+        history = HistoryManager(token_budget=3000, keep_recent=2)
+        compacted = history.compact(messages)
+
+        self.assertLessEqual(
+            sum(content_chars(c) for c in compacted), 3000 * 4)
+        self.assertGreater(history.last_tokens_saved, 0)
+        # Prompt and the latest turn are sent as-is.
+        self.assertIs(compacted[0], messages[0])
+        self.assertEqual(compacted[-2:], messages[-2:])
+        # Every call still has a response with the same name, in place.
+        self.assertEqual(len(compacted), len(messages))
+        for original, sent in zip(messages, compacted):
+            self.assertEqual(
+                [(p.function_call is None, p.function_response is None)
+                 for p in original.parts],
+                [(p.function_call is None, p.function_response is None)
+                 for p in sent.parts])
+        oldest = compacted[2].parts[0].function_response
+        self.assertEqual(oldest.name, "get_file_content")
+        self.assertIn("elided", oldest.response["result"])
+        # The caller's history is never modified.
+        self.assertEqual(len(messages[2].parts[0].function_response.response["result"]), 5007)
+
+    def test_observe_calibrates_estimate(self):
+        history = HistoryManager(token_budget=1000)
+        history.compact(self.session(1, result_chars=3000))
+        history.observe(prompt_tokens=1500)
+        self.assertLess(history.chars_per_token, 3)
+
+    def test_run_agent_sends_compacted_history(self):
+        big = "y" * 20000
+        working_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, working_directory)
+        with open(os.path.join(working_directory, "big.txt"), "w") as f:
+            f.write(big)
+        responses = [
+            make_response([call_part("get_file_content", file_path="big.txt")]),
+            make_response([call_part("get_files_info")]),
+            make_response([call_part("get_files_info")]),
+            make_response([types.Part(text="done")]),
+        ]
+        client = FakeClient(responses)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main.run_agent(client, "prompt", verbose=True,
+                           working_directory=working_directory,
+                           history=HistoryManager(token_budget=1000, keep_recent=2))
+
+        last_request = client.models.requests[-1]
+        read_result = last_request[2].parts[0].function_response.response["result"]
+        self.assertLess(len(read_result), 2000)
+        self.assertIn("History tokens saved: ~", output.getvalue())
+
+
+@unittest.skipUnless(python_worker.is_available(), "needs os.fork and send_fds")
+class TestPythonWorker(AgentTestCase):
+    SCRIPTS = {
+        "ok.py": "import sys\nprint('args', sys.argv[1:])\n",
+        "fail.py": "print('before')\ndef f():\n    raise ValueError('boom')\nf()\n",
+        "exit.py": "import sys\nsys.stderr.write('bye')\nsys.exit(3)\n",
+        "imports.py": "from helper import VALUE\nprint(VALUE)\n",
+        "helper.py": "VALUE = 42\n",
+    }
+
+    def setUp(self):
+        super().setUp()
+        for name, source in self.SCRIPTS.items():
+            with open(os.path.join(self.working_directory, name), "w") as f:
+                f.write(source)
+        self.addCleanup(set_execution_backend, "subprocess")
+
+    def test_matches_subprocess_backend(self):
+        cases = [("ok.py", ["a", "b"]), ("fail.py", None), ("exit.py", None),
+                 ("imports.py", None)]
+        expected = [run_python_file(self.working_directory, *case) for case in cases]
+        set_execution_backend("forkserver")
+        actual = [run_python_file(self.working_directory, *case) for case in cases]
+        self.assertEqual(actual, expected)
+
+    def test_timeout(self):
+        command = ["python", os.path.join(self.working_directory, "slow.py")]
+        with self.assertRaises(subprocess.TimeoutExpired):
+            python_worker.run(command, cwd=self.working_directory, timeout=0.1)
+        # The worker survives a timed-out child and keeps serving.
+        result = python_worker.run(command, cwd=self.working_directory, timeout=5)
+        self.assertEqual((result.returncode, result.stdout.text()), (0, "done\n"))
+
+
+class TestOutputCapture(AgentTestCase):
+    def test_ring_buffer_keeps_head_and_tail(self):
+        data = bytes(range(256)) * 40
+        capture = output_capture.BoundedCapture(
+            "stdout", head_bytes=100, tail_bytes=300)
+        for size in (1, 7, 500, 3, 299, 301, 64, 1000):
+            capture.feed(data[:size])
+            data = data[size:] + data[:size]
+        fed = capture.total_bytes
+        self.assertEqual(capture.dropped_bytes, fed - 400)
+        self.assertEqual(len(capture.tail()), 300)
+
+        expected = bytearray()
+        data = bytes(range(256)) * 40
+        for size in (1, 7, 500, 3, 299, 301, 64, 1000):
+            expected += data[:size]
+            data = data[size:] + data[:size]
+        self.assertEqual(capture.tail(), bytes(expected[-300:]))
+
+    def test_large_output_is_truncated_with_a_note(self):
+        with open(os.path.join(self.working_directory, "loud.py"), "w") as f:
+            f.write("import sys\nsys.stdout.write('start' + 'x' * 5_000_000 + 'end')\n")
+        result = run_python_file(self.working_directory, "loud.py")
+
+        self.assertLess(len(result), 2 * (output_capture.OUTPUT_HEAD_BYTES
+                                          + output_capture.OUTPUT_TAIL_BYTES))
+        self.assertIn("STDOUT:\nstart", result)
+        self.assertTrue(result.endswith("end"))
+        self.assertIn("bytes of stdout truncated (5000008 bytes total)", result)
+
+    def test_kill_after_limit(self):
+        with open(os.path.join(self.working_directory, "forever.py"), "w") as f:
+            f.write("while True:\n    print('spam' * 100)\n")
+        output_capture.set_output_limits(kill_after_bytes=1_000_000)
+        self.addCleanup(output_capture.set_output_limits)
+
+        start = time.perf_counter()
+        result = run_python_file(self.working_directory, "forever.py")
+        self.assertLess(time.perf_counter() - start, 10)
+        self.assertIn("Process killed after writing more than 1000000 bytes to stdout", result)
+
+
+class FakeAsyncModels:
+    """Async model stub: reads a.txt once, then echoes the session's prompt."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = []
+
+    async def generate_content(self, model, contents, config):
+        self.requests.append(list(contents))
+        await asyncio.sleep(self.latency)
+        if len(contents) == 1:
+            return make_response([call_part("get_file_content", file_path="a.txt")])
+        prompt = contents[0].parts[0].text
+        file_text = contents[-1].parts[0].function_response.response["result"]
+        return make_response([types.Part(text=f"{prompt}: {file_text}")])
+
+
+class FakeAio:
+    def __init__(self, latency):
+        self.models = FakeAsyncModels(latency)
+
+
+class FakeAsyncClient:
+    def __init__(self, latency=0.1):
+        self.aio = FakeAio(latency)
+
+
+class TestGovernor(AgentTestCase):
+    def read(self, file_path="slow.py"):
+        return make_response([call_part("get_file_content", file_path=file_path)])
+
+    def assert_forced(self, client, reason):
+        final_request = client.models.requests[-1]
+        self.assertIn("Stop calling tools", final_request[-1].parts[0].text)
+        mode = client.models.configs[-1].tool_config.function_calling_config.mode
+        self.assertEqual(mode, types.FunctionCallingConfigMode.NONE)
+        self.assertIn(f"Stopping ({reason})", self.output.getvalue())
+
+    def test_repeated_calls_are_answered_until_a_write(self):
+        governor = Governor()
+        client, final_text = self.run_agent([
+            self.read(),
+            self.read(),
+            make_response([call_part(
+                "write_file", file_path="slow.py", content="print('new')\n")]),
+            self.read(),
+            make_response([types.Part(text="done")]),
+        ], governor=governor)
+
+        self.assertEqual(final_text, "done")
+        first, repeat, after_write = (
+            self.tool_results(client, turn)[0][1] for turn in (1, 2, 4))
+        self.assertNotIn("note", first)
+        self.assertEqual(repeat, {**first, "note": REPEAT_NOTE})
+        self.assertEqual(after_write, {"result": "print('new')\n"})
+        self.assertEqual(governor.stats(), {
+            "stop_reasons": {"answered": 1}, "repeats_answered": 1})
+
+    def test_scripts_always_run(self):
+        governor = Governor()
+        run = make_response([call_part("run_python_file", file_path="slow.py")])
+        client, final_text = self.run_agent(
+            [run, run, make_response([types.Part(text="done")])], governor=governor)
+
+        self.assertEqual(final_text, "done")
+        self.assertNotIn("note", self.tool_results(client, 2)[0][1])
+        self.assertEqual(governor.repeats_answered, 0)
+
+    def test_streamed_repeats_are_answered_by_the_dispatcher(self):
+        governor = Governor()
+        read = [make_chunk([call_part("get_file_content", file_path="slow.py")],
+                           usage=True)]
+        client, final_text = self.run_agent([
+            read, read, [make_chunk([types.Part(text="done")], usage=True)],
+        ], stream=True, governor=governor)
+
+        self.assertEqual(final_text, "done")
+        self.assertEqual(self.tool_results(client, 2)[0][1]["note"], REPEAT_NOTE)
+        self.assertEqual(governor.repeats_answered, 1)
+
+    def test_no_progress_forces_a_final_answer(self):
+        governor = Governor(max_stalled_turns=2)
+        client, final_text = self.run_agent([
+            self.read(),
+            self.read(),
+            self.read("missing.py"),
+            make_response([types.Part(text="stuck")]),
+        ], governor=governor)
+
+        self.assertEqual(final_text, "stuck")
+        self.assertEqual(len(client.models.requests), 4)
+        self.assert_forced(client, "no_progress")
+        self.assertEqual(governor.stop_reasons, {"no_progress": 1})
+
+    def test_token_limit_drops_calls_from_the_final_answer(self):
+        governor = Governor(max_tokens=30)
+        client, final_text = self.run_agent([
+            self.read(),
+            make_response([call_part("get_files_info")]),
+            make_response([types.Part(text="partial"), call_part("get_files_info")]),
+        ], governor=governor)
+
+        # Each response counts 15 tokens, so the third call is the last.
+        self.assertEqual(final_text, "partial")
+        self.assert_forced(client, "token_limit")
+        self.assertEqual(governor.stop_reasons, {"token_limit": 1})
+
+    def test_time_limits(self):
+        ticks = iter(range(0, 1000, 10))
+        governor = Governor(max_seconds=25, clock=lambda: next(ticks))
+        client, final_text = self.run_agent([
+            self.read(),
+            make_response([call_part("get_files_info")]),
+            make_response([types.Part(text="late")]),
+        ], governor=governor)
+        self.assertEqual(final_text, "late")
+        self.assert_forced(client, "time_limit")
+
+        governor = Governor(max_tool_seconds=0.2)
+        client, final_text = self.run_agent([
+            make_response([call_part("run_python_file", file_path="slow.py")]),
+            make_response([types.Part(text="slow")]),
+        ], governor=governor)
+        self.assertEqual(final_text, "slow")
+        self.assert_forced(client, "tool_time_limit")
+
+    def test_last_iteration_is_forced_to_answer(self):
+        governor = Governor(dedupe=False)
+        responses = [self.read() for _ in range(main.MAX_ITERATIONS - 1)]
+        client, final_text = self.run_agent(
+            responses + [make_response([types.Part(text="last")])],
+            governor=governor)
+        self.assertEqual(final_text, "last")
+        self.assert_forced(client, "max_iterations")
+        self.assertEqual(governor.stats(), {
+            "stop_reasons": {"max_iterations": 1}, "repeats_answered": 0})
+
+
+class TestBatch(AgentTestCase):
+    def run_batch(self, prompts, concurrency):
+        client = FakeAsyncClient()
+        lines = [json.dumps({"id": i, "prompt": p}) for i, p in enumerate(prompts)]
+        output = io.StringIO()
+        start = time.perf_counter()
+        asyncio.run(batch.run_batch(
+            client, lines, output, concurrency=concurrency,
+            working_directory=self.working_directory))
+        elapsed = time.perf_counter() - start
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        return client, sorted(results, key=lambda r: r["id"]), elapsed
+
+    def test_sessions_keep_separate_histories(self):
+        with open(os.path.join(self.working_directory, "a.txt"), "w") as f:
+            f.write("data")
+        prompts = [f"prompt {i}" for i in range(6)]
+        client, results, _ = self.run_batch(prompts, concurrency=3)
+
+        self.assertEqual([r["text"] for r in results],
+                         [f"{p}: data" for p in prompts])
+        for result in results:
+            self.assertEqual(result["iterations"], 2)
+            self.assertEqual(result["prompt_tokens"], 20)
+            self.assertEqual(result["response_tokens"], 10)
+        self.assertTrue(all(len(r) in (1, 3) for r in client.aio.models.requests))
+
+    def test_throughput_scales_with_concurrency(self):
+        with open(os.path.join(self.working_directory, "a.txt"), "w") as f:
+            f.write("data")
+        prompts = [f"prompt {i}" for i in range(8)]
+        _, _, serial = self.run_batch(prompts, concurrency=1)
+        _, _, concurrent = self.run_batch(prompts, concurrency=8)
+
+        self.assertGreater(serial, 1.6)
+        self.assertLess(concurrent, serial / 4)
+
+    def test_forced_answer_without_text_is_none(self):
+        class CallingModels:
+            async def generate_content(self, model, contents, config):
+                return make_response([call_part("get_files_info")])
+
+        client = FakeAsyncClient()
+        client.aio.models = CallingModels()
+        result = asyncio.run(batch.run_session(
+            client, "list", working_directory=self.working_directory,
+            governor=Governor(max_tokens=1)))
+        self.assertIsNone(result["text"])
+        self.assertEqual(result["stop_reason"], "token_limit")
+
+
+class TestServer(AgentTestCase):
+    def serve(self, scenario, latency=0.0, **kwargs):
+        """Run ``scenario(server, client)`` against a server on a free port."""
+        client = StubClient(latency)
+
+        async def run():
+            server = AgentServer(client, template=self.working_directory, **kwargs)
+            await server.start("127.0.0.1", 0)
+            try:
+                return await scenario(server, client)
+            finally:
+                await server.close()
+        return asyncio.run(run())
+
+    def test_streams_a_session_and_continues_it(self):
+        async def scenario(server, client):
+            status, headers, events = await request(
+                server.port, "POST", "/prompt", {"prompt": "first"})
+            self.assertEqual(status, 200)
+            self.assertEqual(headers["content-type"], "application/x-ndjson")
+            self.assertEqual([event["event"] for event in events],
+                             ["session", "model", "tool", "model", "done"])
+            self.assertEqual(events[1]["function_calls"], ["get_files_info"])
+            self.assertEqual(events[2]["name"], "get_files_info")
+            self.assertEqual(events[-1]["text"], "first: 1 entries")
+            session_id = events[0]["session"]
+
+            working_directory = server.sessions[session_id].working_directory
+            self.assertNotEqual(working_directory, self.working_directory)
+            self.assertTrue(os.path.exists(os.path.join(working_directory, "slow.py")))
+
+            _, _, events = await request(
+                server.port, "POST", "/prompt",
+                {"prompt": "second", "session": session_id})
+            self.assertEqual(events[-1]["text"], "second: 1 entries")
+            # The first prompt's turns were sent along with the second's.
+            self.assertEqual(len(client.aio.models.requests[-1]), 7)
+
+            _, _, other = await request(
+                server.port, "POST", "/prompt", {"prompt": "other"})
+            self.assertNotEqual(
+                server.sessions[other[0]["session"]].working_directory,
+                working_directory)
+
+            # Give the tools' per-directory state something to forget.
+            with redirect_stdout(io.StringIO()):
+                call_function(types.FunctionCall(
+                    name="search_files", args={"pattern": "sleep"}),
+                    working_directory=working_directory)
+            run_tests_module._project(os.path.abspath(working_directory))
+
+            status, _, body = await request(
+                server.port, "DELETE", f"/sessions/{session_id}")
+            self.assertEqual((status, body), (200, {"deleted": session_id}))
+            self.assertFalse(os.path.exists(working_directory))
+            self.assertNotIn(os.path.abspath(working_directory), search_files._indexes)
+            self.assertNotIn(os.path.abspath(working_directory), run_tests_module._projects)
+            _, _, health = await request(server.port, "GET", "/health")
+            self.assertEqual(health["sessions"], 1)
+            self.assertEqual(health["completed"], 3)
+        self.serve(scenario)
+
+    def test_limits_in_flight_and_rejects_overflow(self):
+        async def scenario(server, client):
+            responses = await asyncio.gather(*(
+                request(server.port, "POST", "/prompt", {"prompt": f"p{i}"})
+                for i in range(8)))
+            statuses = sorted(status for status, _, _ in responses)
+            self.assertEqual(statuses, [200] * 4 + [503] * 4)
+            for status, headers, body in responses:
+                if status == 503:
+                    self.assertEqual(headers["retry-after"], "1")
+                else:
+                    self.assertEqual(body[-1]["event"], "done")
+            self.assertEqual(client.aio.models.peak, 2)
+            _, _, health = await request(server.port, "GET", "/health")
+            self.assertEqual(
+                {key: health[key] for key in ("in_flight", "waiting", "completed", "rejected")},
+                {"in_flight": 0, "waiting": 0, "completed": 4, "rejected": 4})
+        self.serve(scenario, latency=0.05, max_in_flight=2, max_waiting=2)
+
+    def test_bad_requests(self):
+        async def scenario(server, client):
+            cases = [
+                ("GET", "/prompt", None, 405),
+                ("POST", "/prompt", [], 400),
+                ("POST", "/prompt", {"text": "hi"}, 400),
+                ("POST", "/prompt", {"prompt": "hi", "session": "nope"}, 404),
+                ("POST", "/prompt", {"prompt": "hi", "session": ["x"]}, 400),
+                ("DELETE", "/sessions/nope", None, 404),
+                ("GET", "/elsewhere", None, 404),
+            ]
+            for method, path, payload, expected in cases:
+                status, _, body = await request(server.port, method, path, payload)
+                self.assertEqual(status, expected, (method, path, payload))
+                self.assertIn("error", body)
+            self.assertEqual(server.sessions, {})
+        self.serve(scenario)
+
+    def test_bad_content_length(self):
+        async def scenario(server, client):
+            for length in ("-1", "ten"):
+                reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+                writer.write(f"POST /prompt HTTP/1.1\r\nContent-Length: {length}"
+                             "\r\n\r\n".encode("latin-1"))
+                status = await reader.readline()
+                writer.close()
+                self.assertEqual(status.split()[1], b"400", length)
+        self.serve(scenario)
+
+    def test_reports_stop_reasons(self):
+        async def scenario(server, client):
+            _, _, events = await request(
+                server.port, "POST", "/prompt", {"prompt": "first"})
+            self.assertEqual(events[-1]["stop_reason"], "answered")
+            _, _, health = await request(server.port, "GET", "/health")
+            self.assertEqual(health["stop_reasons"], {"answered": 1})
+        self.serve(scenario, governor=Governor())
+
+
+def api_error(code, retry_delay=None):
+    error = {"code": code, "message": "injected", "status": "INJECTED"}
+    if retry_delay is not None:
+        error["details"] = [{
+            "@type": "type.googleapis.com/google.rpc.RetryInfo",
+            "retryDelay": retry_delay,
+        }]
+    error_type = errors.ClientError if code < 500 else errors.ServerError
+    return error_type(code, {"error": error})
+
+
+class FlakyModels(FakeModels):
+    """FakeModels that raises the queued ``failures`` before each response."""
+
+    def __init__(self, responses, failures):
+        super().__init__(responses)
+        self.failures = list(failures)
+
+    def generate_content(self, model, contents, config):
+        if self.failures:
+            raise self.failures.pop(0)
+        return super().generate_content(model, contents, config)
+
+    def generate_content_stream(self, model, contents, config):
+        if self.failures:
+            raise self.failures.pop(0)
+        return super().generate_content_stream(model, contents, config)
+
+
+class FakeClock:
+    """A clock that only moves when something sleeps on it."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ThrottlingAsyncModels(FakeAsyncModels):
+    """FakeAsyncModels with a server-side requests/minute quota.
+
+    Time runs 1000 times faster than real time so that a test can use up
+    a per-minute quota in milliseconds. Requests over the quota fail with
+    a 429, as the API's would.
+    """
+
+    SPEEDUP = 1000.0
+
+    def __init__(self, rpm):
+        super().__init__(latency=0)
+        self.quota = TokenBucket(rpm, self.clock())
+        self.throttled = 0
+
+    @classmethod
+    def clock(cls):
+        return time.monotonic() * cls.SPEEDUP
+
+    @classmethod
+    async def sleep(cls, seconds):
+        await asyncio.sleep(seconds / cls.SPEEDUP)
+
+    async def generate_content(self, model, contents, config):
+        # Half a (sped-up) second of slack for timer granularity.
+        if self.quota.reserve(1, self.clock()) > 0.5:
+            self.quota.refund(1)
+            self.throttled += 1
+            raise api_error(429)
+        return await super().generate_content(model, contents, config)
+
+
+class TestScheduler(AgentTestCase):
+    def scheduler(self, clock, **kwargs):
+        return RequestScheduler(
+            clock=clock, sleep=clock.sleep, rng=random.Random(0), **kwargs)
+
+    def run_flaky(self, failures, scheduler, stream=False):
+        responses = [make_response([types.Part(text="answer")])]
+        if stream:
+            responses = [[make_chunk([types.Part(text="answer")], usage=True)]]
+        client = FakeClient([])
+        client.models = FlakyModels(responses, failures)
+        with redirect_stdout(io.StringIO()):
+            final_text = main.run_agent(
+                client, "prompt", working_directory=self.working_directory,
+                stream=stream, scheduler=scheduler)
+        return client, final_text
+
+    def test_retries_transient_errors_with_jittered_backoff(self):
+        clock = FakeClock()
+        scheduler = self.scheduler(clock, base_delay=1.0, max_delay=3.0)
+        failures = [api_error(503), api_error(500), ConnectionError("reset"),
+                    api_error(429)]
+        client, final_text = self.run_flaky(failures, scheduler)
+
+        self.assertEqual(final_text, "answer")
+        self.assertEqual(scheduler.retries, 4)
+        self.assertEqual(len(clock.sleeps), 4)
+        for attempt, delay in enumerate(clock.sleeps):
+            self.assertLessEqual(delay, min(3.0, 2 ** attempt))
+            self.assertGreaterEqual(delay, 0)
+        self.assertEqual(len(set(clock.sleeps)), 4)
+
+    def test_honors_server_retry_delay(self):
+        clock = FakeClock()
+        scheduler = self.scheduler(clock, base_delay=0.1)
+        _, final_text = self.run_flaky([api_error(429, retry_delay="7s")], scheduler)
+
+        self.assertEqual(final_text, "answer")
+        self.assertEqual(clock.sleeps, [7.0])
+
+    def test_gives_up_after_max_retries(self):
+        clock = FakeClock()
+        scheduler = self.scheduler(clock, max_retries=2)
+        with self.assertRaises(errors.ServerError):
+            self.run_flaky([api_error(503)] * 3, scheduler)
+        self.assertEqual(len(clock.sleeps), 2)
+
+    def test_client_errors_are_not_retried(self):
+        clock = FakeClock()
+        scheduler = self.scheduler(clock)
+        with self.assertRaises(errors.ClientError):
+            self.run_flaky([api_error(400)], scheduler)
+        self.assertEqual(clock.sleeps, [])
+
+    def test_streamed_request_is_retried_before_the_first_chunk(self):
+        clock = FakeClock()
+        scheduler = self.scheduler(clock)
+        _, final_text = self.run_flaky([api_error(503)], scheduler, stream=True)
+
+        self.assertEqual(final_text, "answer")
+        self.assertEqual(scheduler.retries, 1)
+
+    def test_buckets_space_out_requests(self):
+        clock = FakeClock()
+        scheduler = self.scheduler(clock, rpm=2)
+        for _ in range(4):
+            scheduler.call(lambda: None)
+
+        # Two requests fit in the first minute; then one every 30 seconds.
+        self.assertEqual(clock.sleeps, [30.0, 30.0])
+
+    def test_token_estimate_follows_usage_metadata(self):
+        clock = FakeClock()
+        scheduler = self.scheduler(clock, tpm=1000)
+        response = make_response([], prompt_tokens=100, response_tokens=300)
+        for _ in range(20):
+            scheduler.call(lambda: response, prompt_chars=400)
+
+        self.assertAlmostEqual(scheduler.chars_per_token, 4.0)
+        self.assertGreater(scheduler.response_tokens, 250)
+        # 8000 tokens against 1000 a minute, less the first minute's 1000.
+        self.assertAlmostEqual(clock.now, 420, delta=30)
+
+    def test_token_estimate_learns_chars_per_token(self):
+        scheduler = self.scheduler(FakeClock())
+        response = make_response([], prompt_tokens=200, response_tokens=10)
+        for _ in range(30):
+            scheduler.call(lambda: response, prompt_chars=400)
+
+        self.assertAlmostEqual(scheduler.chars_per_token, 2.0)
+        self.assertAlmostEqual(scheduler.response_tokens, 10, delta=0.1)
+
+    def run_throttled_batch(self, scheduler):
+        with open(os.path.join(self.working_directory, "a.txt"), "w") as f:
+            f.write("data")
+        client = FakeAsyncClient()
+        client.aio.models = ThrottlingAsyncModels(rpm=6)
+        lines = [json.dumps(f"prompt {i}") for i in range(8)]
+        output = io.StringIO()
+        asyncio.run(batch.run_batch(
+            client, lines, output, concurrency=8,
+            working_directory=self.working_directory, scheduler=scheduler))
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        return client.aio.models, results
+
+    def test_shared_limits_keep_sessions_under_the_quota(self):
+        scheduler = RequestScheduler(
+            rpm=6, clock=ThrottlingAsyncModels.clock,
+            async_sleep=ThrottlingAsyncModels.sleep)
+        models, results = self.run_throttled_batch(scheduler)
+
+        self.assertEqual(models.throttled, 0)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(r["text"] == f"prompt {r['id'] - 1}: data" for r in results))
+
+    def test_unlimited_sessions_are_throttled_and_retried(self):
+        scheduler = RequestScheduler(
+            base_delay=5.0, clock=ThrottlingAsyncModels.clock,
+            async_sleep=ThrottlingAsyncModels.sleep, max_retries=20)
+        models, results = self.run_throttled_batch(scheduler)
+
+        self.assertGreater(models.throttled, 0)
+        self.assertEqual(scheduler.retries, models.throttled)
+        self.assertTrue(all(r["text"] is not None for r in results))
+
+
+class FakeCaches:
+    """Stands in for client.caches, the explicit context caching endpoints.
+
+    A cache's size is estimated at four characters a token.
+    """
+
+    def __init__(self):
+        self.tokens = {}
+        self.created = []
+        self.updated = []
+
+    def create(self, model, config):
+        chars = len(config.system_instruction or "") + sum(
+            len(json.dumps(tool.model_dump(mode="json", exclude_none=True)))
+            for tool in config.tools or [])
+        chars += sum(content_chars(content) for content in config.contents or [])
+        name = f"cachedContents/{len(self.created) + 1}"
+        self.tokens[name] = chars // 4
+        self.created.append(config)
+        return types.CachedContent(
+            name=name, model=model,
+            usage_metadata=types.CachedContentUsageMetadata(
+                total_token_count=self.tokens[name]))
+
+    def update(self, name, config):
+        if name not in self.tokens:
+            raise api_error(404)
+        self.updated.append(name)
+        return types.CachedContent(name=name)
+
+
+class CachingModels(FakeModels):
+    """FakeModels that resolves cached_content against a FakeCaches."""
+
+    def __init__(self, responses, caches):
+        super().__init__(responses)
+        self.caches = caches
+        self.configs = []
+
+    def generate_content(self, model, contents, config):
+        self.configs.append(config)
+        response = super().generate_content(model, contents, config)
+        if config.cached_content is not None:
+            if config.system_instruction is not None or config.tools is not None:
+                raise api_error(400)
+            response.usage_metadata.cached_content_token_count = (
+                self.caches.tokens[config.cached_content])
+        return response
+
+
+class CachingClient:
+    def __init__(self, responses, caches=None):
+        self.caches = caches or FakeCaches()
+        self.models = CachingModels(responses, self.caches)
+
+
+class SessionTestCase(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session_dir = os.path.join(self.working_directory, ".sessions")
+        with open(os.path.join(self.working_directory, "a.txt"), "w") as f:
+            f.write("contents")
+
+    def turns(self, final_text="done"):
+        return [
+            make_response([call_part("get_file_content", file_path="a.txt")]),
+            make_response([types.Part(text=final_text)]),
+        ]
+
+    def dump(self, contents):
+        return [content.model_dump(mode="json", exclude_none=True)
+                for content in contents]
+
+
+class TestSessions(SessionTestCase):
+    def test_resume_continues_the_conversation(self):
+        session = Session.create(self.session_dir)
+        client, _ = self.run_agent(self.turns("It says contents."), session=session)
+
+        loaded = Session.load(session.id, self.session_dir)
+        history = client.models.requests[-1] + [
+            types.Content(role="model", parts=[types.Part(text="It says contents.")])]
+        self.assertEqual(self.dump(loaded.messages), self.dump(history))
+
+        client, final_text = self.run_agent(
+            [make_response([types.Part(text="Yes.")])], session=loaded)
+        self.assertEqual(final_text, "Yes.")
+        sent = client.models.requests[0]
+        self.assertEqual(self.dump(sent[:-1]), self.dump(history))
+        self.assertEqual(sent[-1].parts[0].text, "prompt")
+        self.assertEqual(len(Session.load("last", self.session_dir).messages), 6)
+
+    def test_saves_append_only_new_messages(self):
+        session = Session.create(self.session_dir)
+        self.run_agent(self.turns(), session=session)
+        with gzip.open(session.path, "rt") as f:
+            self.assertEqual(len(f.readlines()), 4)
+
+        self.run_agent([make_response([types.Part(text="again")])],
+                       session=Session.load(session.path))
+        with gzip.open(session.path, "rt") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 6)
+        self.assertEqual(records[4]["content"]["parts"][0]["text"], "prompt")
+
+    def test_missing_session(self):
+        with self.assertRaises(FileNotFoundError):
+            Session.load("nope", self.session_dir)
+        with self.assertRaises(FileNotFoundError):
+            Session.load("last", self.session_dir)
+
+
+class TestContextCache(SessionTestCase):
+    def run_cached(self, responses, caches=None, **kwargs):
+        client = CachingClient(responses, caches)
+        context_cache = ContextCache(client, main.MODEL)
+        with redirect_stdout(io.StringIO()):
+            final_text = main.run_agent(
+                client, "prompt", working_directory=self.working_directory,
+                context_cache=context_cache, **kwargs)
+        return client, context_cache, final_text
+
+    def test_requests_send_only_the_suffix(self):
+        pinned = [main.pinned_content(os.path.join(self.working_directory, "a.txt"))]
+        client, context_cache, final_text = self.run_cached(
+            self.turns(), pinned=pinned)
+
+        self.assertEqual(final_text, "done")
+        (created,) = client.caches.created
+        self.assertEqual(created.system_instruction, main.system_prompt)
+        self.assertEqual(self.dump(created.contents), self.dump(pinned))
+        for config in client.models.configs:
+            self.assertEqual(config.cached_content, "cachedContents/1")
+        # The pinned file is not resent; only this run's turns are.
+        self.assertEqual(len(client.models.requests[0]), 1)
+        self.assertEqual(client.models.requests[0][0].parts[0].text, "prompt")
+        self.assertEqual(len(client.models.requests[1]), 3)
+
+        tokens = client.caches.tokens["cachedContents/1"]
+        self.assertGreater(tokens, 1024)
+        self.assertEqual(context_cache.tokens_saved, 2 * tokens)
+        self.assertIn(f"{2 * tokens} prompt tokens served from it over 2 requests",
+                      context_cache.summary())
+
+    def test_resume_reuses_the_handle(self):
+        session = Session.create(self.session_dir)
+        client, _, _ = self.run_cached(self.turns(), session=session)
+
+        loaded = Session.load(session.id, self.session_dir)
+        self.assertEqual(loaded.context_cache["name"], "cachedContents/1")
+        client, context_cache, _ = self.run_cached(
+            [make_response([types.Part(text="Yes.")])], caches=client.caches,
+            session=loaded)
+
+        self.assertEqual(len(client.caches.created), 1)
+        self.assertEqual(client.caches.updated, ["cachedContents/1"])
+        self.assertEqual(client.models.configs[0].cached_content, "cachedContents/1")
+        self.assertIn("reused", context_cache.summary())
+
+        # Once the handle is gone, a new one covers the history too.
+        del client.caches.tokens["cachedContents/1"]
+        client, context_cache, _ = self.run_cached(
+            [make_response([types.Part(text="Again.")])], caches=client.caches,
+            session=Session.load(session.id, self.session_dir))
+        self.assertEqual(len(client.caches.created[-1].contents), 6)
+        self.assertEqual(len(client.models.requests[0]), 1)
+        self.assertEqual(
+            Session.load(session.id, self.session_dir).context_cache["name"],
+            "cachedContents/2")
+
+    def test_history_budget_keeps_pinned_and_cached_contents(self):
+        pinned = [main.pinned_content(os.path.join(self.working_directory, "a.txt"))]
+        client, _ = self.run_agent(
+            self.turns(), pinned=pinned, history=HistoryManager(token_budget=1))
+        self.assertEqual(
+            [content.parts[0].text for content in client.models.requests[0]],
+            [pinned[0].parts[0].text, "prompt"])
+
+        client, _, _ = self.run_cached(
+            self.turns(), pinned=pinned, history=HistoryManager(token_budget=1))
+        # Compacting doesn't bring back what the cache holds.
+        self.assertEqual(len(client.models.requests[0]), 1)
+        self.assertEqual(client.models.requests[0][0].parts[0].text, "prompt")
+        self.assertEqual(len(client.models.requests[1]), 3)
+
+    def test_forced_answer_goes_without_the_cache(self):
+        session = Session.create(self.session_dir)
+        client, _, final_text = self.run_cached(
+            [self.turns()[0], make_response([call_part("get_files_info")])],
+            governor=Governor(max_tokens=1), session=session)
+
+        # Function calling can only be turned off outside the cache.
+        final = client.models.configs[-1]
+        self.assertIsNone(final.cached_content)
+        self.assertEqual(final.system_instruction, main.system_prompt)
+        self.assertEqual(final.tool_config.function_calling_config.mode,
+                         types.FunctionCallingConfigMode.NONE)
+        self.assertEqual(len(client.models.requests[-1]), 4)
+        # A final response without text is no answer.
+        self.assertIsNone(final_text)
+
+        # The request to stop isn't part of the saved conversation.
+        messages = Session.load(session.id, self.session_dir).messages
+        self.assertEqual(len(messages), 3)
+        self.assertFalse(any("Stop calling tools" in (part.text or "")
+                             for content in messages for part in content.parts))
+
+    def test_small_prefix_is_sent_uncached(self):
+        client = CachingClient([make_response([types.Part(text="ok")])])
+        context_cache = ContextCache(client, main.MODEL, min_tokens=10**6)
+        with redirect_stdout(io.StringIO()):
+            main.run_agent(client, "prompt", context_cache=context_cache,
+                           working_directory=self.working_directory)
+
+        self.assertEqual(client.caches.created, [])
+        self.assertIsNotNone(client.models.configs[0].system_instruction)
+        self.assertEqual(context_cache.summary(), "Context cache: not used")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Tracer:
+    """Record the spans of agent runs and summarize them.
+
+    Each span (a model call, a tool call, or the history size at the start
+    of an iteration) is appended to ``path`` as one JSON line if a path is
+    given, and folded into the per-span timings that ``summary`` reports.
+    Callers only build spans when a tracer is passed in, so tracing costs
+    nothing when it is off.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.iterations = 0
+        self.history_sizes = []  # (messages, chars, sent_chars) per iteration
+        self._durations = defaultdict(list)
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._file = None if path is None else open(path, "a", encoding="utf-8")
+
+    def record(self, span, **fields):
+        entry = {"ts": round(time.time(), 6), "span": span, **fields}
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(entry, default=str) + "\n")
+            if "seconds" in fields:
+                name = fields.get("name", span)
+                self._durations[name].append(fields["seconds"])
+
+    def model_call(self, iteration, seconds, prompt_tokens, response_tokens):
+        with self._lock:
+            self.prompt_tokens += prompt_tokens or 0
+            self.response_tokens += response_tokens or 0
+        self.record("model", iteration=iteration, seconds=seconds,
+                    prompt_tokens=prompt_tokens, response_tokens=response_tokens)
+
+    def tool_call(self, iteration, function_call, response, seconds):
+        self.record(
+            "tool",
+            iteration=iteration,
+            name=function_call.name,
+            args_chars=len(json.dumps(function_call.args or {}, default=str)),
+            result_chars=len(json.dumps(response, default=str)),
+            seconds=seconds,
+        )
+
+    def history(self, iteration, messages, chars, sent_chars):
+        with self._lock:
+            self.iterations += 1
+            self.history_sizes.append((messages, chars, sent_chars))
+        self.record("history", iteration=iteration, messages=messages,
+                    chars=chars, sent_chars=sent_chars)
+
+    def durations(self):
+        """Return {span or tool name: [seconds, ...]} recorded so far."""
+        with self._lock:
+            return {name: list(values) for name, values in self._durations.items()}
+
+    def summary(self):
+        """Return a table of p50/p95 per span plus token totals."""
+        durations = self.durations()
+        wall = time.perf_counter() - self._started
+        lines = [
+            f"Trace summary: {self.iterations} iterations in {wall:.2f}s",
+            f"{'span':<20}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}",
+        ]
+        # The model first, then tools by the time they took overall.
+        names = sorted(durations, key=lambda name: (name != "model", -sum(durations[name])))
+        for name in names:
+            values = durations[name]
+            lines.append(
+                f"{name:<20}{len(values):>7}"
+                f"{percentile(values, 0.5) * 1000:>10.1f}"
+                f"{percentile(values, 0.95) * 1000:>10.1f}"
+                f"{sum(values):>10.2f}"
+            )
+        lines.append(
+            f"Tokens: {self.prompt_tokens} prompt + {self.response_tokens} response"
+            f" = {self.prompt_tokens + self.response_tokens} total")
+        return "\n".join(lines)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None